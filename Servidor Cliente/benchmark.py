@@ -0,0 +1,392 @@
+# benchmark.py
+#
+# Benchmark reproducible de la API de contactos. Crea una base con datos
+# sintéticos, ejecuta cada ruta con la concurrencia pedida y escribe los
+# resultados (rendimiento y latencias p50/p95/p99) en JSON para comparar corridas.
+#
+# Ejemplos:
+#   python benchmark.py --rows 100000 --concurrency 8 --output base.json
+#   python benchmark.py --rows 100000 --mode server --workers 4 --compare base.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import servidor
+
+CALLES = ('San Martín', 'Belgrano', 'Rivadavia', 'Sarmiento', 'Mitre', 'Corrientes',
+          'Santa Fe', 'Córdoba', 'Libertador', 'Alem', 'Moreno', 'Lavalle')
+APELLIDOS = ('González', 'Rodríguez', 'Gómez', 'Fernández', 'López', 'Díaz', 'Martínez',
+             'Pérez', 'García', 'Sánchez', 'Romero', 'Sosa', 'Álvarez', 'Torres')
+
+# Cantidad de pedidos por escenario cuando no se indica otra cosa. Exportar e
+# importar mueven mucho más que un pedido común, por eso usan menos.
+REQUESTS_POR_ESCENARIO = {
+    'list_page': 500,
+    'list_all': 5,
+    'search': 500,
+    'fuzzy': 500,
+    'create': 300,
+    'update': 300,
+    'delete': 300,
+    'export': 3,
+    'import': 5,
+    'report': 500,
+}
+
+# Filas del CSV enviado en cada pedido del escenario de importación
+FILAS_POR_IMPORTACION = 1000
+
+# El listado completo sin paginar se omite en bases más grandes que esto
+MAX_FILAS_LIST_ALL = 200000
+
+
+# El nombre depende sólo de `i`, así los escenarios pueden reconstruir nombres
+# existentes sin leer la base
+def nombre_sintetico(i):
+    return f'{APELLIDOS[(i * 7919) % len(APELLIDOS)]} {i:07d}'
+
+
+def contacto_sintetico(i, rng):
+    nombre = nombre_sintetico(i)
+    telefono = f'+54 11 {i:08d}'
+    direccion = f'{rng.choice(CALLES)} {rng.randint(1, 9999)}'
+    return nombre, telefono, direccion, servidor.normalizar_telefono(telefono)
+
+
+# Crea una base nueva con `filas` contactos sintéticos. Primero se aplican las
+# migraciones sobre la base vacía y después se insertan los datos con el índice de
+# búsqueda en pausa, como hace /import, para no indexar fila por fila.
+def sembrar_base(path, filas, seed=42):
+    for sufijo in ('', '-wal', '-shm'):
+        if os.path.exists(path + sufijo):
+            os.remove(path + sufijo)
+
+    servidor.DATABASE_PATH = path
+    servidor.REPORTS_DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(path)), 'reports.db')
+    servidor.init_db(en_segundo_plano=False)
+    agenda = servidor.agenda_principal()
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    if agenda.fts_disponible:
+        cursor.execute('INSERT INTO contactos_fts_pausa (activa) VALUES (1)')
+    lote = 50000
+    for inicio in range(0, filas, lote):
+        cursor.executemany(servidor.INSERT_CONTACTO_SQL,
+                           (contacto_sintetico(i, rng) for i in range(inicio, min(inicio + lote, filas))))
+    if agenda.fts_disponible:
+        servidor.indexar_contactos_desde(cursor, 0)
+        cursor.execute('DELETE FROM contactos_fts_pausa')
+    if agenda.busqueda_aproximada_disponible:
+        servidor.indexar_claves_pendientes(cursor)
+    conn.commit()
+    conn.close()
+
+
+def percentil(ordenadas, p):
+    if not ordenadas:
+        return None
+    indice = min(len(ordenadas) - 1, int(round(p / 100 * (len(ordenadas) - 1))))
+    return ordenadas[indice]
+
+
+# Cliente HTTP mínimo con la misma interfaz para el test client de Flask y para
+# un servidor real: request(method, path, **kwargs) -> código de estado.
+class ClienteTest:
+    def __init__(self):
+        self.client = servidor.app.test_client()
+
+    def request(self, method, path, params=None, json_body=None, data=None, headers=None):
+        respuesta = self.client.open(path, method=method, query_string=params, json=json_body,
+                                     data=data, headers=headers)
+        respuesta.get_data()  # consume también las respuestas por streaming
+        respuesta.close()  # como un servidor WSGI: libera la conexión de /export
+        return respuesta.status_code
+
+
+class ClienteHTTP:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, path, params=None, json_body=None, data=None, headers=None):
+        respuesta = self.session.request(method, f'{self.base_url}{path}', params=params, json=json_body,
+                                         data=data, headers=headers, timeout=300)
+        respuesta.content  # descarga el cuerpo completo
+        return respuesta.status_code
+
+
+# Genera los pedidos de cada escenario. Cada hilo tiene su propio generador para
+# no compartir estado; los nombres nuevos llevan el número de hilo para que
+# no choquen entre sí.
+class Escenarios:
+    def __init__(self, filas, seed):
+        self.filas = filas
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._creados = []
+
+    def nombre_existente(self, rng):
+        return nombre_sintetico(rng.randrange(self.filas))
+
+    def list_page(self, cliente, rng, hilo, n):
+        nombre = self.nombre_existente(rng)
+        cursor = servidor.codificar_cursor(nombre, nombre)
+        return cliente.request('GET', '/contacts', params={'limit': 100, 'cursor': cursor})
+
+    def list_all(self, cliente, rng, hilo, n):
+        return cliente.request('GET', '/contacts')
+
+    def search(self, cliente, rng, hilo, n):
+        termino = rng.choice((rng.choice(APELLIDOS)[:4], f'{rng.randrange(10 ** 6):06d}', rng.choice(CALLES)))
+        return cliente.request('GET', '/contacts', params={'query': termino, 'limit': 50})
+
+    # Un nombre existente sin acentos y con una letra del apellido cambiada
+    def fuzzy(self, cliente, rng, hilo, n):
+        apellido, numero = servidor.plegar_texto(self.nombre_existente(rng)).split()
+        posicion = rng.randrange(len(apellido))
+        termino = f'{apellido[:posicion]}{rng.choice("aeiousz")}{apellido[posicion + 1:]} {numero}'
+        return cliente.request('GET', '/contacts', params={'query': termino, 'mode': 'fuzzy', 'limit': 10})
+
+    def create(self, cliente, rng, hilo, n):
+        nombre = f'Bench {self.seed}-{hilo}-{n}'
+        status = cliente.request('POST', '/contacts', json_body={
+            'nombre': nombre, 'telefono': f'+1 {self.seed}{hilo:03d}{n:07d}', 'direccion': 'Calle Falsa 123'})
+        if status == 201:
+            with self._lock:
+                self._creados.append(nombre)
+        return status
+
+    def update(self, cliente, rng, hilo, n):
+        nombre = self.nombre_existente(rng)
+        return cliente.request('PUT', f'/contacts/{nombre}', json_body={'direccion': f'Nueva {n}'})
+
+    def delete(self, cliente, rng, hilo, n):
+        with self._lock:
+            nombre = self._creados.pop() if self._creados else None
+        if nombre is None:
+            return 404
+        return cliente.request('DELETE', f'/contacts/{nombre}')
+
+    def export(self, cliente, rng, hilo, n):
+        return cliente.request('GET', '/export', headers={'Accept-Encoding': 'identity'})
+
+    def import_(self, cliente, rng, hilo, n):
+        lineas = ['nombre,telefono,direccion']
+        for i in range(FILAS_POR_IMPORTACION):
+            lineas.append(f'Import {self.seed}-{hilo}-{n}-{i},+2 {hilo:03d}{n:05d}{i:05d},Calle {i}')
+        return cliente.request('POST', '/import', data='\n'.join(lineas).encode('utf-8'),
+                               headers={'Content-Type': 'text/csv'})
+
+    # Cada cuarto pedido lee la lista de reportes pendientes en lugar de enviar uno
+    def report(self, cliente, rng, hilo, n):
+        if n % 4 == 3:
+            return cliente.request('GET', '/reports', params={'status': 'pending', 'limit': 100})
+        return cliente.request('POST', '/enviar_mensaje', json_body={'mensaje': f'Reporte {hilo}-{n}: ' + 'x' * 200})
+
+    def funcion(self, nombre):
+        return getattr(self, 'import_' if nombre == 'import' else nombre)
+
+
+# Ejecuta `total` pedidos de un escenario repartidos en `concurrencia` hilos y
+# devuelve rendimiento y percentiles de latencia.
+def ejecutar_escenario(funcion, crear_cliente, total, concurrencia, seed):
+    latencias = []
+    errores = 0
+    lock = threading.Lock()
+    por_hilo = [total // concurrencia + (1 if i < total % concurrencia else 0) for i in range(concurrencia)]
+
+    def trabajador(hilo):
+        nonlocal errores
+        cliente = crear_cliente()
+        rng = random.Random(seed * 1000 + hilo)
+        propias = []
+        fallidas = 0
+        for n in range(por_hilo[hilo]):
+            inicio = time.perf_counter()
+            try:
+                status = funcion(cliente, rng, hilo, n)
+            except Exception:
+                status = None
+            propias.append(time.perf_counter() - inicio)
+            if status is None or status >= 500:
+                fallidas += 1
+        with lock:
+            latencias.extend(propias)
+            errores += fallidas
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(trabajador, range(concurrencia)))
+    segundos = time.perf_counter() - inicio
+
+    latencias.sort()
+    ms = lambda valor: round(valor * 1000, 3) if valor is not None else None
+    return {
+        'requests': len(latencias),
+        'errors': errores,
+        'seconds': round(segundos, 3),
+        'throughput_rps': round(len(latencias) / segundos, 2) if segundos else None,
+        'p50_ms': ms(percentil(latencias, 50)),
+        'p95_ms': ms(percentil(latencias, 95)),
+        'p99_ms': ms(percentil(latencias, 99)),
+        'max_ms': ms(latencias[-1] if latencias else None),
+    }
+
+
+# Levanta servidor.py en otro proceso sobre la base sembrada y espera a /ready
+def iniciar_servidor(directorio, port, workers, threads):
+    script = Path(__file__).parent / 'servidor.py'
+    proceso = subprocess.Popen(
+        [sys.executable, str(script), '--port', str(port), '--workers', str(workers), '--threads', str(threads)],
+        cwd=directorio, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError('El servidor terminó antes de estar listo')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1) as respuesta:
+                if respuesta.status == 200:
+                    return proceso
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.1)
+    proceso.terminate()
+    raise RuntimeError('El servidor no respondió a tiempo')
+
+
+def detener_servidor(proceso, port):
+    try:
+        urllib.request.urlopen(urllib.request.Request(f'http://127.0.0.1:{port}/shutdown', method='POST'), timeout=5)
+    except (urllib.error.URLError, OSError):
+        pass
+    try:
+        proceso.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proceso.terminate()
+
+
+# Compara dos resultados y devuelve los escenarios que empeoraron más que `umbral`
+# (0.2 = 20 %) en p95 o en rendimiento.
+def comparar(actual, anterior, umbral):
+    regresiones = []
+    for nombre, resultado in actual['scenarios'].items():
+        previo = anterior.get('scenarios', {}).get(nombre)
+        if not previo:
+            continue
+        if previo.get('p95_ms') and resultado['p95_ms'] > previo['p95_ms'] * (1 + umbral):
+            regresiones.append(f"{nombre}: p95 {previo['p95_ms']} ms -> {resultado['p95_ms']} ms")
+        if previo.get('throughput_rps') and resultado['throughput_rps'] < previo['throughput_rps'] * (1 - umbral):
+            regresiones.append(f"{nombre}: rendimiento {previo['throughput_rps']} -> {resultado['throughput_rps']} req/s")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de la API de contactos')
+    parser.add_argument('--rows', type=int, default=10000, help='contactos sintéticos en la base (10k a 5M)')
+    parser.add_argument('--concurrency', type=int, default=4, help='hilos que envían pedidos a la vez')
+    parser.add_argument('--mode', choices=('test-client', 'server'), default='test-client',
+                        help='test client de Flask en el mismo proceso, o servidor.py real en otro proceso')
+    parser.add_argument('--scenarios', default=','.join(REQUESTS_POR_ESCENARIO),
+                        help='escenarios a ejecutar, separados por comas')
+    parser.add_argument('--requests', type=int, help='pedidos por escenario (reemplaza los valores por defecto)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help='ruta de la base a crear (por defecto, un directorio temporal)')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--workers', type=int, default=1, help='procesos del servidor en modo server')
+    parser.add_argument('--threads', type=int, default=8, help='hilos por proceso en modo server')
+    parser.add_argument('--output', help='archivo JSON donde guardar los resultados')
+    parser.add_argument('--compare', help='resultado JSON anterior para detectar regresiones')
+    parser.add_argument('--threshold', type=float, default=0.2, help='tolerancia para --compare (0.2 = 20 %%)')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix='contacts-bench-') if not args.db else None
+    db_path = args.db or os.path.join(directorio, 'contacts.db')
+
+    inicio = time.perf_counter()
+    sembrar_base(db_path, args.rows, args.seed)
+    segundos_siembra = time.perf_counter() - inicio
+    print(f'Base sembrada con {args.rows} contactos en {segundos_siembra:.1f} s: {db_path}', file=sys.stderr)
+
+    proceso = None
+    if args.mode == 'server':
+        directorio_db = os.path.dirname(os.path.abspath(db_path))
+        if os.path.basename(db_path) != 'contacts.db':
+            raise SystemExit('En modo server la base debe llamarse contacts.db (servidor.py la abre por ese nombre)')
+        proceso = iniciar_servidor(directorio_db, args.port, args.workers, args.threads)
+        crear_cliente = lambda: ClienteHTTP(f'http://127.0.0.1:{args.port}')
+    else:
+        crear_cliente = ClienteTest
+
+    escenarios = Escenarios(args.rows, args.seed)
+    resultados = {}
+    try:
+        for nombre in [e.strip() for e in args.scenarios.split(',') if e.strip()]:
+            if nombre not in REQUESTS_POR_ESCENARIO:
+                raise SystemExit(f'Escenario desconocido: {nombre}')
+            if nombre == 'list_all' and args.rows > MAX_FILAS_LIST_ALL:
+                print(f'Se omite list_all: la base tiene más de {MAX_FILAS_LIST_ALL} filas', file=sys.stderr)
+                continue
+            total = args.requests or REQUESTS_POR_ESCENARIO[nombre]
+            concurrencia = max(1, min(args.concurrency, total))
+            resultados[nombre] = ejecutar_escenario(escenarios.funcion(nombre), crear_cliente, total,
+                                                    concurrencia, args.seed)
+            print(f"{nombre:10s} {resultados[nombre]['throughput_rps']:>10} req/s  "
+                  f"p50 {resultados[nombre]['p50_ms']} ms  p95 {resultados[nombre]['p95_ms']} ms  "
+                  f"p99 {resultados[nombre]['p99_ms']} ms", file=sys.stderr)
+    finally:
+        if proceso is not None:
+            detener_servidor(proceso, args.port)
+
+    salida = {
+        'meta': {
+            'rows': args.rows,
+            'concurrency': args.concurrency,
+            'mode': args.mode,
+            'workers': args.workers if args.mode == 'server' else None,
+            'threads': args.threads if args.mode == 'server' else None,
+            'seed': args.seed,
+            'seed_seconds': round(segundos_siembra, 3),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'scenarios': resultados,
+    }
+    texto = json.dumps(salida, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(texto, encoding='utf-8')
+    else:
+        print(texto)
+
+    if directorio:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    if args.compare:
+        anterior = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        regresiones = comparar(salida, anterior, args.threshold)
+        for regresion in regresiones:
+            print(f'REGRESIÓN {regresion}', file=sys.stderr)
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,723 @@
 # cliente.py
 
+import time
+# Momento en que empieza a cargarse el módulo: origen de la medición del arranque
+_IMPORT_START = time.perf_counter()
+
 import sys
 import requests
 import os
 import csv
+import hashlib
+import io
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLineEdit,
                              QPushButton, QHBoxLayout, QTextEdit, QDialog,
-                             QLabel, QMessageBox, QTableWidget, QTableWidgetItem,
-                             QHeaderView, QFileDialog)
-from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
-from PyQt6.QtMultimediaWidgets import QVideoWidget
-from PyQt6.QtCore import QUrl, QFile, QTextStream
+                             QLabel, QMessageBox, QTableView, QAbstractItemView,
+                             QHeaderView, QFileDialog, QProgressDialog, QProgressBar)
+from PyQt6.QtCore import (Qt, QUrl, QFile, QTextStream, QObject, QRunnable,
+                          QThreadPool, pyqtSignal, QAbstractTableModel, QModelIndex,
+                          QSortFilterProxyModel, QTimer)
 from PyQt6.QtGui import QCloseEvent
 
+# Opcional: con MessagePack las listas de contactos llegan en binario y se decodifican más rápido
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Cantidad de mediciones de tiempo que se guardan por endpoint
+TIMING_SAMPLES = 500
+
+# Cantidad de respuestas GET que se guardan con su ETag para pedirlas con If-None-Match
+ETAG_CACHE_SIZE = 64
+
+# Milisegundos sin escribir antes de mandar la búsqueda al servidor
+SEARCH_DEBOUNCE_MS = 300
+
+# Milisegundos entre consultas del estado del servidor mientras arranca (ver run_client)
+READY_POLL_MS = 100
+
+# Formatos de lista de contactos que entiende el cliente, del más compacto al más
+# verboso. El servidor elige el mejor que soporte (ver formato_preferido en servidor.py).
+FORMAT_COLUMNAR = 'application/vnd.contactos.columnar+json'
+FORMAT_MSGPACK = 'application/msgpack'
+ACCEPT_CONTACTS = ', '.join(([FORMAT_MSGPACK] if msgpack else [])
+                            + [f'{FORMAT_COLUMNAR};q=0.9', 'application/json;q=0.5'])
+
+# Si está activo, al terminar el arranque se imprime cuánto tardó cada fase
+STARTUP_TIMING = os.environ.get('CONTACTS_STARTUP_TIMING', '') not in ('', '0')
+
+class StartupTimer:
+    """Mide el arranque del cliente por fases.
+
+    Cada mark() guarda el tiempo transcurrido desde la marca anterior; finish()
+    cierra la medición con la llegada de los primeros datos.
+    """
+    def __init__(self, origin):
+        self.origin = origin
+        self.phases = []  # (fase, segundos)
+        self.finished = False
+        self._last = origin
+
+    def extend_back(self, origin, phase):
+        """Adelanta el origen (por ejemplo al inicio de main.py) con una fase previa."""
+        self.phases.insert(0, (phase, self.origin - origin))
+        self.origin = origin
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def finish(self, phase):
+        if self.finished:
+            return
+        self.mark(phase)
+        self.finished = True
+        if STARTUP_TIMING:
+            print(self.summary(), file=sys.stderr)
+
+    def summary(self):
+        phases = ', '.join(f'{phase} {seconds * 1000:.0f} ms' for phase, seconds in self.phases)
+        return f"Arranque: {phases} (total {(self._last - self.origin) * 1000:.0f} ms)"
+
+startup_timer = StartupTimer(_IMPORT_START)
+startup_timer.mark('imports')
+
+# Rutas del servidor que no dependen de la agenda (no llevan el prefijo /books/<book>)
+SERVER_ENDPOINTS = ('/enviar_mensaje', '/shutdown')
+
+# Importación: el CSV se valida completo en el cliente y después se sube en partes
+# de IMPORT_CHUNK_ROWS filas, IMPORT_PARALLEL_CHUNKS a la vez. Cada parte reintenta
+# IMPORT_CHUNK_RETRIES veces ante un corte de conexión o un 502/503/504.
+IMPORT_CHUNK_ROWS = 5000
+IMPORT_PARALLEL_CHUNKS = 3
+IMPORT_CHUNK_RETRIES = 3
+
+# Errores que se informan como máximo (igual que el reporte del servidor)
+MAX_IMPORT_ERRORS = 1000
+
+IMPORT_HEADER = ['nombre', 'telefono', 'direccion']
+
+# Escrituras en segundo plano: agregar, actualizar y borrar se guardan en una cola
+# local y se mandan a /contacts/batch de a WRITE_BATCH_SIZE. Si el servidor no
+# responde se reintenta cada WRITE_RETRY_MS, duplicando la espera hasta WRITE_MAX_RETRY_MS.
+WRITE_BATCH_SIZE = 500
+WRITE_RETRY_MS = 2000
+WRITE_MAX_RETRY_MS = 60000
+
+def normalize_phone(telefono):
+    """Clave de un teléfono como la calcula el servidor (normalizar_telefono):
+    solo dígitos, con el prefijo "00" equivalente a "+". None si no tiene dígitos."""
+    texto = telefono.strip()
+    digits = ''.join(c for c in texto if c.isdigit())
+    if texto.startswith('00'):
+        digits = digits[2:]
+    return digits or None
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def validate_import_file(file_path, progress_callback=None):
+    """Revisa un CSV de contactos antes de subirlo, en una sola pasada.
+
+    Controla la cabecera, que cada fila tenga 3 campos no vacíos y un teléfono con
+    dígitos, y que no se repitan nombres ni teléfonos dentro del archivo. Devuelve
+    {'rows', 'failed', 'errors', 'errors_truncated'} con los errores en el mismo
+    formato que el reporte de /import. progress_callback(filas, None) informa el avance.
+    """
+    result = {'rows': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+
+    def add_error(line, code, message, nombre=None):
+        result['failed'] += 1
+        if len(result['errors']) < MAX_IMPORT_ERRORS:
+            result['errors'].append({'line': line, 'nombre': nombre, 'code': code, 'message': message})
+        else:
+            result['errors_truncated'] = True
+
+    names = {}
+    phones = {}
+    with open(file_path, encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file)
+        try:
+            header = next(reader, None)
+            if header is None:
+                add_error(1, 'invalid_format', 'El archivo CSV está vacío.')
+                return result
+            if [h.strip() for h in header] != IMPORT_HEADER:
+                add_error(1, 'invalid_format', 'La cabecera del archivo CSV no es válida. Se esperaba: nombre,telefono,direccion')
+                return result
+            for row in reader:
+                line = reader.line_num
+                result['rows'] += 1
+                if progress_callback and result['rows'] % 10000 == 0:
+                    progress_callback(result['rows'], None)
+                if len(row) != 3:
+                    add_error(line, 'invalid_format', f"La fila '{row}' no tiene el formato correcto (debe tener 3 columnas).")
+                    continue
+                nombre, telefono, direccion = (field.strip() for field in row)
+                if not (nombre and telefono and direccion):
+                    add_error(line, 'missing_fields', 'Todos los campos son obligatorios.', nombre or None)
+                    continue
+                phone_key = normalize_phone(telefono)
+                if phone_key is None:
+                    add_error(line, 'invalid_phone', 'El teléfono debe contener al menos un dígito.', nombre)
+                elif nombre in names:
+                    add_error(line, 'duplicate_name', f"El contacto '{nombre}' ya aparece en la línea {names[nombre]}.", nombre)
+                elif phone_key in phones:
+                    add_error(line, 'duplicate_phone', f"El teléfono '{telefono}' ya aparece en la línea {phones[phone_key]}.", nombre)
+                else:
+                    names[nombre] = line
+                    phones[phone_key] = line
+        except UnicodeDecodeError:
+            add_error(reader.line_num + 1, 'invalid_encoding', 'El archivo CSV no está codificado en UTF-8.')
+        except csv.Error as e:
+            add_error(reader.line_num, 'invalid_format', f'El archivo CSV no es válido: {e}')
+    return result
+
+def iter_import_chunks(file_path, chunk_rows):
+    """Recorre un CSV ya validado en partes de chunk_rows filas. Por cada parte
+    devuelve (línea de su primera fila, cantidad de filas, CSV con cabecera en bytes)."""
+    with open(file_path, encoding='utf-8-sig', newline='') as file:
+        reader = csv.reader(file)
+        next(reader)
+        rows = []
+        first_line = None
+        for row in reader:
+            if first_line is None:
+                first_line = reader.line_num
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield first_line, len(rows), _encode_csv(rows)
+                rows = []
+                first_line = None
+        if rows:
+            yield first_line, len(rows), _encode_csv(rows)
+
+def _encode_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(IMPORT_HEADER)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+def columns_to_rows(columns):
+    """Convierte {'nombre': [...], 'telefono': [...], ...} en una lista de contactos."""
+    keys = list(columns)
+    return [dict(zip(keys, values)) for values in zip(*columns.values())]
+
+def decode_contacts(response):
+    """Lee una respuesta de /contacts en cualquiera de sus formatos.
+
+    Devuelve siempre contactos como diccionarios: una lista, o una página
+    {'contacts': [...], 'next_cursor': ...}.
+    """
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+    if content_type == FORMAT_MSGPACK:
+        data = msgpack.unpackb(response.content, raw=False)
+    else:
+        data = response.json()
+    if content_type in (FORMAT_MSGPACK, FORMAT_COLUMNAR):
+        if 'contacts' in data:
+            data['contacts'] = columns_to_rows(data['contacts'])
+        else:
+            data = columns_to_rows(data)
+    return data
+
+def if_match_header(version):
+    """Cabecera para una escritura condicional a la versión del contacto (o ninguna)."""
+    return {'If-Match': f'"{version}"'} if version is not None else None
+
+def conflict_result(response):
+    """Resultado de un 412: el contacto cambió en el servidor desde que se leyó."""
+    body = response.json()
+    return {'error': body.get('error', 'El contacto fue modificado por otro usuario.'),
+            'conflict': True, 'contact': body.get('contact')}
+
+def apply_write(contact, write):
+    """Estado de un contacto después de aplicarle una escritura encolada (None si
+    queda borrado o si es un update de un contacto que no se conoce). La versión
+    se predice como la calcula el servidor: 1 al crear y +1 en cada update."""
+    if write['op'] == 'delete':
+        return None
+    if write['op'] == 'create':
+        return {'nombre': write['nombre'], 'telefono': write['telefono'],
+                'direccion': write['direccion'], 'version': 1}
+    if contact is None:
+        return None
+    updated = dict(contact)
+    if write.get('telefono'):
+        updated['telefono'] = write['telefono']
+    if write.get('direccion'):
+        updated['direccion'] = write['direccion']
+    if contact.get('version') is not None:
+        updated['version'] = contact['version'] + 1
+    return updated
+
+def write_landed(write, result):
+    """Indica si una escritura rechazada ya estaba aplicada en el servidor. Pasa al
+    reenviar un lote cuya respuesta se perdió: el create da 409, el update 412 y
+    el delete 404, pero el contacto ya quedó como se quería."""
+    contact = result.get('contact')
+    if write['op'] == 'delete':
+        return result['status'] == 404
+    if contact is None or result['status'] not in (409, 412):
+        return False
+    if write['op'] == 'create':
+        return contact['telefono'] == write['telefono'] and contact['direccion'] == write['direccion']
+    return ((not write.get('telefono') or contact['telefono'] == write['telefono'])
+            and (not write.get('direccion') or contact['direccion'] == write['direccion']))
+
+def as_change(nombre, contact):
+    """Cambio en el formato de /contacts/changes para el estado de un contacto."""
+    return {'op': 'upsert', **contact} if contact is not None else {'op': 'delete', 'nombre': nombre}
+
+
+class WriteQueue:
+    """Cola durable de escrituras pendientes en SQLite (en memoria, o en disco si
+    se indica path).
+
+    Las operaciones se guardan en orden y se borran recién cuando el servidor
+    contestó por ellas, así sobreviven a un cierre del cliente sin conexión.
+    También guarda la sesión de cada importación sin terminar, para retomarla.
+    """
+    def __init__(self, path=None):
+        self._conn = sqlite3.connect(path or ':memory:', isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path:
+                self._conn.execute('PRAGMA journal_mode = WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS operaciones (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op TEXT NOT NULL,
+                    nombre TEXT NOT NULL,
+                    telefono TEXT,
+                    direccion TEXT,
+                    version INTEGER,
+                    creada REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS importaciones (
+                    archivo TEXT NOT NULL,
+                    politica TEXT NOT NULL,
+                    sesion TEXT NOT NULL,
+                    PRIMARY KEY (archivo, politica)
+                )
+            ''')
+
+    def push(self, op, nombre, telefono=None, direccion=None, version=None):
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO operaciones (op, nombre, telefono, direccion, version, creada) VALUES (?, ?, ?, ?, ?, ?)',
+                (op, nombre, telefono, direccion, version, time.time()))
+            return cursor.lastrowid
+
+    def pending(self, limit=-1, names=None):
+        """Operaciones pendientes en orden, opcionalmente solo las de ciertos contactos."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, op, nombre, telefono, direccion, version FROM operaciones ORDER BY id LIMIT ?',
+                (limit,)).fetchall()
+        writes = [{'id': id_, 'op': op, 'nombre': nombre, 'telefono': telefono,
+                   'direccion': direccion, 'version': version}
+                  for id_, op, nombre, telefono, direccion, version in rows]
+        return writes if names is None else [write for write in writes if write['nombre'] in names]
+
+    def remove(self, ids):
+        with self._lock:
+            self._conn.executemany('DELETE FROM operaciones WHERE id = ?', [(id_,) for id_ in ids])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM operaciones').fetchone()[0]
+
+    def import_session(self, digest, policy):
+        """Sesión de la importación sin terminar de ese archivo con esa política, o None."""
+        with self._lock:
+            row = self._conn.execute('SELECT sesion FROM importaciones WHERE archivo = ? AND politica = ?',
+                                     (digest, policy)).fetchone()
+        return row[0] if row else None
+
+    def save_import_session(self, digest, policy, session):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO importaciones (archivo, politica, sesion) VALUES (?, ?, ?)',
+                               (digest, policy, session))
+
+    def remove_import_session(self, digest, policy):
+        with self._lock:
+            self._conn.execute('DELETE FROM importaciones WHERE archivo = ? AND politica = ?', (digest, policy))
+
+    def close(self):
+        self._conn.close()
+
+
+class ContactCache:
+    """Copia local de la agenda en SQLite (en memoria, o en disco si se indica path).
+
+    Guarda la revisión del servidor con la que está sincronizada, así después
+    solo hace falta pedir los cambios posteriores (/contacts/changes), y la
+    versión de cada contacto para las escrituras condicionales (If-Match).
+    """
+    def __init__(self, path=None):
+        self._conn = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self._lock = threading.RLock()
+        # Una sola recarga a la vez (usan la misma tabla temporal)
+        self._reload_lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS contactos (
+                    nombre TEXT PRIMARY KEY,
+                    telefono TEXT NOT NULL,
+                    direccion TEXT NOT NULL,
+                    version INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS estado (
+                    clave TEXT PRIMARY KEY,
+                    valor TEXT
+                );
+            ''')
+            # Una caché en disco anterior no tiene las versiones: se descarta la
+            # revisión para que la próxima sincronización la recargue completa.
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(contactos)')]
+            if 'version' not in columns:
+                self._conn.execute('ALTER TABLE contactos ADD COLUMN version INTEGER')
+                self._conn.execute("DELETE FROM estado WHERE clave = 'revision'")
+
+    @property
+    def revision(self):
+        """Revisión sincronizada, o None si la caché nunca se cargó."""
+        with self._lock:
+            row = self._conn.execute("SELECT valor FROM estado WHERE clave = 'revision'").fetchone()
+        return int(row[0]) if row else None
+
+    def page(self, after=None, limit=500):
+        """Devuelve hasta limit contactos ordenados por nombre, después de `after`."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT nombre, telefono, direccion, version FROM contactos WHERE nombre > ? ORDER BY nombre LIMIT ?',
+                (after or '', limit)).fetchall()
+        return [{'nombre': nombre, 'telefono': telefono, 'direccion': direccion, 'version': version}
+                for nombre, telefono, direccion, version in rows]
+
+    def get(self, nombre):
+        with self._lock:
+            row = self._conn.execute('SELECT nombre, telefono, direccion, version FROM contactos WHERE nombre = ?',
+                                     (nombre,)).fetchone()
+        return dict(zip(('nombre', 'telefono', 'direccion', 'version'), row)) if row else None
+
+    def apply_changes(self, changes, revision=None):
+        """Aplica cambios en el formato de /contacts/changes. Sin revision no se
+        avanza la revisión sincronizada (cambios locales todavía sin confirmar)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO contactos (nombre, telefono, direccion, version) VALUES (?, ?, ?, ?)',
+                [(c['nombre'], c['telefono'], c['direccion'], c.get('version')) for c in changes if c['op'] == 'upsert'])
+            self._conn.executemany(
+                'DELETE FROM contactos WHERE nombre = ?',
+                [(c['nombre'],) for c in changes if c['op'] == 'delete'])
+            if revision is not None:
+                self.set_revision(revision)
+
+    @contextmanager
+    def reloading(self):
+        """Prepara el reemplazo de todo el contenido.
+
+        Lo descargado se guarda con insert_contacts en una tabla aparte, que pasa
+        a ser la caché recién con commit_reload. Mientras tanto la caché se sigue
+        leyendo y modificando sin esperar a la descarga, y si la recarga falla a
+        mitad de camino queda la copia anterior.
+        """
+        with self._reload_lock:
+            with self._lock, self._conn:
+                self._conn.execute('DROP TABLE IF EXISTS temp.recarga')
+                self._conn.execute('CREATE TEMP TABLE recarga (nombre TEXT PRIMARY KEY, telefono TEXT NOT NULL, '
+                                   'direccion TEXT NOT NULL, version INTEGER)')
+            try:
+                yield self
+            finally:
+                with self._lock, self._conn:
+                    self._conn.execute('DROP TABLE IF EXISTS temp.recarga')
+
+    def insert_contacts(self, contacts):
+        """Agrega contactos a la recarga en curso (ver reloading)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO temp.recarga (nombre, telefono, direccion, version) VALUES (?, ?, ?, ?)',
+                [(c['nombre'], c['telefono'], c['direccion'], c.get('version')) for c in contacts])
+
+    def commit_reload(self, revision):
+        """Reemplaza el contenido por lo cargado con insert_contacts, en una sola transacción."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM contactos')
+            self._conn.execute('INSERT INTO contactos (nombre, telefono, direccion, version) '
+                               'SELECT nombre, telefono, direccion, version FROM temp.recarga')
+            self._conn.execute('DELETE FROM temp.recarga')
+            self.set_revision(revision)
+
+    def set_revision(self, revision):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO estado (clave, valor) VALUES ('revision', ?)",
+                               (str(revision),))
+
+    def close(self):
+        self._conn.close()
+
+
 class ClientController:
-    def __init__(self, server_url='http://127.0.0.1:5000'):
+    def __init__(self, server_url='http://127.0.0.1:5000', page_size=500, timeout=10, transfer_timeout=120,
+                 pool_size=4, retries=3, backoff_factor=0.3, cache_path=None, book=None, queue_path=None):
         self.server_url = server_url
+        # Con book se trabaja sobre esa agenda del servidor (/books/<book>/...) en
+        # lugar de la principal. Los reportes y /shutdown son del servidor entero.
+        self.book_prefix = f'/books/{quote(book, safe="")}' if book else ''
+        self.page_size = page_size
+        # Segundos de espera por defecto: timeout para las llamadas comunes y
+        # transfer_timeout para exportar/importar, que mueven archivos completos.
+        # Cada método acepta su propio timeout para sobrescribirlos.
+        self.timeout = timeout
+        self.transfer_timeout = transfer_timeout
+        self.session = self._create_session(pool_size, retries, backoff_factor)
+        self._timings = {}
+        self._timings_lock = threading.Lock()
+        # Copia local de la agenda, sincronizada con /contacts/changes
+        self.cache = ContactCache(cache_path)
+        self._etag_cache = OrderedDict()
+        self._etag_lock = threading.Lock()
+        # Escrituras que todavía no llegaron al servidor (ver queue_write). La caché
+        # las muestra ya aplicadas: cada vez que un contacto vuelve a tomar el estado
+        # del servidor se le reaplican las suyas. _writes_lock mantiene juntas la
+        # cola y la caché; _flush_lock evita dos envíos de la cola a la vez.
+        self.write_queue = WriteQueue(queue_path)
+        self._writes_lock = threading.RLock()
+        self._flush_lock = threading.Lock()
 
-    def get_all_contacts(self):
-        """Obtiene todos los contactos del servidor."""
+    def _create_session(self, pool_size, retries, backoff_factor):
+        """Crea una sesión HTTP que reutiliza conexiones (keep-alive).
+
+        Solo se reintentan los métodos idempotentes, con espera exponencial entre
+        intentos; un POST nunca se reenvía para no duplicar contactos.
+        """
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # Compresiones que urllib3 puede descomprimir (incluye br si está instalado brotli)
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        return session
+
+    def _request(self, method, endpoint, path=None, **kwargs):
+        """Hace un pedido con la sesión y registra cuánto tardó.
+
+        endpoint es el nombre con el que se agrupan los tiempos (por ejemplo
+        '/contacts/<nombre>'); path es la ruta real si es distinta.
+        """
+        prefix = '' if endpoint in SERVER_ENDPOINTS else self.book_prefix
+        start = time.perf_counter()
+        try:
+            return self.session.request(method, f'{self.server_url}{prefix}{path or endpoint}', **kwargs)
+        finally:
+            self._record_timing(f'{method} {endpoint}', time.perf_counter() - start)
+
+    def _record_timing(self, key, elapsed):
+        with self._timings_lock:
+            samples = self._timings.setdefault(key, deque(maxlen=TIMING_SAMPLES))
+            samples.append(elapsed)
+
+    def get_request_stats(self):
+        """Devuelve la latencia observada por el cliente para cada endpoint, en milisegundos."""
+        stats = {}
+        with self._timings_lock:
+            timings = {key: sorted(samples) for key, samples in self._timings.items()}
+        for key, samples in timings.items():
+            count = len(samples)
+            stats[key] = {
+                'count': count,
+                'avg_ms': round(sum(samples) / count * 1000, 2),
+                'p50_ms': round(samples[count // 2] * 1000, 2),
+                'p95_ms': round(samples[min(count - 1, int(count * 0.95))] * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+            }
+        return stats
+
+    def _get_json(self, endpoint, params=None, timeout=None):
+        """GET que reutiliza la última respuesta si el servidor contesta 304.
+
+        Las respuestas se guardan con su ETag; al repetir el mismo pedido se manda
+        If-None-Match y, si la agenda no cambió, no se vuelve a descargar el cuerpo.
+        """
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        with self._etag_lock:
+            cached = self._etag_cache.get(key)
+        headers = {'Accept': ACCEPT_CONTACTS}
+        if cached:
+            headers['If-None-Match'] = cached[0]
+        response = self._request('GET', endpoint, params=params, headers=headers,
+                                 timeout=timeout or self.timeout)
+        if response.status_code == 304 and cached:
+            with self._etag_lock:
+                self._etag_cache.move_to_end(key, last=True)
+            return cached[1]
+        response.raise_for_status()
+        data = decode_contacts(response)
+        etag = response.headers.get('ETag')
+        if etag:
+            with self._etag_lock:
+                self._etag_cache[key] = (etag, data)
+                self._etag_cache.move_to_end(key, last=True)
+                while len(self._etag_cache) > ETAG_CACHE_SIZE:
+                    self._etag_cache.popitem(last=False)
+        return data
+
+    def sync_contacts(self, timeout=None):
+        """Pone al día la caché local con los cambios del servidor.
+
+        Devuelve {'reset': False, 'changes': [...]} con los cambios aplicados, o
+        {'reset': True} si hubo que recargar la agenda completa (primera vez, o
+        si el servidor ya no conserva las revisiones pedidas).
+        """
+        try:
+            revision = self.cache.revision
+            if revision is None:
+                self._reload_cache(timeout)
+                return {'reset': True, 'changes': []}
+
+            changes = []
+            while True:
+                response = self._request('GET', '/contacts/changes', params={'since': revision},
+                                         timeout=timeout or self.timeout)
+                response.raise_for_status()
+                delta = response.json()
+                if delta['reset']:
+                    self._reload_cache(timeout)
+                    return {'reset': True, 'changes': []}
+                names = {change['nombre'] for change in delta['changes']}
+                with self._writes_lock:
+                    self.cache.apply_changes(delta['changes'], delta['revision'])
+                    replayed = self._replay_pending(names)
+                    changes.extend(as_change(change['nombre'], self.cache.get(change['nombre']))
+                                   if change['nombre'] in replayed else change
+                                   for change in delta['changes'])
+                revision = delta['revision']
+                if not delta['has_more']:
+                    return {'reset': False, 'changes': changes}
+        except requests.exceptions.RequestException as e:
+            return {'error': f'Error al sincronizar contactos: {e}'}
+
+    def _reload_cache(self, timeout=None):
+        """Descarga la agenda completa, página por página, a la caché local."""
+        params = {'limit': self.page_size}
+        revision = None
+        with self.cache.reloading() as cache:
+            while True:
+                response = self._request('GET', '/contacts', params=params, headers={'Accept': ACCEPT_CONTACTS},
+                                         timeout=timeout or self.timeout)
+                response.raise_for_status()
+                # La revisión de la primera página alcanza: los cambios que ocurran
+                # durante la descarga se vuelven a aplicar en la próxima sincronización.
+                if revision is None:
+                    revision = int(response.headers.get('X-Revision', 0))
+                page = decode_contacts(response)
+                cache.insert_contacts(page['contacts'])
+                if not page['next_cursor']:
+                    break
+                params['cursor'] = page['next_cursor']
+            with self._writes_lock:
+                cache.commit_reload(revision)
+                self._replay_pending()
+
+    def _replay_pending(self, names=None):
+        """Vuelve a aplicar a la caché las escrituras pendientes (de todos los
+        contactos o solo de names) y devuelve los nombres afectados. Se usa
+        después de que esos contactos tomaron el estado del servidor."""
+        with self._writes_lock:
+            writes = self.write_queue.pending(names=names)
+            for write in writes:
+                current = self.cache.get(write['nombre'])
+                contact = apply_write(current, write)
+                if current is not None or contact is not None:
+                    self.cache.apply_changes([as_change(write['nombre'], contact)])
+            return {write['nombre'] for write in writes}
+
+    def close(self):
+        """Cierra las conexiones abiertas de la sesión, la caché local y la cola de escrituras."""
+        self.session.close()
+        self.cache.close()
+        self.write_queue.close()
+
+    def get_contacts_page(self, cursor=None, query=None, page_size=None, sort='nombre', timeout=None):
+        """Obtiene una página de contactos (opcionalmente filtrados por query).
+
+        Sin query, las páginas salen de la caché local ordenadas por nombre; al
+        pedir la primera se sincroniza antes con el servidor.
+        """
+        page_size = page_size or self.page_size
+        if not query and sort == 'nombre':
+            if cursor is None:
+                sync = self.sync_contacts(timeout)
+                if 'error' in sync and self.cache.revision is None:
+                    return sync
+            contacts = self.cache.page(cursor, page_size + 1)
+            next_cursor = contacts[page_size - 1]['nombre'] if len(contacts) > page_size else None
+            return {'contacts': contacts[:page_size], 'next_cursor': next_cursor}
+
+        params = {'limit': page_size, 'sort': sort}
+        if cursor:
+            params['cursor'] = cursor
+        if query:
+            params['query'] = query
         try:
-            response = requests.get(f'{self.server_url}/contacts')
+            return self._get_json('/contacts', params, timeout)
+        except requests.exceptions.RequestException as e:
+            return {'error': f'Error al obtener contactos: {e}'}
+
+    def iter_contact_pages(self, page_size=None, sort='nombre', timeout=None):
+        """Recorre los contactos del servidor página por página (paginación por cursor)."""
+        params = {'limit': page_size or self.page_size, 'sort': sort}
+        while True:
+            response = self._request('GET', '/contacts', params=params, headers={'Accept': ACCEPT_CONTACTS},
+                                     timeout=timeout or self.timeout)
             response.raise_for_status()
-            return response.json()
+            page = decode_contacts(response)
+            yield page['contacts']
+            if not page['next_cursor']:
+                break
+            params['cursor'] = page['next_cursor']
+
+    def get_all_contacts(self, timeout=None):
+        """Obtiene todos los contactos del servidor."""
+        try:
+            contacts = []
+            for page in self.iter_contact_pages(timeout=timeout):
+                contacts.extend(page)
+            return contacts
         except requests.exceptions.RequestException as e:
             return {'error': f'Error al obtener contactos: {e}'}
 
-    def search_contact(self, query: str):
+    def search_contact(self, query: str, timeout=None):
         """Busca contactos por nombre, teléfono o dirección."""
         try:
-            response = requests.get(f'{self.server_url}/contacts', params={'query': query})
-            response.raise_for_status()
-            return response.json()
+            return self._get_json('/contacts', {'query': query}, timeout)
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
                 return {'error': f'No se encontraron contactos que coincidan con "{query}".'}
@@ -39,11 +725,11 @@ class ClientController:
         except requests.exceptions.RequestException as e:
             return {'error': f'Error de conexión: {e}'}
 
-    def add_contact(self, nombre: str, telefono: str, direccion: str):
+    def add_contact(self, nombre: str, telefono: str, direccion: str, timeout=None):
         """Agrega un nuevo contacto."""
         data = {'nombre': nombre, 'telefono': telefono, 'direccion': direccion}
         try:
-            response = requests.post(f'{self.server_url}/contacts', json=data)
+            response = self._request('POST', '/contacts', json=data, timeout=timeout or self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
@@ -52,21 +738,33 @@ class ClientController:
         except requests.exceptions.RequestException as e:
             return {'error': f'Error de conexión: {e}'}
 
-    def delete_contact(self, nombre: str):
-        """Elimina un contacto por nombre."""
+    def delete_contact(self, nombre: str, version=None, timeout=None):
+        """Elimina un contacto por nombre.
+
+        Con version, solo si el contacto sigue en esa versión; si otro lo modificó
+        devuelve {'error', 'conflict': True, 'contact': <contacto actual>}.
+        """
         try:
-            response = requests.delete(f'{self.server_url}/contacts/{nombre}')
+            response = self._request('DELETE', '/contacts/<nombre>', f'/contacts/{nombre}',
+                                     headers=if_match_header(version), timeout=timeout or self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
                 return {'error': f'Contacto "{nombre}" no encontrado.'}
+            if e.response.status_code == 412:
+                return conflict_result(e.response)
             return {'error': f'Error HTTP: {e.response.status_code}'}
         except requests.exceptions.RequestException as e:
             return {'error': f'Error de conexión: {e}'}
 
-    def update_contact(self, nombre: str, telefono: str, direccion: str):
-        """Actualiza un contacto existente."""
+    def update_contact(self, nombre: str, telefono: str, direccion: str, version=None, timeout=None):
+        """Actualiza un contacto existente.
+
+        Con version, solo si el contacto sigue en esa versión (If-Match); si otro
+        lo modificó devuelve {'error', 'conflict': True, 'contact': <contacto actual>}.
+        La respuesta trae la nueva versión en 'version'.
+        """
         data = {}
         if telefono:
             data['telefono'] = telefono
@@ -74,55 +772,549 @@ class ClientController:
             data['direccion'] = direccion
         
         try:
-            response = requests.put(f'{self.server_url}/contacts/{nombre}', json=data)
+            response = self._request('PUT', '/contacts/<nombre>', f'/contacts/{nombre}', json=data,
+                                     headers=if_match_header(version), timeout=timeout or self.timeout)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 412:
+                return conflict_result(e.response)
             error_message = e.response.json().get('error', f'Error HTTP: {e.response.status_code}')
             return {'error': f'Error al actualizar contacto: {error_message}'}
         except requests.exceptions.RequestException as e:
             return {'error': f'Error de conexión: {e}'}
             
-    def send_message(self, mensaje: str):
+    def batch_contacts(self, operations, atomic=False, timeout=None):
+        """Aplica varias operaciones en un solo pedido y una sola transacción.
+
+        operations es una lista de dicts con 'op' ('create', 'update' o 'delete'),
+        'nombre' y, según la operación, 'telefono' y 'direccion'. La respuesta
+        trae el resultado de cada operación en 'results'.
+        """
+        try:
+            response = self._request('POST', '/contacts/batch',
+                                     json={'operations': operations, 'atomic': atomic},
+                                     timeout=timeout or self.transfer_timeout)
+            try:
+                return response.json()
+            except ValueError:
+                response.raise_for_status()
+                return {'error': f'Error HTTP: {response.status_code}'}
+        except requests.exceptions.RequestException as e:
+            return {'error': f'Error de conexión: {e}'}
+
+    def queue_write(self, op, nombre, telefono=None, direccion=None, version=None):
+        """Encola una escritura y la aplica a la caché sin esperar al servidor.
+        Devuelve {'contact', 'version', 'pending'} o {'error'} si no es válida."""
+        if op == 'create' and not (nombre and telefono and direccion):
+            return {'error': 'Todos los campos (nombre, teléfono, dirección) son obligatorios.'}
+        if op == 'update' and not (telefono or direccion):
+            return {'error': 'Debes ingresar al menos el teléfono o la dirección para actualizar.'}
+        if op not in ('create', 'update', 'delete') or not nombre:
+            return {'error': f'Operación no válida: "{op}".'}
+        if telefono and normalize_phone(telefono) is None:
+            return {'error': 'El teléfono debe contener al menos un dígito.'}
+
+        write = {'op': op, 'nombre': nombre, 'telefono': telefono or None, 'direccion': direccion or None,
+                 'version': version if op != 'create' else None}
+        with self._writes_lock:
+            current = self.cache.get(nombre)
+            # Con la caché cargada se sabe si el contacto existe (incluidas las escrituras pendientes)
+            if self.cache.revision is not None:
+                if op == 'create' and current is not None:
+                    return {'error': f'El contacto "{nombre}" ya existe.'}
+                if op != 'create' and current is None:
+                    return {'error': f'Contacto "{nombre}" no encontrado.'}
+            self.write_queue.push(**write)
+            contact = apply_write(current, write)
+            if current is not None or contact is not None:
+                self.cache.apply_changes([as_change(nombre, contact)])
+
+        if contact is not None:
+            expected_version = contact.get('version')
+        elif op == 'update' and version is not None:
+            expected_version = version + 1
+        else:
+            expected_version = None
+        return {'contact': contact, 'version': expected_version, 'pending': len(self.write_queue)}
+
+    def pending_writes(self):
+        """Cantidad de escrituras que todavía no llegaron al servidor."""
+        return len(self.write_queue)
+
+    def flush_writes(self, timeout=None):
+        """Envía las escrituras encoladas a /contacts/batch, en orden y de a WRITE_BATCH_SIZE.
+        Devuelve {'applied', 'conflicts', 'changes', 'pending'} y 'error' si no hubo conexión."""
+        summary = {'applied': 0, 'conflicts': [], 'changes': [], 'pending': 0}
+        if not self._flush_lock.acquire(blocking=False):
+            summary['pending'] = len(self.write_queue)
+            return summary
+        try:
+            touched = set()
+            while True:
+                writes = self.write_queue.pending(WRITE_BATCH_SIZE)
+                if not writes:
+                    break
+                # A lo sumo una escritura por contacto por lote: si el servidor la
+                # rechaza, las siguientes de ese contacto se descartan en lugar de aplicarse
+                names = set()
+                for position, write in enumerate(writes):
+                    if write['nombre'] in names:
+                        writes = writes[:position]
+                        break
+                    names.add(write['nombre'])
+                operations = [{key: value for key, value in write.items() if key != 'id' and value is not None}
+                              for write in writes]
+                response = self.batch_contacts(operations, timeout=timeout or self.timeout)
+                if 'results' not in response:
+                    summary['error'] = response.get('error', 'Respuesta inesperada del servidor.')
+                    break
+                # 503: la agenda todavía no acepta versiones; esas escrituras se reintentan más tarde
+                if not self._apply_flush_results(writes, response['results'], summary, touched):
+                    break
+            summary['changes'] = [as_change(nombre, self.cache.get(nombre)) for nombre in touched]
+        finally:
+            self._flush_lock.release()
+        summary['pending'] = len(self.write_queue)
+        return summary
+
+    def _apply_flush_results(self, writes, results, summary, touched):
+        """Quita de la cola lo que el servidor contestó y corrige la caché; False si queda algo por reintentar."""
+        done = []
+        confirmed = {}  # nombre -> versión que quedó en el servidor
+        known = {}      # nombre -> estado en el servidor, para los contactos con escrituras rechazadas
+        rejected = set()
+        complete = True
+        for write, result in zip(writes, results):
+            nombre = write['nombre']
+            if result['status'] == 503:
+                complete = False
+                continue
+            done.append(write['id'])
+            if result['status'] < 300 or write_landed(write, result):
+                summary['applied'] += 1
+                version = result.get('version', (result.get('contact') or {}).get('version'))
+                if write['op'] != 'delete' and version is not None:
+                    confirmed[nombre] = version
+            else:
+                rejected.add(nombre)
+                summary['conflicts'].append({'op': write['op'], 'nombre': nombre, 'status': result['status'],
+                                             'error': result.get('error', f'Error HTTP: {result["status"]}'),
+                                             'contact': result.get('contact')})
+                if 'contact' in result:
+                    known[nombre] = result['contact']
+
+        with self._writes_lock:
+            self.write_queue.remove(done)
+            pending = self.write_queue.pending()
+            dependent = [write for write in pending if write['nombre'] in rejected]
+            for write in dependent:
+                summary['conflicts'].append({'op': write['op'], 'nombre': write['nombre'], 'status': None,
+                                             'error': 'Se descartó porque un cambio anterior del mismo '
+                                                      'contacto fue rechazado.',
+                                             'contact': known.get(write['nombre'])})
+            self.write_queue.remove([write['id'] for write in dependent])
+            still_pending = {write['nombre'] for write in pending if write['nombre'] not in rejected}
+            # Versión real de lo aplicado (por ejemplo, un update sin version sobre
+            # un contacto que otro había cambiado)
+            for nombre, version in confirmed.items():
+                contact = self.cache.get(nombre)
+                if nombre not in still_pending and contact is not None and contact['version'] != version:
+                    contact['version'] = version
+                    self.cache.apply_changes([as_change(nombre, contact)])
+                    touched.add(nombre)
+            if known:
+                self.cache.apply_changes([as_change(nombre, contact) for nombre, contact in known.items()])
+                touched.update(known)
+        return complete
+
+    def send_message(self, mensaje: str, timeout=None):
         """Envía un mensaje al servidor."""
-        url = f'{self.server_url}/enviar_mensaje'
         try:
-            response = requests.post(url, json={'mensaje': mensaje})
+            response = self._request('POST', '/enviar_mensaje', json={'mensaje': mensaje},
+                                     timeout=timeout or self.timeout)
             response.raise_for_status()
             return response.json()
+        except requests.exceptions.HTTPError as e:
+            # Con la cola de reportes llena el servidor responde 503 con un mensaje para mostrar
+            return {'status': 'error', 'message': e.response.json().get('message', f'Error HTTP: {e.response.status_code}')}
         except requests.exceptions.RequestException as e:
             return {'status': 'error', 'message': f'Error de conexión: {e}'}
             
-    def shutdown_server(self):
+    def shutdown_server(self, timeout=2):
         """Envía una petición de apagado al servidor."""
         try:
-            requests.post(f'{self.server_url}/shutdown')
+            self._request('POST', '/shutdown', timeout=timeout)
         except requests.exceptions.RequestException as e:
             print(f"Error al enviar la señal de apagado al servidor: {e}")
 
-    def export_contacts(self):
-        """Solicita al servidor que exporte todos los contactos."""
+    def export_contacts(self, file_path: str, progress_callback=None, timeout=None):
+        """Descarga la exportación CSV del servidor y la escribe directo en un archivo.
+
+        progress_callback(filas_escritas, total) se llama por cada bloque recibido;
+        total es None si el servidor no informa la cantidad de contactos.
+        """
         try:
-            response = requests.get(f'{self.server_url}/export', timeout=30)
-            response.raise_for_status()
-            return response.text
+            with self._request('GET', '/export', timeout=timeout or self.transfer_timeout, stream=True) as response:
+                response.raise_for_status()
+                total = response.headers.get('X-Contact-Count')
+                total = int(total) if total is not None else None
+                written_rows = -1  # la primera línea es la cabecera
+                with open(file_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        file.write(chunk)
+                        written_rows += chunk.count(b'\n')
+                        if progress_callback:
+                            progress_callback(max(written_rows, 0), total)
+            return {'message': f'Contactos exportados a:\n{file_path}'}
         except requests.exceptions.RequestException as e:
             return {'error': f'Error al exportar contactos: {e}'}
+        except OSError as e:
+            return {'error': f'No se pudo guardar el archivo: {e}'}
+
+    def import_contacts(self, file_path: str, on_conflict: str = 'skip', progress_callback=None, timeout=None):
+        """Importa contactos desde un archivo CSV.
+
+        Primero se valida el archivo completo en el cliente (validate_import_file):
+        si tiene errores no se sube nada. Después se sube en partes, varias a la vez,
+        cada una con una clave de idempotencia: un id de sesión al azar y el número
+        de parte. La sesión se guarda en la cola (ver WriteQueue.import_session)
+        hasta que la importación termina: si se corta, volver a importar el mismo
+        archivo retoma esa sesión y no repite las partes que ya se aplicaron; una
+        importación terminada no se recuerda, así que repetirla vuelve a aplicarla.
+        on_conflict indica qué hacer con los contactos que ya existen: 'skip',
+        'upsert' o 'fail'; con 'fail' el archivo se sube en una sola parte para que
+        no se importe nada si algo falla.
 
-    def import_contacts(self, contacts_csv: str):
-        """Envía al servidor un string en formato CSV para importar contactos."""
+        progress_callback(filas, total) informa el avance; total es None mientras se
+        valida. Devuelve el reporte de la importación, con las líneas del archivo.
+        """
         try:
-            response = requests.post(f'{self.server_url}/import', data=contacts_csv, headers={'Content-Type': 'text/csv'})
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            error_message = ""
-            if e.response is not None:
-                try:
-                    error_message = e.response.json().get('error', f'Error HTTP: {e.response.status_code}')
-                except json.JSONDecodeError:
-                    error_message = f'Error HTTP: {e.response.status_code}'
-            return {'error': f'Error al importar contactos: {error_message}'}
+            validation = validate_import_file(file_path, progress_callback)
+            if validation['failed']:
+                return dict(validation, policy=on_conflict, imported=0, skipped=0, aborted=True,
+                            error=f"El archivo tiene {validation['failed']} errores; no se importó ningún contacto.")
+            digest = file_digest(file_path)
+            session = self.write_queue.import_session(digest, on_conflict)
+            if session is None:
+                session = secrets.token_hex(16)
+                self.write_queue.save_import_session(digest, on_conflict, session)
+            total = validation['rows']
+            chunk_rows = max(total, 1) if on_conflict == 'fail' else IMPORT_CHUNK_ROWS
+
+            report = {'policy': on_conflict, 'imported': 0, 'skipped': 0, 'failed': 0, 'aborted': False,
+                      'errors': [], 'errors_truncated': False, 'replayed': 0}
+            uploaded = 0
+            failure = None
+            with ThreadPoolExecutor(IMPORT_PARALLEL_CHUNKS) as executor:
+                pending = set()
+                chunks = enumerate(iter_import_chunks(file_path, chunk_rows))
+                while True:
+                    # Se leen partes nuevas solo a medida que se liberan lugares, así en
+                    # memoria hay como mucho IMPORT_PARALLEL_CHUNKS partes.
+                    while failure is None and len(pending) < IMPORT_PARALLEL_CHUNKS:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        index, (first_line, count, body) = chunk
+                        future = executor.submit(self._upload_import_chunk, body, f'{session}-{index}',
+                                                 on_conflict, timeout)
+                        future.chunk = (first_line, count)
+                        pending.add(future)
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        first_line, count = future.chunk
+                        response = future.result()
+                        if 'imported' not in response:
+                            failure = failure or response['error']
+                            continue
+                        self._merge_import_report(report, response, first_line)
+                        if response.get('replayed'):
+                            report['replayed'] += count
+                        uploaded += count
+                        if progress_callback:
+                            progress_callback(uploaded, total)
+        except OSError as e:
+            return {'error': f'No se pudo leer el archivo: {e}'}
+
+        if failure is None:
+            self.write_queue.remove_import_session(digest, on_conflict)
+        if on_conflict == 'fail' and report['failed']:
+            report['aborted'] = True
+        if failure is not None:
+            report['error'] = (f"Se importaron {report['imported']} contactos y la importación se interrumpió: "
+                               f"{failure}. Volvé a importar el mismo archivo para continuar.")
+        elif report['aborted']:
+            report['error'] = (f"La importación se canceló por errores; no se importó ningún contacto "
+                               f"({report['failed']} errores).")
+        elif report['failed']:
+            report['error'] = (f"Se importaron {report['imported']} contactos. "
+                               f"Ocurrieron {report['failed']} errores en la importación.")
+        elif report['skipped']:
+            report['message'] = (f"Se importaron {report['imported']} contactos. "
+                                 f"Se omitieron {report['skipped']} contactos que ya existían.")
+        else:
+            report['message'] = f"Se importaron {report['imported']} contactos exitosamente."
+        if report['replayed']:
+            field = 'error' if 'error' in report else 'message'
+            report[field] += (f" {report['replayed']} filas ya se habían subido en un intento anterior "
+                              f"de esta importación y no se volvieron a aplicar.")
+        return report
+
+    def _upload_import_chunk(self, body, idempotency_key, on_conflict, timeout=None):
+        """Sube una parte de la importación. Como lleva clave de idempotencia se puede
+        reenviar sin riesgo si se corta la conexión; si el servidor ya la había
+        aplicado, la respuesta lleva 'replayed'."""
+        for attempt in range(IMPORT_CHUNK_RETRIES + 1):
+            if attempt:
+                time.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                response = self._request('POST', '/import', data=body,
+                                         params={'on_conflict': on_conflict},
+                                         headers={'Content-Type': 'text/csv', 'Idempotency-Key': idempotency_key},
+                                         timeout=timeout or self.transfer_timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = f'Error de conexión: {e}'
+                continue
+            if response.status_code in (502, 503, 504):
+                error = f'Error HTTP: {response.status_code}'
+                continue
+            try:
+                result = response.json()
+            except ValueError:
+                return {'error': f'Error HTTP: {response.status_code}'}
+            if response.headers.get('Idempotent-Replayed') == 'true':
+                result['replayed'] = True
+            return result
+        return {'error': error}
+
+    @staticmethod
+    def _merge_import_report(report, response, first_line):
+        """Suma el reporte de una parte al total, pasando sus líneas (2 es la primera
+        fila de la parte) a líneas del archivo."""
+        for field in ('imported', 'skipped', 'failed'):
+            report[field] += response.get(field, 0)
+        for error in response.get('errors', []):
+            if len(report['errors']) < MAX_IMPORT_ERRORS:
+                report['errors'].append(dict(error, line=error['line'] - 2 + first_line))
+            else:
+                report['errors_truncated'] = True
+        report['errors_truncated'] = report['errors_truncated'] or response.get('errors_truncated', False)
+
+
+class WorkerSignals(QObject):
+    """Señales de un RequestWorker. Se emiten desde un hilo del pool y Qt las
+    entrega en el hilo de la interfaz."""
+    finished = pyqtSignal(object, object)  # (worker, resultado)
+    progress = pyqtSignal(object, object)
+
+
+class RequestWorker(QRunnable):
+    """Ejecuta una llamada del ClientController fuera del hilo de la interfaz."""
+    def __init__(self, fn, *args, on_result=None, key=None, with_progress=False, **kwargs):
+        super().__init__()
+        # El pool no debe borrar el objeto al terminar: ClientApp guarda referencias
+        # para poder cancelar pedidos que todavía no empezaron.
+        self.setAutoDelete(False)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_result = on_result
+        self.key = key
+        self.signals = WorkerSignals()
+        if with_progress:
+            self.kwargs['progress_callback'] = self.signals.progress.emit
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            result = {'error': f'Error inesperado: {e}'}
+        self.signals.finished.emit(self, result)
+
+
+def contact_matches(contact, text):
+    """Indica si un contacto coincide con un texto de búsqueda, con el mismo criterio
+    que el servidor: subcadena sin distinguir mayúsculas, o los dígitos del texto
+    dentro de los dígitos del teléfono."""
+    text = text.casefold()
+    if any(text in contact[column].casefold() for column in ContactTableModel.COLUMNS):
+        return True
+    digits = ''.join(c for c in text if c.isdigit())
+    return bool(digits) and digits in ''.join(c for c in contact['telefono'] if c.isdigit())
+
+
+class ContactTableModel(QAbstractTableModel):
+    """Modelo de la tabla de contactos.
+
+    Los datos se guardan por columnas (una lista por campo, ordenadas por nombre
+    como las devuelve el servidor) y se piden de a una página cuando la vista
+    llega al final (canFetchMore/fetchMore). Después de agregar, actualizar o
+    borrar un contacto se modifica solo la fila afectada. La versión de cada
+    contacto se guarda aparte (no se muestra) para las escrituras condicionales.
+    """
+    COLUMNS = ('nombre', 'telefono', 'direccion')
+    HEADERS = ('Nombre', 'Teléfono', 'Dirección')
+
+    load_failed = pyqtSignal(str)
+    page_loaded = pyqtSignal()
+
+    def __init__(self, controller, run_in_background, parent=None):
+        super().__init__(parent)
+        self.controller = controller
+        self.run_in_background = run_in_background
+        self._columns = {column: [] for column in self.COLUMNS + ('version',)}
+        self._query = None
+        self._next_cursor = None
+        self._exhausted = True
+        self._loading = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._columns['nombre'])
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self._columns[self.COLUMNS[index.column()]][index.row()]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    @property
+    def query(self):
+        return self._query
+
+    def contact_at(self, row):
+        return {column: self._columns[column][row] for column in self.COLUMNS}
+
+    def load(self, query=None):
+        """Vacía la tabla y pide la primera página (de todos los contactos o de una búsqueda)."""
+        self.beginResetModel()
+        for values in self._columns.values():
+            values.clear()
+        self._query = query
+        self._next_cursor = None
+        self._exhausted = False
+        self._loading = False
+        self.endResetModel()
+        self.fetch_page()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted and not self._loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetch_page()
+
+    def fetch_page(self):
+        self._loading = True
+        self.run_in_background(self.controller.get_contacts_page, self._next_cursor, self._query,
+                               on_result=self.on_page_loaded, key='contacts')
+
+    def apply_sync(self, sync):
+        """Aplica a la tabla los cambios de una sincronización de la caché."""
+        if 'error' in sync:
+            self.load_failed.emit(sync['error'])
+        elif self._query is None:
+            if sync['reset']:
+                self.load()
+                return
+            for change in sync['changes']:
+                if change['op'] == 'delete':
+                    self.remove_contact(change['nombre'])
+                else:
+                    self.upsert_contact(change)
+
+    def on_page_loaded(self, page):
+        self._loading = False
+        if 'error' in page:
+            self._exhausted = True
+            self.load_failed.emit(page['error'])
+            return
+
+        contacts = page['contacts']
+        if contacts:
+            first = self.rowCount()
+            self.beginInsertRows(QModelIndex(), first, first + len(contacts) - 1)
+            for column, values in self._columns.items():
+                values.extend(contact.get(column) for contact in contacts)
+            self.endInsertRows()
+        self._next_cursor = page['next_cursor']
+        self._exhausted = self._next_cursor is None
+        self.page_loaded.emit()
+
+    def find_row(self, nombre):
+        names = self._columns['nombre']
+        row = bisect_left(names, nombre)
+        return row if row < len(names) and names[row] == nombre else None
+
+    def upsert_contact(self, contact):
+        """Agrega o actualiza la fila de un contacto sin recargar la tabla."""
+        row = self.find_row(contact['nombre'])
+        if row is not None:
+            self.update_contact(contact['nombre'], contact['telefono'], contact['direccion'], contact.get('version'))
+            return
+        if self._query and not contact_matches(contact, self._query):
+            return
+
+        names = self._columns['nombre']
+        row = bisect_left(names, contact['nombre'])
+        # Si cae después de la última fila cargada y quedan páginas, llegará con fetchMore
+        if row == len(names) and not self._exhausted:
+            return
+        self.beginInsertRows(QModelIndex(), row, row)
+        for column, values in self._columns.items():
+            values.insert(row, contact.get(column))
+        self.endInsertRows()
+
+    def update_contact(self, nombre, telefono=None, direccion=None, version=None):
+        row = self.find_row(nombre)
+        if row is None:
+            return
+        if telefono:
+            self._columns['telefono'][row] = telefono
+        if direccion:
+            self._columns['direccion'][row] = direccion
+        if version is not None:
+            self._columns['version'][row] = version
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+
+    def version_of(self, nombre):
+        """Versión conocida del contacto, o None si no está cargado o no se sabe."""
+        row = self.find_row(nombre)
+        return self._columns['version'][row] if row is not None else None
+
+    def remove_contact(self, nombre):
+        row = self.find_row(nombre)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        for values in self._columns.values():
+            del values[row]
+        self.endRemoveRows()
+
+
+class ContactFilterProxyModel(QSortFilterProxyModel):
+    """Ordena las filas cargadas y las filtra localmente con contact_matches."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._filter_text = ''
+
+    def set_filter_text(self, text):
+        self._filter_text = text.strip()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if not self._filter_text:
+            return True
+        return contact_matches(self.sourceModel().contact_at(source_row), self._filter_text)
 
 
 class MessageDialog(QDialog):
@@ -151,8 +1343,12 @@ class MessageDialog(QDialog):
             QMessageBox.warning(self, "Error de Validación", "El mensaje no puede estar vacío.")
             return
 
-        response = self.controller.send_message(message)
-        
+        self.send_button.setEnabled(False)
+        self.parent_window.run_in_background(self.controller.send_message, message,
+                                             on_result=self.on_message_sent)
+
+    def on_message_sent(self, response):
+        self.send_button.setEnabled(True)
         if response.get('status') == 'success':
             QMessageBox.information(self, "Mensaje Enviado", response.get('message'))
             self.parent_window.mostrar_video_agradecimiento()
@@ -197,19 +1393,34 @@ class UpdateContactDialog(QDialog):
             QMessageBox.warning(self, "Error de Validación", "Debes ingresar al menos el teléfono o la dirección para actualizar.")
             return
 
-        response = self.controller.update_contact(self.contact_name, telefono, direccion)
-
+        # Se envía la versión que muestra la tabla: si otro usuario cambió el
+        # contacto mientras tanto, el servidor no lo pisa (412) y se informa al
+        # enviar la cola
+        version = self.parent_window.contact_model.version_of(self.contact_name)
+        response = self.parent_window.queue_write('update', self.contact_name, telefono, direccion, version)
         if 'error' in response:
             QMessageBox.critical(self, "Error de Actualización", f"ERROR: {response['error']}")
         else:
-            QMessageBox.information(self, "Actualización Exitosa", f"Contacto {self.contact_name} actualizado correctamente.")
-            self.parent_window.get_all_contacts()
             self.close()
 
 class ClientApp(QWidget):
-    def __init__(self):
+    def __init__(self, server_status=None):
         super().__init__()
-        self.controller = ClientController()
+        # Las escrituras pendientes quedan en disco (una cola por agenda) para no
+        # perderlas si se cierra el cliente mientras el servidor no responde
+        book = os.environ.get('CONTACTS_BOOK') or None
+        queue_path = os.environ.get('CONTACTS_QUEUE_PATH',
+                                    f'pending_writes-{book}.db' if book else 'pending_writes.db')
+        self.controller = ClientController(cache_path=os.environ.get('CONTACTS_CACHE_PATH'),
+                                           book=book, queue_path=queue_path)
+
+        # Todas las llamadas al servidor corren en este pool para no congelar la
+        # ventana. active_requests guarda el último pedido de cada grupo (por
+        # ejemplo, lo que llena la tabla) para descartar los que quedaron viejos.
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(4)
+        self.workers = set()
+        self.active_requests = {}
         
         self.setWindowTitle('Agenda de Contactos Conased')
         self.setGeometry(100, 100, 800, 500)
@@ -264,23 +1475,81 @@ class ClientApp(QWidget):
         file_io_layout.addWidget(self.export_button)
         file_io_layout.addWidget(self.import_button)
 
-        self.table_widget = QTableWidget(self)
-        self.table_widget.setColumnCount(3)
-        self.table_widget.setHorizontalHeaderLabels(['Nombre', 'Teléfono', 'Dirección'])
-        self.table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.contact_model = ContactTableModel(self.controller, self.run_in_background, self)
+        self.contact_model.load_failed.connect(
+            lambda error: self.show_message("Error", error, QMessageBox.Icon.Critical))
+        self.contact_model.page_loaded.connect(lambda: startup_timer.finish('primeros_datos'))
+        self.contact_model.load_failed.connect(lambda error: startup_timer.finish('primeros_datos'))
+        self.proxy_model = ContactFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.contact_model)
+        self.search_input.textChanged.connect(self.proxy_model.set_filter_text)
+
+        # Búsqueda mientras se escribe: el pedido al servidor sale cuando se deja de
+        # escribir por SEARCH_DEBOUNCE_MS; mientras tanto se filtran las filas cargadas.
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.search_contact)
+        self.search_input.textChanged.connect(self.search_timer.start)
+
+        self.table_view = QTableView(self)
+        self.table_view.setModel(self.proxy_model)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table_view.verticalHeader().hide()
+        self.table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         
-        self.table_widget.cellDoubleClicked.connect(self.open_update_dialog_from_table)
+        self.table_view.doubleClicked.connect(self.open_update_dialog_from_table)
+
+        # Aviso mientras el servidor arranca (por ejemplo, aplicando migraciones)
+        self.server_label = QLabel("Esperando a que el servidor termine de arrancar...", self)
+        self.server_label.hide()
+        self.server_status = server_status
+        self.ready_timer = QTimer(self)
+        self.ready_timer.setSingleShot(True)
+        self.ready_timer.setInterval(READY_POLL_MS)
+        self.ready_timer.timeout.connect(self.check_server)
+
+        # Indicador de carga: barra indeterminada visible mientras haya pedidos en curso
+        self.loading_bar = QProgressBar(self)
+        self.loading_bar.setRange(0, 0)
+        self.loading_bar.setTextVisible(False)
+        self.loading_bar.setMaximumHeight(6)
+        self.loading_bar.hide()
+
+        # Escrituras encoladas que todavía no llegaron al servidor. flush_timer
+        # programa el próximo envío; si el servidor no responde, la espera entre
+        # intentos se duplica hasta WRITE_MAX_RETRY_MS.
+        self.pending_label = QLabel(self)
+        self.pending_label.hide()
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.timeout.connect(self.flush_writes)
+        self.flush_retry_ms = WRITE_RETRY_MS
 
         self.layout.addLayout(add_layout)
         self.layout.addLayout(search_layout)
         self.layout.addLayout(file_io_layout)
         self.layout.addWidget(self.get_all_button)
         self.layout.addWidget(self.report_button)
-        self.layout.addWidget(self.table_widget)
+        self.layout.addWidget(self.loading_bar)
+        self.layout.addWidget(self.server_label)
+        self.layout.addWidget(self.pending_label)
+        self.layout.addWidget(self.table_view)
         
         self.setLayout(self.layout)
-        
-        self.get_all_contacts()
+
+        # La primera carga sale cuando arranca el bucle de eventos (o cuando el
+        # servidor está listo, si se pasó server_status): la ventana se muestra
+        # vacía enseguida y las filas llegan en segundo plano.
+        self.update_pending_label(self.controller.pending_writes())
+        if server_status is None:
+            QTimer.singleShot(0, self.on_server_ready)
+        else:
+            self.server_label.show()
+            QTimer.singleShot(0, self.check_server)
     
     def load_stylesheet(self):
         style_file = QFile(os.path.join(os.path.dirname(__file__), 'style.qss'))
@@ -290,9 +1559,54 @@ class ClientApp(QWidget):
             style_file.close()
 
     def closeEvent(self, event: QCloseEvent):
+        self.ready_timer.stop()
+        self.thread_pool.clear()
+        # Último intento de enviar lo pendiente; si no llega, queda en la cola para la próxima vez
+        self.controller.flush_writes(timeout=2)
         self.controller.shutdown_server()
+        self.controller.close()
         event.accept()
 
+    def run_in_background(self, fn, *args, on_result=None, key=None, on_progress=None):
+        """Ejecuta fn(*args) en el pool de hilos y entrega el resultado a on_result
+        en el hilo de la interfaz.
+
+        Si se indica key, un pedido nuevo con la misma key reemplaza al anterior:
+        si el anterior todavía no empezó se cancela, y si ya está en curso su
+        resultado se descarta al llegar.
+        """
+        if key is not None:
+            previous = self.active_requests.get(key)
+            if previous is not None and self.thread_pool.tryTake(previous):
+                self.finish_worker(previous)
+
+        worker = RequestWorker(fn, *args, on_result=on_result, key=key,
+                               with_progress=on_progress is not None)
+        worker.signals.finished.connect(self.on_worker_finished)
+        if on_progress is not None:
+            worker.signals.progress.connect(on_progress)
+
+        self.workers.add(worker)
+        if key is not None:
+            self.active_requests[key] = worker
+        self.update_loading_indicator()
+        self.thread_pool.start(worker)
+
+    def on_worker_finished(self, worker, result):
+        superseded = worker.key is not None and self.active_requests.get(worker.key) is not worker
+        self.finish_worker(worker)
+        if not superseded and worker.on_result is not None:
+            worker.on_result(result)
+
+    def finish_worker(self, worker):
+        self.workers.discard(worker)
+        if worker.key is not None and self.active_requests.get(worker.key) is worker:
+            del self.active_requests[worker.key]
+        self.update_loading_indicator()
+
+    def update_loading_indicator(self):
+        self.loading_bar.setVisible(bool(self.workers))
+
     def show_message(self, title, message, icon):
         msg = QMessageBox(self)
         msg.setWindowTitle(title)
@@ -300,6 +1614,67 @@ class ClientApp(QWidget):
         msg.setIcon(icon)
         msg.exec()
 
+    def queue_write(self, op, nombre, telefono=None, direccion=None, version=None):
+        """Encola una escritura, la muestra en la tabla sin esperar al servidor y
+        programa el envío. Devuelve el resultado de controller.queue_write."""
+        response = self.controller.queue_write(op, nombre, telefono, direccion, version)
+        if 'error' in response:
+            return response
+        if op == 'delete':
+            self.contact_model.remove_contact(nombre)
+        elif response['contact'] is not None:
+            self.contact_model.upsert_contact(response['contact'])
+        else:
+            self.contact_model.update_contact(nombre, telefono, direccion, response['version'])
+        self.update_pending_label(response['pending'])
+        self.flush_timer.start(0)
+        return response
+
+    def flush_writes(self):
+        if 'flush' in self.active_requests or not self.controller.pending_writes():
+            return
+        self.run_in_background(self.controller.flush_writes, on_result=self.on_writes_flushed, key='flush')
+
+    def on_writes_flushed(self, response):
+        for change in response['changes']:
+            if change['op'] == 'delete':
+                self.contact_model.remove_contact(change['nombre'])
+            else:
+                self.contact_model.upsert_contact(change)
+
+        offline = 'error' in response
+        self.update_pending_label(response['pending'], offline)
+        if offline:
+            self.flush_timer.start(self.flush_retry_ms)
+            self.flush_retry_ms = min(self.flush_retry_ms * 2, WRITE_MAX_RETRY_MS)
+        else:
+            self.flush_retry_ms = WRITE_RETRY_MS
+            if response['pending']:
+                self.flush_timer.start(WRITE_RETRY_MS)
+
+        if response['conflicts']:
+            self.show_message("Cambios Rechazados", self.format_write_conflicts(response['conflicts']),
+                              QMessageBox.Icon.Warning)
+
+    def update_pending_label(self, pending, offline=False):
+        if not pending:
+            self.pending_label.hide()
+            return
+        text = f"{pending} cambio(s) sin enviar al servidor"
+        if offline:
+            text += " (sin conexión; se reintentará automáticamente)"
+        self.pending_label.setText(text)
+        self.pending_label.show()
+
+    def format_write_conflicts(self, conflicts, max_lines=20):
+        """Arma el texto a mostrar con las escrituras encoladas que el servidor rechazó."""
+        lines = [f"El servidor rechazó {len(conflicts)} cambio(s); la tabla ya muestra los datos actuales:"]
+        for conflict in conflicts[:max_lines]:
+            lines.append(f"{conflict['nombre']}: {conflict['error']}")
+        if len(conflicts) > max_lines:
+            lines.append("...")
+        return "\n".join(lines)
+
     def add_contact(self):
         nombre = self.input_nombre.text().strip()
         telefono = self.input_telefono.text().strip()
@@ -309,18 +1684,19 @@ class ClientApp(QWidget):
             self.show_message("Error de Validación", "Todos los campos (nombre, teléfono, dirección) son obligatorios.", QMessageBox.Icon.Warning)
             return
 
-        response = self.controller.add_contact(nombre, telefono, direccion)
+        response = self.queue_write('create', nombre, telefono, direccion)
         if 'error' in response:
             self.show_message("Error al Agregar", response['error'], QMessageBox.Icon.Critical)
-        else:
-            self.show_message("Éxito", f"Contacto '{nombre}' agregado correctamente.", QMessageBox.Icon.Information)
-            self.get_all_contacts()
+            return
+        self.input_nombre.clear()
+        self.input_telefono.clear()
+        self.input_direccion.clear()
 
     def search_contact(self):
+        self.search_timer.stop()
         query = self.search_input.text().strip()
         if query:
-            response = self.controller.search_contact(query)
-            self.display_response(response)
+            self.contact_model.load(query)
         else:
             self.get_all_contacts()
 
@@ -336,42 +1712,78 @@ class ClientApp(QWidget):
                                      QMessageBox.StandardButton.No)
                                      
         if reply == QMessageBox.StandardButton.Yes:
-            response = self.controller.delete_contact(nombre)
+            response = self.queue_write('delete', nombre, version=self.contact_model.version_of(nombre))
             if 'error' in response:
                 self.show_message("Error al Eliminar", response['error'], QMessageBox.Icon.Critical)
-            else:
-                self.show_message("Éxito", response['message'], QMessageBox.Icon.Information)
-                self.get_all_contacts()
 
     def show_update_dialog(self):
         nombre = self.search_input.text().strip()
         if not nombre:
             self.show_message("Error de Validación", "Por favor, ingrese un nombre para actualizar.", QMessageBox.Icon.Warning)
             return
-        
-        search_result = self.controller.search_contact(nombre)
+
+        # Si el contacto ya se conoce localmente no hace falta consultar al servidor
+        if self.contact_model.find_row(nombre) is not None or self.controller.cache.get(nombre) is not None:
+            UpdateContactDialog(self.controller, nombre, self).exec()
+            return
+        self.run_in_background(self.controller.search_contact, nombre,
+                               on_result=lambda search_result: self.on_update_search_result(nombre, search_result))
+
+    def on_update_search_result(self, nombre, search_result):
         if 'error' in search_result:
             self.show_message("Contacto No Encontrado", search_result['error'], QMessageBox.Icon.Critical)
         else:
             dialog = UpdateContactDialog(self.controller, nombre, self)
             dialog.exec()
             
-    def open_update_dialog_from_table(self, row, column):
-        item = self.table_widget.item(row, 0)
-        if item:
-            contact_name = item.text()
+    def open_update_dialog_from_table(self, index):
+        contact_name = self.proxy_model.index(index.row(), 0).data()
+        if contact_name:
             dialog = UpdateContactDialog(self.controller, contact_name, self)
             dialog.exec()
 
+    def check_server(self):
+        self.run_in_background(self.server_status, on_result=self.on_server_status, key='ready')
+
+    def on_server_status(self, status):
+        if status == 'starting':
+            self.ready_timer.start()
+            return
+        self.server_label.hide()
+        if status == 'ready':
+            startup_timer.mark('servidor_listo')
+            self.on_server_ready()
+        else:
+            self.show_message("Error", "El servidor terminó antes de estar listo. Los cambios que se "
+                              "hagan quedan guardados y se enviarán cuando vuelva a estar disponible.",
+                              QMessageBox.Icon.Critical)
+
+    def on_server_ready(self):
+        self.get_all_contacts()
+        # Lo que quedó sin enviar de la sesión anterior
+        self.flush_timer.start(0)
+
     def get_all_contacts(self):
-        response = self.controller.get_all_contacts()
-        self.display_response(response)
+        self.contact_model.load()
+
+    def refresh_contacts(self):
+        """Trae solo los cambios desde la última sincronización y los aplica a la tabla."""
+        if self.contact_model.query is None:
+            self.run_in_background(self.controller.sync_contacts,
+                                   on_result=self.contact_model.apply_sync, key='sync')
+        else:
+            self.contact_model.load(self.contact_model.query)
 
     def show_message_dialog(self):
         dialog = MessageDialog(self.controller, self)
         dialog.exec()
         
     def mostrar_video_agradecimiento(self):
+        # QtMultimedia es lo más lento de cargar (y arrastra las bibliotecas de audio
+        # y video del sistema), así que se importa recién la primera vez que se usa.
+        from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
+        from PyQt6.QtMultimediaWidgets import QVideoWidget
+
         dialogo_video = QDialog(self)
         dialogo_video.setWindowTitle("Mensaje Recibido")
         dialogo_video.setFixedSize(800, 600)
@@ -401,69 +1813,99 @@ class ClientApp(QWidget):
         dialogo_video.exec()
         
     def detener_video(self):
-        if self.media_player.playbackState() == QMediaPlayer.PlaybackState.PlayingState:
+        if self.media_player.playbackState() == self.media_player.PlaybackState.PlayingState:
             self.media_player.stop()
 
-    def display_response(self, response):
-        self.table_widget.setRowCount(0)
-
-        if 'error' in response:
-            self.show_message("Error", response["error"], QMessageBox.Icon.Critical)
-        elif isinstance(response, list):
-            self.table_widget.setRowCount(len(response))
-            for i, contact in enumerate(response):
-                self.table_widget.setItem(i, 0, QTableWidgetItem(contact.get('nombre', '')))
-                self.table_widget.setItem(i, 1, QTableWidgetItem(contact.get('telefono', '')))
-                self.table_widget.setItem(i, 2, QTableWidgetItem(contact.get('direccion', '')))
-        elif 'message' in response:
-            self.show_message("Información", response["message"], QMessageBox.Icon.Information)
-        else:
-            self.show_message("Información", str(response), QMessageBox.Icon.Information)
-            
     def export_contacts_to_file(self):
         """Maneja la lógica de exportar contactos."""
-        response = self.controller.export_contacts()
-        if 'error' in response:
-            self.show_message("Error de Exportación", response['error'], QMessageBox.Icon.Critical)
-            return
-
         file_dialog = QFileDialog(self)
         file_path, _ = file_dialog.getSaveFileName(self, "Guardar contactos", "contacts.csv", "Archivos CSV (*.csv)")
 
-        if file_path:
-            try:
-                with open(file_path, 'w', newline='', encoding='utf-8') as file:
-                    file.write(response)
-                self.show_message("Exportación Exitosa", f"Contactos exportados a:\n{file_path}", QMessageBox.Icon.Information)
-            except Exception as e:
-                self.show_message("Error de Archivo", f"No se pudo guardar el archivo: {e}", QMessageBox.Icon.Critical)
+        if not file_path:
+            return
+
+        self.export_progress = QProgressDialog("Exportando contactos...", None, 0, 0, self)
+        self.export_progress.setWindowTitle("Exportar a CSV")
+        self.export_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.export_progress.setMinimumDuration(300)
+        self.export_button.setEnabled(False)
+
+        self.run_in_background(self.controller.export_contacts, file_path,
+                               on_result=self.on_contacts_exported,
+                               on_progress=self.update_export_progress)
+
+    def update_export_progress(self, written_rows, total):
+        if total:
+            self.export_progress.setMaximum(total)
+            self.export_progress.setValue(min(written_rows, total))
+        self.export_progress.setLabelText(f"Exportando contactos... {written_rows} filas")
+
+    def on_contacts_exported(self, response):
+        self.export_progress.close()
+        self.export_button.setEnabled(True)
+        if 'error' in response:
+            self.show_message("Error de Exportación", response['error'], QMessageBox.Icon.Critical)
+        else:
+            self.show_message("Exportación Exitosa", response['message'], QMessageBox.Icon.Information)
 
     def import_contacts_from_file(self):
         """Maneja la lógica de importar contactos."""
         file_dialog = QFileDialog(self)
         file_path, _ = file_dialog.getOpenFileName(self, "Seleccionar archivo para importar", "", "Archivos CSV (*.csv)")
 
-        if file_path:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    contacts_csv_data = file.read()
-                
-                response = self.controller.import_contacts(contacts_csv_data)
-                
-                if 'error' in response:
-                    self.show_message("Error de Importación", response['error'], QMessageBox.Icon.Critical)
-                else:
-                    self.show_message("Importación Exitosa", response['message'], QMessageBox.Icon.Information)
-                    self.get_all_contacts()
-            except Exception as e:
-                self.show_message("Error de Archivo", f"No se pudo leer el archivo: {e}", QMessageBox.Icon.Critical)
+        if not file_path:
+            return
+
+        self.import_progress = QProgressDialog("Validando archivo...", None, 0, 0, self)
+        self.import_progress.setWindowTitle("Importar desde CSV")
+        self.import_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.import_progress.setMinimumDuration(300)
+        self.import_button.setEnabled(False)
+        self.run_in_background(self.controller.import_contacts, file_path,
+                               on_result=self.on_contacts_imported,
+                               on_progress=self.update_import_progress)
+
+    def update_import_progress(self, rows, total):
+        if total is None:
+            self.import_progress.setLabelText(f"Validando archivo... {rows} filas")
+            return
+        self.import_progress.setMaximum(total)
+        self.import_progress.setValue(min(rows, total))
+        self.import_progress.setLabelText(f"Importando contactos... {rows} de {total} filas")
+
+    def on_contacts_imported(self, response):
+        self.import_progress.close()
+        self.import_button.setEnabled(True)
+        if 'error' in response:
+            self.show_message("Error de Importación", self.format_import_report(response), QMessageBox.Icon.Critical)
+        else:
+            self.show_message("Importación Exitosa", self.format_import_report(response), QMessageBox.Icon.Information)
+        if response.get('imported'):
+            self.refresh_contacts()
+
+    def format_import_report(self, response, max_lines=20):
+        """Arma el texto a mostrar a partir del reporte de importación del servidor."""
+        lines = [response.get('error') or response.get('message', '')]
+        errors = response.get('errors', [])
+        for error in errors[:max_lines]:
+            lines.append(f"Línea {error['line']}: {error['message']}")
+        if len(errors) > max_lines or response.get('errors_truncated'):
+            lines.append("...")
+        return "\n".join(lines)
 
 
-def run_client():
+# Abre la ventana y devuelve el código de salida. Si se pasa server_status, la
+# ventana se muestra enseguida y lo llama en segundo plano cada READY_POLL_MS hasta
+# que devuelve 'ready' ('starting' mientras el servidor arranca, 'stopped' si
+# terminó; ver main.py) antes de pedir los contactos.
+def run_client(server_status=None):
     app = QApplication(sys.argv)
-    window = ClientApp()
+    startup_timer.mark('qapplication')
+    window = ClientApp(server_status)
+    startup_timer.mark('ventana')
     window.show()
-    sys.exit(app.exec())
+    QTimer.singleShot(0, lambda: startup_timer.mark('visible'))
+    return app.exec()
 
 if __name__ == "__main__":
-    run_client()
\ No newline at end of file
+    sys.exit(run_client())
\ No newline at end of file
@@ -1,29 +1,116 @@
-import threading
 import time
+# Momento en que arranca el lanzador: origen de la medición del arranque
+LAUNCH_START = time.perf_counter()
+
+import argparse
 import os
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
 from pathlib import Path
 
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 5000
+SERVER_URL = f'http://{SERVER_HOST}:{SERVER_PORT}'
+
+# Segundos entre consultas a /ready mientras el servidor arranca
+READY_POLL_SECONDS = 0.1
+
+# Segundos que se espera a que el servidor termine después de pedirle que se apague
+SHUTDOWN_TIMEOUT = 10
 
-# Ejecutar el servidor Flask
+# Hilos de waitress cuando el servidor corre dentro del mismo proceso que el cliente
+IN_PROCESS_THREADS = 4
+
+
+# Ejecutar el servidor (waitress/gunicorn según servidor.py) en otro proceso
 def run_server():
     server_path = Path(__file__).parent / 'servidor.py'
-    os.system(f'python "{server_path}"')
+    return subprocess.Popen([sys.executable, str(server_path)])
 
-# Ejecutar el cliente PyQt6
-def run_client():
-    server_path = Path(__file__).parent / 'cliente.py'
-    os.system(f'python "{server_path}"')
+# Ejecutar el servidor en un hilo de este proceso: evita arrancar otro intérprete
+# y volver a cargar las bibliotecas. Las migraciones también corren en el hilo, así
+# la ventana no las espera. El hilo termina cuando el cliente pide /shutdown.
+def run_server_in_process(threads=IN_PROCESS_THREADS):
+    import servidor
 
-if __name__ == "__main__":
-    # Crear hilos para ejecutar el servidor y el cliente
-    server_thread = threading.Thread(target=run_server)
-    client_thread = threading.Thread(target=run_client)
+    def serve():
+        servidor.init_db()
+        servidor.run_waitress(SERVER_HOST, SERVER_PORT, threads)
 
-    # Iniciar los hilos
+    server_thread = threading.Thread(target=serve, name='servidor', daemon=True)
     server_thread.start()
-    time.sleep(2)  # Dar tiempo para que el servidor arranque antes de que el cliente se conecte
-    client_thread.start()
+    return server_thread
+
+# Estado del servidor para el cliente: 'ready' cuando /ready responde, 'starting'
+# mientras sigue arrancando y 'stopped' si terminó. server_alive() indica si el
+# servidor sigue corriendo.
+def server_status(server_alive):
+    if not server_alive():
+        return 'stopped'
+    try:
+        with urllib.request.urlopen(f'{SERVER_URL}/ready', timeout=1) as response:
+            if response.status == 200:
+                return 'ready'
+    except (urllib.error.URLError, OSError):
+        pass
+    return 'starting'
 
-    # Esperar que ambos hilos terminen (si es necesario)
-    server_thread.join()
-    client_thread.join()
\ No newline at end of file
+# Consulta /ready hasta que el servidor responde o termina. No hay plazo: con una
+# base grande las migraciones que se aplican antes de escuchar pueden tardar, y
+# cortar el servidor a mitad de una la deshace y la repite en el próximo arranque.
+def wait_until_ready(server_alive):
+    while (status := server_status(server_alive)) == 'starting':
+        time.sleep(READY_POLL_SECONDS)
+    return status == 'ready'
+
+# Pide al servidor que se apague cuando se cierra el cliente. Si el cliente se
+# cerró antes de que el servidor escuchara, su /shutdown no llegó: se espera a que
+# termine de arrancar y se lo pide ahora, en lugar de cortarlo a mitad de una migración.
+def request_shutdown(server_alive):
+    if not wait_until_ready(server_alive):
+        return
+    try:
+        request = urllib.request.Request(f'{SERVER_URL}/shutdown', method='POST')
+        urllib.request.urlopen(request, timeout=2).close()
+    except (urllib.error.URLError, OSError):
+        pass  # ya se estaba apagando
+
+def main():
+    parser = argparse.ArgumentParser(description='Lanza el servidor y el cliente de la agenda')
+    parser.add_argument('--single-process', action='store_true',
+                        default=os.environ.get('CONTACTS_SINGLE_PROCESS', '') not in ('', '0'),
+                        help='corre el servidor en un hilo de este proceso en lugar de otro intérprete')
+    args = parser.parse_args()
+
+    if args.single_process:
+        server_thread = run_server_in_process()
+        server_alive = server_thread.is_alive
+    else:
+        server_process = run_server()
+        server_alive = lambda: server_process.poll() is None
+
+    # El cliente corre en este proceso y se importa después de lanzar el servidor:
+    # mientras se cargan Qt y requests y se arma la ventana, el servidor ya arranca.
+    import cliente
+
+    cliente.startup_timer.extend_back(LAUNCH_START, 'servidor' if args.single_process else 'lanzador')
+    exit_code = cliente.run_client(server_status=lambda: server_status(server_alive))
+
+    # El cliente apaga el servidor al cerrarse; se espera a que termine. Solo se
+    # fuerza la terminación de un servidor que ya escuchaba: lo que sigue migrando
+    # en segundo plano son lotes que se retoman en el próximo arranque.
+    request_shutdown(server_alive)
+    if args.single_process:
+        server_thread.join(timeout=SHUTDOWN_TIMEOUT)
+    else:
+        try:
+            server_process.wait(timeout=SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            server_process.terminate()
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
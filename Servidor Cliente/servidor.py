@@ -1,24 +1,182 @@
 # servidor.py
 
+import argparse
+import atexit
+import base64
+import codecs
+import cProfile
 import json
+import multiprocessing
 import os
+import random
 import sqlite3
 import signal
 import io
 import csv
-from flask import Flask, jsonify, request, make_response
+import glob
+import gzip
+import importlib.util
+import queue
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.request import pathname2url
+from flask import Flask, jsonify, request, g, Response
 from flask_cors import CORS
 
+# Dependencias opcionales: sin ellas no se ofrece compresión brotli ni MessagePack,
+# y la distancia de edición de la búsqueda aproximada se calcula en Python
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    from rapidfuzz.distance import Levenshtein
+except ImportError:
+    Levenshtein = None
+
 app = Flask(__name__)
 CORS(app) # Habilitar CORS para toda la aplicación
 
-# Define la ruta de la base de datos en una variable
+# Define la ruta de la base de datos en una variable. Es la agenda principal; las
+# agendas con nombre (/books/<book>/...) tienen cada una su archivo en BOOKS_DIR.
 DATABASE_PATH = 'contacts.db'
 
-# Función para inicializar la base de datos
-def init_db():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+# Configuración del pool de conexiones y de SQLite. Se puede cambiar al arrancar
+# con variables de entorno (por ejemplo CONTACTS_DB_POOL_SIZE=16).
+DB_POOL_SIZE = int(os.environ.get('CONTACTS_DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('CONTACTS_DB_POOL_TIMEOUT', 10))
+DB_PRAGMAS = {
+    'synchronous': os.environ.get('CONTACTS_DB_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('CONTACTS_DB_CACHE_SIZE', -16000)),  # negativo = KiB
+    'mmap_size': int(os.environ.get('CONTACTS_DB_MMAP_SIZE', 64 * 1024 * 1024)),
+    'busy_timeout': int(os.environ.get('CONTACTS_DB_BUSY_TIMEOUT', 5000)),  # milisegundos
+}
+
+# Longitud mínima de búsqueda para usar el índice de trigramas (FTS5 trigram)
+MIN_LONGITUD_FTS = 3
+
+# Expresión SQL que deja solo los dígitos de un teléfono ("+555 12-34" -> "5551234").
+# Se usa en los triggers, por eso no puede depender de funciones definidas en Python.
+def sql_solo_digitos(columna):
+    expresion = columna
+    for caracter in (' ', '-', '+', '(', ')', '.', '/'):
+        expresion = f"REPLACE({expresion}, '{caracter}', '')"
+    return expresion
+
+# Clave canónica de un teléfono: solo sus dígitos, tomando el prefijo
+# internacional "00" como equivalente a "+" ("+54 11 555-1234" y "0054 11 5551234"
+# dan "54115551234"). Devuelve None si el texto no tiene ningún dígito.
+def normalizar_telefono(telefono):
+    texto = telefono.strip()
+    digitos = re.sub(r'[^0-9]', '', texto)
+    if texto.startswith('00'):
+        digitos = digitos[2:]
+    return digitos or None
+
+# El teléfono puede llegar como número en el JSON ({"telefono": 1155551234}) y se
+# toma como texto. Devuelve None si no es texto ni un número entero.
+def telefono_como_texto(telefono):
+    if isinstance(telefono, int) and not isinstance(telefono, bool):
+        return str(telefono)
+    return telefono if isinstance(telefono, str) else None
+
+# Pasa un texto a minúsculas, sin acentos ni signos: "José-María Núñez" -> "jose maria nunez"
+def plegar_texto(texto):
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    sin_acentos = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return re.sub(r'[\W_]+', ' ', sin_acentos).strip()
+
+# Reglas de pronunciación del español, en orden, para la clave fonética
+REGLAS_FONETICAS = [(re.compile(patron), reemplazo) for patron, reemplazo in (
+    (r'ph', 'f'),
+    (r'ch', 'x'),
+    (r'qu(?=[ei])', 'k'),
+    (r'g(?=[ei])', 'j'),
+    (r'gu(?=[ei])', 'g'),
+    (r'c(?=[ei])', 's'),
+    (r'll', 'y'),
+    (r'[cq]', 'k'),
+    (r'z', 's'),
+    (r'[vw]', 'b'),
+    (r'h', ''),
+    (r'y$', 'i'),
+)]
+
+# Clave fonética de una palabra ya plegada: se aplican las reglas, se juntan las
+# letras repetidas (no los dígitos) y se conserva la primera letra y, del resto, solo las consonantes.
+# "gonzalez", "gonzales" y "gonsalez" dan "gnsls"; "vazquez" y "basques", "bsks".
+@lru_cache(maxsize=65536)
+def clave_fonetica(palabra):
+    for patron, reemplazo in REGLAS_FONETICAS:
+        palabra = patron.sub(reemplazo, palabra)
+    palabra = re.sub(r'(\D)\1+', r'\1', palabra)
+    return palabra[:1] + re.sub(r'[aeiou]', '', palabra[1:])
+
+# Las claves de al menos esta longitud se indexan también con una letra menos
+MIN_LONGITUD_VARIANTES = 2
+
+# Claves con las que se indexa y se busca una palabra: su clave fonética y las que
+# resultan de quitarle una letra. Dos palabras cuyas claves difieren
+# en una letra (agregada, faltante o cambiada) comparten alguna.
+def claves_palabra(palabra):
+    clave = clave_fonetica(palabra)
+    if not clave:
+        return []
+    variantes = set()
+    if len(clave) >= MIN_LONGITUD_VARIANTES:
+        variantes = {clave[:i] + clave[i + 1:] for i in range(len(clave))}
+    return [clave] + sorted(variantes - {clave})
+
+def claves_nombre(nombre):
+    return {clave for palabra in plegar_texto(nombre).split() for clave in claves_palabra(palabra)}
+
+# --- Migraciones del esquema ---
+#
+# Cada cambio de esquema es una migración numerada. Las aplicadas quedan
+# registradas en la tabla schema_version, así que al arrancar solo se ejecutan las
+# pendientes, en orden. Las bases anteriores a este registro (sin schema_version)
+# pasan por todas: cada migración revisa lo que ya existe antes de crearlo.
+#
+# Una migración es una función migracion(cursor, progreso) que se ejecuta dentro de
+# una transacción junto con la actualización de schema_version. Devuelve None cuando
+# terminó; las migraciones por lotes devuelven en cambio su progreso (un entero que
+# reciben en la siguiente llamada) y se vuelven a llamar, con un commit por lote.
+
+# Filas que se procesan por transacción en las migraciones por lotes
+MIGRATION_BATCH_SIZE = 5000
+
+# Pausa entre lotes de las migraciones en segundo plano, para dejar escribir a las peticiones
+MIGRATION_PAUSE_SECONDS = 0.01
+
+def columnas_tabla(cursor, tabla):
+    cursor.execute(f'PRAGMA table_info({tabla})')
+    return [fila[1] for fila in cursor.fetchall()]
+
+def existe_tabla(cursor, nombre):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nombre,))
+    return cursor.fetchone() is not None
+
+# Indica si alguna restricción o índice UNIQUE de la tabla es exactamente sobre esa columna
+def columna_unica(cursor, tabla, columna):
+    cursor.execute(f'PRAGMA index_list({tabla})')
+    for indice in cursor.fetchall():
+        if indice[2]:  # unique
+            cursor.execute(f"PRAGMA index_info('{indice[1]}')")
+            if [fila[2] for fila in cursor.fetchall()] == [columna]:
+                return True
+    return False
+
+# 1. La tabla original de contactos
+def migracion_tabla_contactos(cursor, progreso):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS contactos (
             nombre TEXT PRIMARY KEY,
@@ -26,163 +184,2511 @@ def init_db():
             direccion TEXT NOT NULL
         )
     ''')
+
+# 2. Las bases creadas con una versión anterior del esquema no tienen la
+# restricción UNIQUE del teléfono; las rutas dependen de ella para detectar
+# teléfonos repetidos, así que se agrega como índice único.
+def migracion_telefono_unico(cursor, progreso):
+    if columna_unica(cursor, 'contactos', 'telefono'):
+        return
+    try:
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS contactos_telefono_unico ON contactos (telefono)')
+    except sqlite3.IntegrityError:
+        print("Hay teléfonos repetidos en la base: no se pudo crear el índice único de teléfonos.")
+
+# 3. Índice de búsqueda (tabla virtual FTS5 con trigramas) y los triggers que lo
+# mantienen sincronizado con `contactos`. Si ya hay contactos, los indexa por lotes
+# la migración 13, en segundo plano; mientras tanto queda contactos_fts_pendiente y
+# se sigue buscando con LIKE. Si SQLite no soporta FTS5 la migración igual termina
+# y se usa LIKE.
+def migracion_indice_busqueda(cursor, progreso):
+    if existe_tabla(cursor, 'contactos_fts'):
+        crear_triggers_busqueda(cursor)
+        return
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE contactos_fts USING fts5(
+                nombre, telefono, direccion, telefono_digitos,
+                tokenize = 'trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Índice de búsqueda no disponible, se usará LIKE: {e}")
+        return
+    crear_triggers_busqueda(cursor)
+    cursor.execute('SELECT 1 FROM contactos LIMIT 1')
+    if cursor.fetchone():
+        cursor.execute('CREATE TABLE IF NOT EXISTS contactos_fts_pendiente (activa INTEGER)')
+
+def crear_triggers_busqueda(cursor):
+    # Mientras esta tabla tenga filas el trigger de inserción no indexa fila por fila:
+    # la importación masiva la usa dentro de su transacción y después indexa todas
+    # las filas nuevas con un solo INSERT ... SELECT, que es mucho más rápido.
+    cursor.execute('CREATE TABLE IF NOT EXISTS contactos_fts_pausa (activa INTEGER)')
+
+    digitos_new = sql_solo_digitos('new.telefono')
+    # El trigger de actualización se recrea para que las bases anteriores también
+    # lo tengan limitado a las columnas visibles (ver migracion_completar_telefono_normalizado).
+    cursor.execute('DROP TRIGGER IF EXISTS contactos_fts_update')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS contactos_fts_insert AFTER INSERT ON contactos
+        WHEN NOT EXISTS (SELECT 1 FROM contactos_fts_pausa) BEGIN
+            INSERT INTO contactos_fts (rowid, nombre, telefono, direccion, telefono_digitos)
+            VALUES (new.rowid, new.nombre, new.telefono, new.direccion, {digitos_new});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_fts_delete AFTER DELETE ON contactos BEGIN
+            DELETE FROM contactos_fts WHERE rowid = old.rowid;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS contactos_fts_update
+        AFTER UPDATE OF nombre, telefono, direccion ON contactos BEGIN
+            DELETE FROM contactos_fts WHERE rowid = old.rowid;
+            INSERT INTO contactos_fts (rowid, nombre, telefono, direccion, telefono_digitos)
+            VALUES (new.rowid, new.nombre, new.telefono, new.direccion, {digitos_new});
+        END
+    ''')
+
+# Agrega al índice de búsqueda las filas de `contactos` con rowid mayor al dado
+def indexar_contactos_desde(cursor, rowid):
+    cursor.execute(f'''
+        INSERT INTO contactos_fts (rowid, nombre, telefono, direccion, telefono_digitos)
+        SELECT rowid, nombre, telefono, direccion, {sql_solo_digitos('telefono')}
+        FROM contactos WHERE rowid > ?
+    ''', (rowid,))
+
+# 4. Registro de cambios: cada inserción, actualización o borrado en `contactos`
+# (también los de /import) agrega una fila con una revisión que solo crece.
+def migracion_registro_cambios(cursor, progreso):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contactos_cambios (
+            rev INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            operacion TEXT NOT NULL
+        )
+    ''')
+    crear_triggers_cambios(cursor)
+
+def crear_triggers_cambios(cursor):
+    cursor.execute('DROP TRIGGER IF EXISTS contactos_cambios_update')  # ver crear_triggers_busqueda
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_cambios_insert AFTER INSERT ON contactos BEGIN
+            INSERT INTO contactos_cambios (nombre, operacion) VALUES (new.nombre, 'upsert');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_cambios_update
+        AFTER UPDATE OF nombre, telefono, direccion ON contactos BEGIN
+            INSERT INTO contactos_cambios (nombre, operacion)
+            SELECT old.nombre, 'delete' WHERE old.nombre != new.nombre;
+            INSERT INTO contactos_cambios (nombre, operacion) VALUES (new.nombre, 'upsert');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_cambios_delete AFTER DELETE ON contactos BEGIN
+            INSERT INTO contactos_cambios (nombre, operacion) VALUES (old.nombre, 'delete');
+        END
+    ''')
+
+# 5. Columna con la clave normalizada del teléfono (ver normalizar_telefono)
+def migracion_columna_telefono_normalizado(cursor, progreso):
+    if 'telefono_normalizado' not in columnas_tabla(cursor, 'contactos'):
+        cursor.execute('ALTER TABLE contactos ADD COLUMN telefono_normalizado TEXT')
+
+# 6. Completa telefono_normalizado en las filas existentes, por lotes. La
+# actualización no dispara los triggers de búsqueda ni de cambios (son "UPDATE OF"
+# de las otras columnas). Mientras no termina, las búsquedas por teléfono no
+# encuentran las filas que faltan completar.
+def migracion_completar_telefono_normalizado(cursor, progreso):
+    cursor.execute('''
+        SELECT rowid, telefono FROM contactos
+        WHERE rowid > ? AND telefono_normalizado IS NULL
+        ORDER BY rowid LIMIT ?
+    ''', (progreso or 0, MIGRATION_BATCH_SIZE))
+    filas = cursor.fetchall()
+    if not filas:
+        return None
+    cursor.executemany('UPDATE contactos SET telefono_normalizado = ? WHERE rowid = ?',
+                       [(normalizar_telefono(telefono), rowid) for rowid, telefono in filas])
+    return filas[-1][0]
+
+# 7. Índice único de telefono_normalizado. Si hay teléfonos que solo difieren en el
+# formato se avisa y el índice queda sin UNIQUE, para que las búsquedas por
+# teléfono igual lo usen.
+def migracion_indice_telefono_normalizado(cursor, progreso):
+    if columna_unica(cursor, 'contactos', 'telefono_normalizado'):
+        return
+    try:
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS contactos_telefono_normalizado_unico
+            ON contactos (telefono_normalizado)
+        ''')
+    except sqlite3.IntegrityError:
+        cursor.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM contactos WHERE telefono_normalizado IS NOT NULL
+                GROUP BY telefono_normalizado HAVING COUNT(*) > 1
+            )
+        ''')
+        print(f"Hay {cursor.fetchone()[0]} teléfonos repetidos con distinto formato: "
+              "no se pudo crear el índice único de teléfonos normalizados.")
+        cursor.execute('CREATE INDEX IF NOT EXISTS contactos_telefono_normalizado ON contactos (telefono_normalizado)')
+
+# 8. Identificador entero: `contactos` pasa a tener id INTEGER PRIMARY KEY (el
+# nombre sigue siendo único). Sin él, el rowid que usan el índice de búsqueda y la
+# importación puede renumerarse con un VACUUM; además es una clave más barata para
+# ordenar y unir tablas. También se agrega el índice (direccion, nombre) para el
+# listado ordenado por dirección.
+#
+# La tabla se reconstruye sin bloquearla: se crea contactos_nueva con sus índices,
+# unos triggers copian ahí cada escritura sobre `contactos` y las filas existentes
+# se copian por lotes (el id es el rowid anterior, así el índice de búsqueda sigue
+# valiendo). Al final, en una sola transacción corta, se reemplaza la tabla y se
+# recrean sus triggers. Progreso: None = sin empezar, luego el último rowid copiado.
+def migracion_identificador_entero(cursor, progreso):
+    columnas = 'nombre, telefono, direccion, telefono_normalizado'
+    if progreso is None:
+        if 'id' in columnas_tabla(cursor, 'contactos'):
+            return None
+        telefono_unico = 'UNIQUE' if columna_unica(cursor, 'contactos', 'telefono') else ''
+        normalizado_unico = 'UNIQUE' if columna_unica(cursor, 'contactos', 'telefono_normalizado') else ''
+        cursor.execute('DROP TABLE IF EXISTS contactos_nueva')
+        cursor.execute(f'''
+            CREATE TABLE contactos_nueva (
+                id INTEGER PRIMARY KEY,
+                nombre TEXT NOT NULL UNIQUE,
+                telefono TEXT NOT NULL {telefono_unico},
+                direccion TEXT NOT NULL,
+                telefono_normalizado TEXT {normalizado_unico}
+            )
+        ''')
+        if not normalizado_unico:
+            cursor.execute('CREATE INDEX contactos_nueva_telefono_normalizado ON contactos_nueva (telefono_normalizado)')
+        cursor.execute('CREATE INDEX contactos_direccion ON contactos_nueva (direccion, nombre)')
+        valores_new = 'new.rowid, new.nombre, new.telefono, new.direccion, new.telefono_normalizado'
+        cursor.execute(f'''
+            CREATE TRIGGER contactos_copia_insert AFTER INSERT ON contactos BEGIN
+                INSERT OR REPLACE INTO contactos_nueva (id, {columnas}) VALUES ({valores_new});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER contactos_copia_update AFTER UPDATE ON contactos BEGIN
+                DELETE FROM contactos_nueva WHERE id = old.rowid;
+                INSERT OR REPLACE INTO contactos_nueva (id, {columnas}) VALUES ({valores_new});
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER contactos_copia_delete AFTER DELETE ON contactos BEGIN
+                DELETE FROM contactos_nueva WHERE id = old.rowid;
+            END
+        ''')
+        return 0
+
+    cursor.execute('SELECT MAX(rowid) FROM (SELECT rowid FROM contactos WHERE rowid > ? ORDER BY rowid LIMIT ?)',
+                   (progreso, MIGRATION_BATCH_SIZE))
+    hasta = cursor.fetchone()[0]
+    if hasta is not None:
+        # Las filas que ya copiaron los triggers son más nuevas: no se pisan
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO contactos_nueva (id, {columnas})
+            SELECT rowid, {columnas} FROM contactos WHERE rowid > ? AND rowid <= ?
+        ''', (progreso, hasta))
+        return hasta
+
+    # Reemplazo: al borrar la tabla vieja se borran también sus índices y triggers
+    cursor.execute('DROP TABLE contactos')
+    cursor.execute('ALTER TABLE contactos_nueva RENAME TO contactos')
+    if existe_tabla(cursor, 'contactos_fts'):
+        crear_triggers_busqueda(cursor)
+    crear_triggers_cambios(cursor)
+    return None
+
+# 9. Índice de la búsqueda aproximada: contactos_claves guarda las claves de cada
+# nombre (ver claves_nombre). Las claves se calculan en Python, así que los
+# triggers solo anotan en contactos_claves_pendientes qué contactos cambiaron y las
+# rutas que escriben (o la próxima búsqueda aproximada) los indexan.
+#
+# El índice se llena por lotes en contactos_claves_nueva y al final se renombra;
+# mientras tanto las escrituras quedan pendientes y se indexan en ese último paso.
+def migracion_indice_aproximado(cursor, progreso):
+    if progreso is None:
+        cursor.execute('CREATE TABLE IF NOT EXISTS contactos_claves_pendientes (id INTEGER PRIMARY KEY)')
+        crear_triggers_claves(cursor)
+        if existe_tabla(cursor, 'contactos_claves'):
+            return None
+        cursor.execute('DROP TABLE IF EXISTS contactos_claves_nueva')
+        cursor.execute('''
+            CREATE TABLE contactos_claves_nueva (
+                clave TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (clave, id)
+            ) WITHOUT ROWID
+        ''')
+        return 0
+
+    cursor.execute('SELECT rowid, nombre FROM contactos WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                   (progreso, MIGRATION_BATCH_SIZE))
+    filas = cursor.fetchall()
+    if filas:
+        cursor.executemany('INSERT OR IGNORE INTO contactos_claves_nueva (clave, id) VALUES (?, ?)',
+                           [(clave, rowid) for rowid, nombre in filas for clave in claves_nombre(nombre)])
+        return filas[-1][0]
+
+    cursor.execute('CREATE INDEX contactos_claves_id ON contactos_claves_nueva (id)')
+    indexar_claves_pendientes(cursor, 'contactos_claves_nueva')
+    cursor.execute('ALTER TABLE contactos_claves_nueva RENAME TO contactos_claves')
+    return None
+
+def crear_triggers_claves(cursor):
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_claves_insert AFTER INSERT ON contactos BEGIN
+            INSERT OR IGNORE INTO contactos_claves_pendientes (id) VALUES (new.rowid);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_claves_update AFTER UPDATE OF nombre ON contactos BEGIN
+            INSERT OR IGNORE INTO contactos_claves_pendientes (id) VALUES (old.rowid);
+            INSERT OR IGNORE INTO contactos_claves_pendientes (id) VALUES (new.rowid);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_claves_delete AFTER DELETE ON contactos BEGIN
+            INSERT OR IGNORE INTO contactos_claves_pendientes (id) VALUES (old.rowid);
+        END
+    ''')
+
+# Recalcula las claves de los contactos pendientes (los borrados solo pierden las
+# suyas). Se llama dentro de la transacción que escribió. Devuelve cuántos indexó.
+def indexar_claves_pendientes(cursor, tabla='contactos_claves'):
+    cursor.execute('''
+        SELECT p.id, c.nombre FROM contactos_claves_pendientes AS p
+        LEFT JOIN contactos AS c ON c.rowid = p.id
+    ''')
+    filas = [tuple(fila) for fila in cursor.fetchall()]
+    if not filas:
+        return 0
+    ids = [(id_,) for id_, _ in filas]
+    cursor.executemany(f'DELETE FROM {tabla} WHERE id = ?', ids)
+    cursor.executemany(f'INSERT OR IGNORE INTO {tabla} (clave, id) VALUES (?, ?)',
+                       [(clave, id_) for id_, nombre in filas if nombre is not None
+                        for clave in claves_nombre(nombre)])
+    cursor.executemany('DELETE FROM contactos_claves_pendientes WHERE id = ?', ids)
+    return len(filas)
+
+# 10. Importaciones ya aplicadas, por clave de idempotencia (cabecera
+# Idempotency-Key de /import). Se guarda el reporte para devolverlo si el cliente
+# reenvía la misma parte (por ejemplo después de un corte de conexión).
+def migracion_importaciones(cursor, progreso):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS importaciones (
+            clave TEXT PRIMARY KEY,
+            estado INTEGER NOT NULL,
+            resultado TEXT NOT NULL,
+            creada TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS importaciones_creada ON importaciones (creada)')
+
+# 11. Versión de cada contacto para el control de concurrencia optimista: empieza
+# en 1 y el trigger la incrementa con cada cambio, venga de la ruta que venga
+# (PUT, /contacts/batch o una importación con upsert). PUT y DELETE aceptan la
+# versión esperada en If-Match y responden 412 si el contacto cambió.
+def migracion_version_contactos(cursor, progreso):
+    if 'version' not in columnas_tabla(cursor, 'contactos'):
+        # Con un valor por defecto constante SQLite no reescribe las filas existentes
+        cursor.execute('ALTER TABLE contactos ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    crear_trigger_version(cursor)
+
+# 12. PUT y /contacts/batch incrementan la versión en el mismo UPDATE y la leen
+# con RETURNING; el trigger pasa a sumarla solo cuando el UPDATE no la tocó (el
+# upsert de /import), para no contarla dos veces.
+def migracion_version_explicita(cursor, progreso):
+    # Las bases que ya tenían la 11 traen el trigger sin la condición WHEN
+    cursor.execute('DROP TRIGGER IF EXISTS contactos_version')
+    crear_trigger_version(cursor)
+
+def crear_trigger_version(cursor):
+    # La actualización del trigger toca solo version, así que no vuelve a disparar
+    # los triggers de búsqueda ni del registro de cambios (limitados a las columnas visibles).
+    # Un UPDATE que ya incrementa version (PUT, con RETURNING) no la suma dos veces.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS contactos_version
+        AFTER UPDATE OF nombre, telefono, direccion ON contactos
+        WHEN new.version = old.version BEGIN
+            UPDATE contactos SET version = old.version + 1 WHERE rowid = new.rowid;
+        END
+    ''')
+
+# 13. Indexa por rangos de rowid las filas que ya existían cuando la migración 3
+# creó el índice de búsqueda. Las que se escriben mientras tanto las indexan los
+# triggers, así que se saltean las que ya están. Al terminar borra
+# contactos_fts_pendiente y las búsquedas pasan a usar FTS5.
+def migracion_completar_indice_busqueda(cursor, progreso):
+    if not existe_tabla(cursor, 'contactos_fts_pendiente'):
+        return None
+    progreso = progreso or 0
+    cursor.execute('SELECT MAX(rowid) FROM (SELECT rowid FROM contactos WHERE rowid > ? ORDER BY rowid LIMIT ?)',
+                   (progreso, MIGRATION_BATCH_SIZE))
+    hasta = cursor.fetchone()[0]
+    if hasta is None:
+        cursor.execute('DROP TABLE contactos_fts_pendiente')
+        return None
+    cursor.execute(f'''
+        INSERT INTO contactos_fts (rowid, nombre, telefono, direccion, telefono_digitos)
+        SELECT rowid, nombre, telefono, direccion, {sql_solo_digitos('telefono')}
+        FROM contactos WHERE rowid > ? AND rowid <= ?
+          AND rowid NOT IN (SELECT rowid FROM contactos_fts WHERE rowid > ? AND rowid <= ?)
+    ''', (progreso, hasta, progreso, hasta))
+    return hasta
+
+# Las rutas que escriben mantienen el índice aproximado al día antes del commit
+def actualizar_indice_aproximado(cursor):
+    if agenda_actual().busqueda_aproximada_disponible:
+        indexar_claves_pendientes(cursor)
+
+MIGRACIONES = [
+    # (versión, descripción, función, por lotes)
+    (1, 'Tabla de contactos', migracion_tabla_contactos, False),
+    (2, 'Índice único de teléfono', migracion_telefono_unico, False),
+    (3, 'Índice de búsqueda FTS5', migracion_indice_busqueda, False),
+    (4, 'Registro de cambios', migracion_registro_cambios, False),
+    (5, 'Columna telefono_normalizado', migracion_columna_telefono_normalizado, False),
+    (6, 'Completar telefono_normalizado', migracion_completar_telefono_normalizado, True),
+    (7, 'Índice de telefono_normalizado', migracion_indice_telefono_normalizado, False),
+    (8, 'Identificador entero e índice por dirección', migracion_identificador_entero, True),
+    (9, 'Índice de búsqueda aproximada', migracion_indice_aproximado, True),
+    (10, 'Importaciones idempotentes', migracion_importaciones, False),
+    (11, 'Versión de contactos', migracion_version_contactos, False),
+    (12, 'Versión incrementada en el UPDATE', migracion_version_explicita, False),
+    (13, 'Completar índice de búsqueda', migracion_completar_indice_busqueda, True),
+]
+
+def crear_tabla_versiones(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            progreso INTEGER,
+            actualizada TEXT NOT NULL
+        )
+    ''')
     conn.commit()
-    conn.close()
 
-# Función para obtener la conexión a la base de datos
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # Esto permite acceder a las columnas por nombre
+# Ejecuta una migración hasta terminarla, con una transacción por llamada (por lote)
+def aplicar_migracion(conn, version, descripcion, migracion, pausa=0):
+    cursor = conn.cursor()
+    while True:
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute('SELECT estado, progreso FROM schema_version WHERE version = ?', (version,))
+            fila = cursor.fetchone()
+            if fila and fila[0] == 'completa':  # la terminó otro proceso
+                conn.rollback()
+                return
+            progreso = migracion(cursor, fila[1] if fila else None)
+            cursor.execute('''
+                INSERT OR REPLACE INTO schema_version (version, descripcion, estado, progreso, actualizada)
+                VALUES (?, ?, ?, ?, datetime('now'))
+            ''', (version, descripcion, 'completa' if progreso is None else 'en_curso', progreso))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if progreso is None:
+            return
+        time.sleep(pausa)
+
+def migraciones_pendientes(conn):
+    aplicadas = {fila[0] for fila in conn.execute("SELECT version FROM schema_version WHERE estado = 'completa'")}
+    return [m for m in MIGRACIONES if m[0] not in aplicadas]
+
+def conectar_para_migrar(database_path):
+    conn = sqlite3.connect(database_path, isolation_level=None)  # transacciones explícitas
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f"PRAGMA busy_timeout = {DB_PRAGMAS['busy_timeout']}")
     return conn
 
+# Función para inicializar la base de datos principal (ver Agenda.migrar)
+def init_db(en_segundo_plano=True, en_otro_proceso=False):
+    agenda_principal().migrar(en_segundo_plano, en_otro_proceso)
+
+# Revisa qué tablas opcionales tiene una base (una Agenda o una Instantanea): las
+# que crea una migración en segundo plano empiezan a usarse cuando termina.
+def detectar_tablas(base, cursor):
+    base.fts_disponible = (existe_tabla(cursor, 'contactos_fts')
+                           and not existe_tabla(cursor, 'contactos_fts_pendiente'))
+    base.busqueda_aproximada_disponible = existe_tabla(cursor, 'contactos_claves')
+    base.importaciones_idempotentes = existe_tabla(cursor, 'importaciones')
+    base.versiones_disponibles = 'version' in columnas_tabla(cursor, 'contactos')
+
+# Cantidad de revisiones que se conservan en el registro de cambios. Un cliente
+# que pide cambios más viejos que los conservados recibe 'reset' y recarga todo.
+CHANGES_RETENTION = int(os.environ.get('CONTACTS_CHANGES_RETENTION', 100000))
+
+# Máximo de contactos modificados que devuelve cada llamada a /contacts/changes
+CHANGES_PAGE_SIZE = 1000
+
+# Al arrancar se descartan las revisiones más viejas que la retención
+def depurar_registro_cambios(conn):
+    conn.execute('DELETE FROM contactos_cambios WHERE rev <= (SELECT MAX(rev) FROM contactos_cambios) - ?',
+                 (CHANGES_RETENTION,))
+
+# Revisión actual de la agenda (0 si todavía no hubo cambios)
+def revision_actual(cursor):
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'contactos_cambios'")
+    fila = cursor.fetchone()
+    return fila[0] if fila else 0
+
+# Pool acotado de conexiones SQLite de larga duración. Las conexiones se reutilizan
+# entre peticiones (y entre hilos, de a una por vez) en lugar de abrir y cerrar
+# el archivo en cada ruta.
+class ConnectionPool:
+    def __init__(self, database_path, max_size, timeout, conectar=None):
+        self.database_path = database_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.conectar = conectar  # función que abre una conexión; por defecto _connect
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.closed = False  # después de close_all, las conexiones devueltas se cierran
+        self.created = 0
+        self.in_use = 0
+        self.acquired = 0
+        self.reused = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Esto permite acceder a las columnas por nombre
+        conn.execute('PRAGMA journal_mode = WAL')
+        for pragma, valor in DB_PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {valor}')
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            with self._lock:
+                crear = self.created < self.max_size
+                if crear:
+                    self.created += 1
+            if crear:
+                try:
+                    conn = self.conectar() if self.conectar else self._connect()
+                except sqlite3.Error:
+                    with self._lock:
+                        self.created -= 1
+                    raise
+                reused = False
+            else:
+                with self._lock:
+                    self.waits += 1
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise RuntimeError('No hay conexiones libres en el pool de la base de datos')
+                reused = True
+
+        with self._lock:
+            self.acquired += 1
+            self.in_use += 1
+            if reused:
+                self.reused += 1
+        return conn
+
+    def release(self, conn):
+        # Una petición que falló a mitad de una escritura no debe dejar la
+        # transacción abierta para la siguiente que use la conexión.
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self.in_use -= 1
+            if self.closed:
+                self.created -= 1
+        if self.closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close_all(self):
+        self.closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self.created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'created': self.created,
+                'in_use': self.in_use,
+                'idle': self._idle.qsize(),
+                'acquired': self.acquired,
+                'reused': self.reused,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+            }
+
+# Una agenda es un archivo SQLite con su pool de conexiones, el estado de sus
+# migraciones y las tablas opcionales que tiene. La agenda principal es
+# DATABASE_PATH; las agendas con nombre las abre RegistroAgendas.
+class Agenda:
+    def __init__(self, nombre, database_path, pool_size):
+        self.nombre = nombre  # None para la agenda principal
+        self.database_path = database_path
+        self.pool = ConnectionPool(database_path, pool_size, DB_POOL_TIMEOUT)
+        # Tablas opcionales (ver detectar_tablas). Sin FTS5 (o hasta que la
+        # migración 13 indexa las filas existentes) se busca con LIKE; mientras se
+        # construye el índice aproximado, mode=fuzzy usa la búsqueda común; sin la
+        # tabla importaciones las importaciones se aplican igual; sin la columna
+        # version no se aceptan escrituras condicionales (If-Match).
+        self.fts_disponible = False
+        self.busqueda_aproximada_disponible = False
+        self.importaciones_idempotentes = False
+        self.versiones_disponibles = False
+        # PRAGMA schema_version con el que se detectaron las tablas por última vez,
+        # y si ya no queda ninguna migración por aplicar (ver revisar_esquema)
+        self.esquema_detectado = None
+        self.migraciones_completas = False
+        self.hilo_migraciones = None  # hilo, o proceso (ver migrar)
+        self.pid_migraciones = None   # proceso que lanzó hilo_migraciones
+        # Copia de solo lectura para los GET (ver Instantanea), si está habilitada
+        self.instantanea = None
+        self.hilo_instantaneas = None
+        self.instantaneas_creadas = 0
+        self._lock = threading.Lock()
+
+    # Aplica en el momento las migraciones pendientes hasta la primera por lotes;
+    # esa y las siguientes siguen en un hilo en segundo plano mientras el servidor
+    # atiende (o en el momento, si en_segundo_plano=False). Con en_otro_proceso
+    # siguen en un proceso aparte: es lo que usa gunicorn, que crea los workers
+    # con fork y no debe tener conexiones SQLite abiertas en ese momento.
+    def migrar(self, en_segundo_plano=True, en_otro_proceso=False):
+        conn = conectar_para_migrar(self.database_path)
+        crear_tabla_versiones(conn)
+        pendientes = migraciones_pendientes(conn)
+        while pendientes and not (en_segundo_plano and pendientes[0][3]):
+            version, descripcion, migracion, _ = pendientes.pop(0)
+            aplicar_migracion(conn, version, descripcion, migracion)
+
+        self._detectar(conn)
+        depurar_registro_cambios(conn)
+        conn.close()
+
+        if pendientes:
+            if en_otro_proceso:
+                self.hilo_migraciones = multiprocessing.get_context('fork').Process(
+                    target=self._migrar_en_segundo_plano, args=(pendientes,), daemon=True)
+            else:
+                self.hilo_migraciones = threading.Thread(target=self._migrar_en_segundo_plano, args=(pendientes,),
+                                                         daemon=True)
+            self.hilo_migraciones.start()
+            self.pid_migraciones = os.getpid()
+
+    def _migrar_en_segundo_plano(self, pendientes):
+        prefijo = f'[{self.nombre}] ' if self.nombre else ''
+        conn = conectar_para_migrar(self.database_path)
+        try:
+            for version, descripcion, migracion, _ in pendientes:
+                print(f"{prefijo}Migración {version} ({descripcion}) en segundo plano...")
+                aplicar_migracion(conn, version, descripcion, migracion, MIGRATION_PAUSE_SECONDS)
+                self._detectar(conn)
+            print(f"{prefijo}Migraciones completadas.")
+        except sqlite3.Error as e:
+            print(f"{prefijo}Falló una migración en segundo plano, se reintentará al reiniciar: {e}")
+        finally:
+            conn.close()
+
+    def _detectar(self, conn):
+        with self._lock:
+            self.esquema_detectado = conn.execute('PRAGMA schema_version').fetchone()[0]
+            detectar_tablas(self, conn.cursor())
+            self.migraciones_completas = not migraciones_pendientes(conn)
+
+    # Las migraciones en segundo plano las puede terminar otro proceso: con
+    # gunicorn, init_db corre en el proceso principal antes de crear los workers y
+    # lo pendiente sigue en un proceso aparte, que no actualiza la Agenda de cada
+    # worker. Mientras falten migraciones, cada conexión que se toma del pool
+    # compara PRAGMA schema_version con el de la última detección y, si cambió,
+    # vuelve a detectar las tablas.
+    def revisar_esquema(self, conn):
+        if self.migraciones_completas:
+            return
+        if conn.execute('PRAGMA schema_version').fetchone()[0] != self.esquema_detectado:
+            self._detectar(conn)
+
+    def migrando(self):
+        if self.hilo_migraciones is None:
+            return False
+        if self.pid_migraciones != os.getpid():
+            # Worker de gunicorn: el proceso de migraciones es del proceso principal
+            return not self.migraciones_completas
+        return self.hilo_migraciones.is_alive()
+
+    def ocupada(self):
+        return self.migrando() or self.pool.stats()['in_use'] > 0
+
+    def cerrar(self):
+        self.pool.close_all()  # el hilo de instantáneas lo ve y descarta la suya
+
+    # Arranca (una sola vez) el hilo que mantiene la instantánea al día
+    def iniciar_instantaneas(self):
+        with self._lock:
+            if self.hilo_instantaneas is None:
+                self.hilo_instantaneas = threading.Thread(target=self._mantener_instantaneas, daemon=True)
+                self.hilo_instantaneas.start()
+
+    # Cada SNAPSHOT_MAX_AGE / 4 segundos compara la revisión y el esquema de la base
+    # con los de la instantánea: si no cambiaron la instantánea sigue vigente; si
+    # cambiaron se copia una nueva y la anterior se descarta cuando nadie la usa.
+    def _mantener_instantaneas(self):
+        for viejo in glob.glob(glob.escape(self.database_path) + '.snapshot-*'):
+            borrar_archivo(viejo)  # de una ejecución anterior
+        retiradas = []
+        while not self.pool.closed:
+            try:
+                self._actualizar_instantanea(retiradas)
+            except sqlite3.Error as e:
+                app.logger.warning('No se pudo actualizar la instantánea de %s: %s', self.database_path, e)
+            retiradas = [r for r in retiradas if not r.descartar()]
+            time.sleep(max(SNAPSHOT_MAX_AGE / 4, 0.05))
+        if self.instantanea is not None:
+            retiradas.append(self.instantanea)
+            self.instantanea = None
+        for retirada in retiradas:
+            retirada.pool.close_all()
+            retirada.descartar(espera=0)
+
+    def _actualizar_instantanea(self, retiradas):
+        inicio = time.monotonic()
+        fuente = sqlite3.connect(self.database_path)
+        try:
+            version = version_datos(fuente.cursor())
+            actual = self.instantanea
+            if actual is not None and actual.version == version:
+                actual.vigente_desde = inicio
+                return
+            self.instantaneas_creadas += 1
+            nueva = Instantanea.copiar(fuente, f'{self.database_path}.snapshot-{self.instantaneas_creadas}',
+                                       version, inicio)
+        finally:
+            fuente.close()
+        self.instantanea = nueva
+        if actual is not None:
+            actual.pool.close_all()
+            retiradas.append(actual)
+
+_agenda_principal = None
+_agenda_principal_lock = threading.Lock()
+
+def agenda_principal():
+    global _agenda_principal
+    with _agenda_principal_lock:
+        if _agenda_principal is None or _agenda_principal.database_path != DATABASE_PATH:
+            if _agenda_principal is not None:
+                _agenda_principal.cerrar()
+            _agenda_principal = Agenda(None, DATABASE_PATH, DB_POOL_SIZE)
+        return _agenda_principal
+
+# --- Instantáneas de solo lectura ---
+
+# Con CONTACTS_SNAPSHOT_MAX_AGE > 0, GET /contacts y /export se atienden desde una
+# copia de la agenda (API de backup de SQLite) en lugar del archivo donde se
+# escribe, así un listado o una exportación no compiten con una importación. Es el
+# atraso máximo en segundos: si la copia no está al día dentro de ese margen (por
+# ejemplo, todavía se está copiando una nueva) se lee la base directamente.
+SNAPSHOT_MAX_AGE = float(os.environ.get('CONTACTS_SNAPSHOT_MAX_AGE', 0))
+SNAPSHOT_POOL_SIZE = int(os.environ.get('CONTACTS_SNAPSHOT_POOL_SIZE', 4))
+
+# Lo que identifica el contenido de una base para las lecturas: la revisión de los
+# contactos y la versión del esquema (que cambia, por ejemplo, al terminar una migración)
+def version_datos(cursor):
+    cursor.execute('PRAGMA schema_version')
+    esquema = cursor.fetchone()[0]
+    return revision_actual(cursor), esquema
+
+def borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False  # en Windows no se puede borrar mientras haya conexiones abiertas
+
+# Copia de solo lectura de una agenda. El archivo no cambia nunca después de
+# copiarlo, así que se abre como inmutable: SQLite no toma bloqueos para leerlo.
+class Instantanea:
+    def __init__(self, ruta, version, vigente_desde):
+        self.ruta = ruta
+        self.version = version
+        self.vigente_desde = vigente_desde  # última vez que se comprobó que estaba al día
+        self.retirada = None
+        self.pool = ConnectionPool(ruta, SNAPSHOT_POOL_SIZE, DB_POOL_TIMEOUT, self._conectar)
+        self.fts_disponible = False
+        self.busqueda_aproximada_disponible = False
+        self.importaciones_idempotentes = False
+        self.versiones_disponibles = False
+
+    # Copia la base de la conexión fuente en un archivo nuevo. Con WAL la copia
+    # lee una foto consistente de la base sin frenar a los que escriben. version es
+    # la de la fuente antes de copiar (la copia no conserva la versión del esquema):
+    # si algo se escribió durante la copia, la próxima comprobación la renueva.
+    @classmethod
+    def copiar(cls, fuente, ruta, version, vigente_desde):
+        borrar_archivo(ruta)
+        destino = sqlite3.connect(ruta, isolation_level=None)
+        try:
+            fuente.backup(destino)
+            destino.execute('PRAGMA journal_mode = DELETE')  # un archivo inmutable no puede estar en WAL
+            cursor = destino.cursor()
+            # Los contactos que el índice aproximado todavía no procesó se indexan
+            # en la copia: las búsquedas en ella no pueden escribir.
+            if existe_tabla(cursor, 'contactos_claves') and existe_tabla(cursor, 'contactos_claves_pendientes'):
+                cursor.execute('BEGIN')
+                indexar_claves_pendientes(cursor)
+                cursor.execute('COMMIT')
+            instantanea = cls(ruta, version, vigente_desde)
+            detectar_tablas(instantanea, cursor)
+        except BaseException:
+            destino.close()
+            borrar_archivo(ruta)
+            raise
+        destino.close()
+        return instantanea
+
+    def _conectar(self):
+        uri = f'file:{pathname2url(os.path.abspath(self.ruta))}?mode=ro&immutable=1'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in ('cache_size', 'mmap_size'):
+            conn.execute(f'PRAGMA {pragma} = {DB_PRAGMAS[pragma]}')
+        return conn
+
+    def edad(self):
+        return time.monotonic() - self.vigente_desde
+
+    # Borra el archivo de una instantánea reemplazada cuando ya no la usa ninguna
+    # petición. Espera unos segundos desde que se retiró por si alguna la acaba
+    # de elegir y todavía no tomó su conexión. Devuelve True si la pudo borrar.
+    def descartar(self, espera=1.0):
+        if self.retirada is None:
+            self.retirada = time.monotonic()
+        if self.pool.stats()['in_use'] or time.monotonic() - self.retirada < espera:
+            return False
+        return borrar_archivo(self.ruta)
+
+# Base desde donde leer en un GET: la instantánea de la agenda si está al día
+# dentro de SNAPSHOT_MAX_AGE, o la agenda misma. Con instantánea la respuesta
+# informa su atraso en la cabecera X-Snapshot-Age (ver informar_instantanea).
+def fuente_lectura():
+    agenda = agenda_actual()
+    if SNAPSHOT_MAX_AGE <= 0:
+        return agenda
+    agenda.iniciar_instantaneas()
+    instantanea = agenda.instantanea
+    if instantanea is None or instantanea.edad() > SNAPSHOT_MAX_AGE:
+        return agenda
+    g.edad_instantanea = instantanea.edad()
+    return instantanea
+
+@app.after_request
+def informar_instantanea(response):
+    edad = g.pop('edad_instantanea', None)
+    if edad is not None:
+        response.headers['X-Snapshot-Age'] = f'{edad:.3f}'
+    return response
+
+@app.route('/stats/snapshot', methods=['GET'])
+def snapshot_stats():
+    agenda = agenda_actual()
+    instantanea = agenda.instantanea
+    return jsonify({
+        'enabled': SNAPSHOT_MAX_AGE > 0,
+        'max_age_seconds': SNAPSHOT_MAX_AGE,
+        'age_seconds': round(instantanea.edad(), 3) if instantanea else None,
+        'revision': instantanea.version[0] if instantanea else None,
+        'snapshots_created': agenda.instantaneas_creadas,
+    })
+
+# --- Agendas con nombre ---
+
+# Cada agenda con nombre es un archivo BOOKS_DIR/<nombre>.db, así las escrituras
+# de una agenda no esperan el lock de escritura de otra. Se abren recién cuando se
+# usan y quedan abiertas como mucho MAX_OPEN_BOOKS, con hasta BOOK_POOL_SIZE
+# conexiones cada una.
+BOOKS_DIR = os.environ.get('CONTACTS_BOOKS_DIR', 'books')
+MAX_OPEN_BOOKS = int(os.environ.get('CONTACTS_MAX_OPEN_BOOKS', 16))
+BOOK_POOL_SIZE = int(os.environ.get('CONTACTS_BOOK_POOL_SIZE', 4))
+
+# Nombres de agenda válidos (también son nombres de archivo)
+NOMBRE_AGENDA = re.compile(r'[a-z0-9][a-z0-9_-]{0,63}')
+
+# Agendas con nombre abiertas, en orden de uso. Al pasar el límite se cierra la
+# que hace más tiempo que no se usa, salvo que esté atendiendo una petición o
+# migrando: en ese caso se espera a la próxima apertura.
+class RegistroAgendas:
+    def __init__(self, max_abiertas):
+        self.max_abiertas = max_abiertas
+        self._abiertas = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.hits = 0
+
+    @staticmethod
+    def ruta(nombre):
+        return os.path.join(BOOKS_DIR, f'{nombre}.db')
+
+    # Devuelve la agenda abierta, abriéndola (y migrándola) si hace falta. Si el
+    # archivo no existe se crea solo con crear=True; si no, devuelve None.
+    def obtener(self, nombre, crear=False):
+        with self._lock:
+            agenda = self._abiertas.get(nombre)
+            if agenda is not None:
+                self._abiertas.move_to_end(nombre)
+                self.hits += 1
+                return agenda
+
+            ruta = self.ruta(nombre)
+            if not os.path.exists(ruta):
+                if not crear:
+                    return None
+                os.makedirs(BOOKS_DIR, exist_ok=True)
+            agenda = Agenda(nombre, ruta, BOOK_POOL_SIZE)
+            agenda.migrar()
+            self._abiertas[nombre] = agenda
+            self.opened += 1
+            self._cerrar_sobrantes()
+            return agenda
+
+    def _cerrar_sobrantes(self):
+        sobrantes = len(self._abiertas) - self.max_abiertas
+        for nombre, agenda in list(self._abiertas.items())[:-1]:
+            if sobrantes <= 0:
+                break
+            if agenda.ocupada():
+                continue
+            del self._abiertas[nombre]
+            agenda.cerrar()
+            self.closed += 1
+            sobrantes -= 1
+
+    def listar(self):
+        with self._lock:
+            abiertas = set(self._abiertas)
+        try:
+            archivos = sorted(f for f in os.listdir(BOOKS_DIR) if f.endswith('.db'))
+        except FileNotFoundError:
+            archivos = []
+        return [{'name': archivo[:-3], 'size_bytes': os.path.getsize(os.path.join(BOOKS_DIR, archivo)),
+                 'open': archivo[:-3] in abiertas}
+                for archivo in archivos if NOMBRE_AGENDA.fullmatch(archivo[:-3])]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': len(self._abiertas),
+                'max_open': self.max_abiertas,
+                'opened': self.opened,
+                'closed': self.closed,
+                'hits': self.hits,
+            }
+
+agendas = RegistroAgendas(MAX_OPEN_BOOKS)
+
+# Las rutas bajo /books/<book>/ reciben el nombre de la agenda en la URL: se saca
+# de los argumentos de la vista (las vistas no lo reciben) y la agenda se abre
+# antes de atender la petición.
+@app.url_value_preprocessor
+def tomar_nombre_agenda(endpoint, values):
+    if values and 'book' in values:
+        g.nombre_agenda = values.pop('book')
+
+@app.before_request
+def abrir_agenda():
+    nombre = g.pop('nombre_agenda', None)
+    if nombre is None:
+        return None
+    if not NOMBRE_AGENDA.fullmatch(nombre):
+        return jsonify({'error': 'Nombre de agenda no válido: use minúsculas, dígitos, "-" o "_" '
+                                 '(hasta 64 caracteres).'}), 400
+    # Las agendas se crean con la primera escritura (POST); leer una que no existe es un 404
+    agenda = agendas.obtener(nombre, crear=request.method == 'POST')
+    if agenda is None:
+        return jsonify({'error': f"La agenda '{nombre}' no existe."}), 404
+    g.agenda = agenda
+    return None
+
+# Agenda de la petición actual: la de /books/<book>/ o la principal
+def agenda_actual():
+    if 'agenda' not in g:
+        g.agenda = agenda_principal()
+    return g.agenda
+
+# Función para obtener la conexión a la base de datos. La conexión se toma del pool
+# de la agenda (o de fuente, por ejemplo una instantánea) una sola vez por petición
+# y se guarda en el contexto de la aplicación de Flask.
+# La conexión va envuelta en ConexionMedida para contar las sentencias SQL de la petición.
+def get_db_connection(fuente=None):
+    if 'db_conn' not in g:
+        g.db_fuente = fuente or agenda_actual()
+        g.db_conn = ConexionMedida(g.db_fuente.pool.acquire(), f'{request.method} {request.path}')
+        if isinstance(g.db_fuente, Agenda):
+            g.db_fuente.revisar_esquema(g.db_conn.conexion)
+    return g.db_conn
+
+# Columnas de un contacto en las respuestas (alias c). La versión se incluye
+# cuando la base de la conexión de la petición ya la tiene (migración 11).
+def columnas_contacto():
+    if g.db_fuente.versiones_disponibles:
+        return 'c.nombre, c.telefono, c.direccion, c.version'
+    return 'c.nombre, c.telefono, c.direccion'
+
+# Devuelve la conexión al pool cuando termina el contexto de la petición.
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        g.pop('db_fuente').pool.release(conn.conexion)
+
+@app.route('/books', methods=['GET'])
+def list_books():
+    return jsonify({'books': agendas.listar()})
+
+@app.route('/stats/books', methods=['GET'])
+def book_stats():
+    return jsonify(agendas.stats())
+
+@app.route('/stats/pool', methods=['GET'])
+def pool_stats():
+    return jsonify(agenda_actual().pool.stats())
+
+# Estado de las migraciones del esquema (las en curso muestran su progreso)
+@app.route('/stats/migrations', methods=['GET'])
+def migration_stats():
+    cursor = get_db_connection().cursor()
+    cursor.execute('SELECT version, descripcion, estado, progreso, actualizada FROM schema_version ORDER BY version')
+    aplicadas = {fila['version']: dict(fila) for fila in cursor.fetchall()}
+    migraciones = [aplicadas.get(version, {'version': version, 'descripcion': descripcion, 'estado': 'pendiente'})
+                   for version, descripcion, _, _ in MIGRACIONES]
+    return jsonify({
+        'version': max((v for v, m in aplicadas.items() if m['estado'] == 'completa'), default=0),
+        'background_running': agenda_actual().migrando(),
+        'migrations': migraciones,
+    })
+
+# --- Métricas y perfilado ---
+
+# Umbrales (en milisegundos) a partir de los cuales se registra en el log una
+# sentencia SQL o una petición lenta.
+SLOW_QUERY_MS = float(os.environ.get('CONTACTS_SLOW_QUERY_MS', 200))
+SLOW_REQUEST_MS = float(os.environ.get('CONTACTS_SLOW_REQUEST_MS', 1000))
+
+# Perfilado opcional: si se define CONTACTS_PROFILE_BUDGET_MS, una fracción de las
+# peticiones (CONTACTS_PROFILE_SAMPLE) se ejecuta bajo cProfile y, si superan ese
+# presupuesto, el perfil se guarda en CONTACTS_PROFILE_DIR para abrirlo con pstats.
+PROFILE_BUDGET_MS = (float(os.environ['CONTACTS_PROFILE_BUDGET_MS'])
+                     if os.environ.get('CONTACTS_PROFILE_BUDGET_MS') else None)
+PROFILE_SAMPLE = float(os.environ.get('CONTACTS_PROFILE_SAMPLE', 0.1))
+PROFILE_DIR = os.environ.get('CONTACTS_PROFILE_DIR', 'profiles')
+
+# Límites superiores (en segundos) de los buckets del histograma de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def texto_sql(sql):
+    texto = ' '.join(sql.split())
+    return texto if len(texto) <= 200 else texto[:200] + '...'
+
+# Cursor que mide cuántas sentencias ejecuta y cuánto tardan (incluyendo la lectura
+# de filas). El resto de los atributos se delegan al cursor de sqlite3.
+class CursorMedido:
+    def __init__(self, cursor, conexion):
+        self._cursor = cursor
+        self._conexion = conexion
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def _ejecutar(self, metodo, sql, params):
+        inicio = time.perf_counter()
+        try:
+            metodo(sql, params)
+        finally:
+            segundos = time.perf_counter() - inicio
+            self._conexion.registrar(segundos, sql)
+        return self
+
+    def execute(self, sql, params=()):
+        return self._ejecutar(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._ejecutar(self._cursor.executemany, sql, params)
+
+    def _leer(self, metodo, *args):
+        inicio = time.perf_counter()
+        try:
+            return metodo(*args)
+        finally:
+            self._conexion.segundos_sql += time.perf_counter() - inicio
+
+    def fetchone(self):
+        return self._leer(self._cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._leer(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._leer(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            filas = self.fetchmany(EXPORT_CHUNK_ROWS)
+            if not filas:
+                return
+            yield from filas
+
+# Envoltorio de la conexión del pool que lleva la cuenta de sentencias y tiempo de
+# SQL de una petición. Lo crea get_db_connection y dura lo que dura la petición.
+class ConexionMedida:
+    def __init__(self, conexion, peticion):
+        self.conexion = conexion
+        self.peticion = peticion  # "MÉTODO /ruta", para el log de consultas lentas
+        self.sentencias = 0
+        self.segundos_sql = 0.0
+
+    def __getattr__(self, nombre):
+        return getattr(self.conexion, nombre)
+
+    def registrar(self, segundos, sql):
+        self.sentencias += 1
+        self.segundos_sql += segundos
+        if segundos * 1000 >= SLOW_QUERY_MS:
+            metricas.contar('consultas_lentas')
+            app.logger.warning('Consulta lenta (%.1f ms) en %s: %s', segundos * 1000,
+                               self.peticion, texto_sql(sql))
+
+    def cursor(self):
+        return CursorMedido(self.conexion.cursor(), self)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+# Contadores e histogramas por ruta, en memoria. Con varios procesos (gunicorn)
+# cada proceso expone los suyos.
+class MetricasPeticiones:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencias = {}   # (método, ruta) -> [conteos por bucket, suma, total]
+        self._peticiones = {}  # (método, ruta, estado) -> cantidad
+        self._sql = {}         # (método, ruta) -> [sentencias, segundos]
+        self.consultas_lentas = 0
+        self.peticiones_lentas = 0
+        self.perfiles_guardados = 0
+
+    def observar(self, metodo, ruta, estado, segundos, sentencias, segundos_sql):
+        with self._lock:
+            clave = (metodo, ruta)
+            histograma = self._latencias.setdefault(clave, [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            for i, limite in enumerate(LATENCY_BUCKETS):
+                if segundos <= limite:
+                    histograma[0][i] += 1
+            histograma[1] += segundos
+            histograma[2] += 1
+            self._peticiones[(metodo, ruta, estado)] = self._peticiones.get((metodo, ruta, estado), 0) + 1
+            sql = self._sql.setdefault(clave, [0, 0.0])
+            sql[0] += sentencias
+            sql[1] += segundos_sql
+
+    def contar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    # Formato de texto de Prometheus (version 0.0.4)
+    def render(self, extras=()):
+        lineas = []
+        with self._lock:
+            lineas.append('# HELP contacts_http_requests_total Peticiones atendidas por ruta y estado.')
+            lineas.append('# TYPE contacts_http_requests_total counter')
+            for (metodo, ruta, estado), cantidad in sorted(self._peticiones.items()):
+                lineas.append(f'contacts_http_requests_total{{method="{metodo}",route="{ruta}",status="{estado}"}} {cantidad}')
+
+            lineas.append('# HELP contacts_http_request_duration_seconds Latencia de las peticiones por ruta.')
+            lineas.append('# TYPE contacts_http_request_duration_seconds histogram')
+            for (metodo, ruta), (conteos, suma, total) in sorted(self._latencias.items()):
+                etiquetas = f'method="{metodo}",route="{ruta}"'
+                for limite, conteo in zip(LATENCY_BUCKETS, conteos):
+                    lineas.append(f'contacts_http_request_duration_seconds_bucket{{{etiquetas},le="{limite}"}} {conteo}')
+                lineas.append(f'contacts_http_request_duration_seconds_bucket{{{etiquetas},le="+Inf"}} {total}')
+                lineas.append(f'contacts_http_request_duration_seconds_sum{{{etiquetas}}} {suma:.6f}')
+                lineas.append(f'contacts_http_request_duration_seconds_count{{{etiquetas}}} {total}')
+
+            lineas.append('# HELP contacts_sql_statements_total Sentencias SQL ejecutadas por ruta.')
+            lineas.append('# TYPE contacts_sql_statements_total counter')
+            for (metodo, ruta), (sentencias, _) in sorted(self._sql.items()):
+                lineas.append(f'contacts_sql_statements_total{{method="{metodo}",route="{ruta}"}} {sentencias}')
+            lineas.append('# HELP contacts_sql_duration_seconds_total Tiempo en SQL por ruta.')
+            lineas.append('# TYPE contacts_sql_duration_seconds_total counter')
+            for (metodo, ruta), (_, segundos) in sorted(self._sql.items()):
+                lineas.append(f'contacts_sql_duration_seconds_total{{method="{metodo}",route="{ruta}"}} {segundos:.6f}')
+
+            contadores = (
+                ('contacts_slow_queries_total', 'Sentencias SQL por encima de CONTACTS_SLOW_QUERY_MS.', self.consultas_lentas),
+                ('contacts_slow_requests_total', 'Peticiones por encima de CONTACTS_SLOW_REQUEST_MS.', self.peticiones_lentas),
+                ('contacts_profiles_saved_total', 'Perfiles guardados por superar el presupuesto.', self.perfiles_guardados),
+            )
+            for nombre, ayuda, valor in contadores:
+                lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} counter', f'{nombre} {valor}']
+
+        for nombre, ayuda, valor in extras:
+            lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} gauge', f'{nombre} {valor}']
+        return '\n'.join(lineas) + '\n'
+
+metricas = MetricasPeticiones()
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+    if PROFILE_BUDGET_MS is not None and random.random() < PROFILE_SAMPLE:
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            return  # ya hay otro perfilador activo en este proceso
+        g.perfil = perfil
+
+@app.after_request
+def guardar_estado(response):
+    g.estado_respuesta = response.status_code
+    return response
+
+def regla_actual():
+    return request.url_rule.rule if request.url_rule else 'sin_ruta'
+
+@app.teardown_request
+def registrar_medicion(exception):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is None:
+        return  # respuesta por streaming: se mide en cerrar_al_terminar
+    finalizar_medicion(inicio, g.pop('perfil', None), g.get('db_conn'), request.method,
+                       regla_actual(), request.full_path, g.get('estado_respuesta', 500))
+
+def finalizar_medicion(inicio, perfil, conn, metodo, ruta, ruta_completa, estado):
+    segundos = time.perf_counter() - inicio
+    if perfil is not None:
+        perfil.disable()
+
+    sentencias = conn.sentencias if conn is not None else 0
+    segundos_sql = conn.segundos_sql if conn is not None else 0.0
+    metricas.observar(metodo, ruta, estado, segundos, sentencias, segundos_sql)
+
+    ms = segundos * 1000
+    if ms >= SLOW_REQUEST_MS:
+        metricas.contar('peticiones_lentas')
+        app.logger.warning('Petición lenta (%.1f ms, %d sentencias SQL en %.1f ms): %s %s',
+                           ms, sentencias, segundos_sql * 1000, metodo, ruta_completa)
+    if perfil is not None and ms >= PROFILE_BUDGET_MS:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        nombre_ruta = ruta.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'raiz'
+        archivo = os.path.join(PROFILE_DIR, f'{time.strftime("%Y%m%d-%H%M%S")}-{metodo}-{nombre_ruta}-{ms:.0f}ms.prof')
+        perfil.dump_stats(archivo)
+        metricas.contar('perfiles_guardados')
+        app.logger.warning('Perfil guardado en %s', archivo)
+
+# Para respuestas por streaming (como /export): el cuerpo se genera después de que
+# termina la vista, así que la respuesta se queda con la conexión del pool y con la
+# medición hasta que el servidor la cierra, tanto si se envió entera como si el
+# cliente cortó antes.
+def cerrar_al_terminar(response):
+    conn = g.pop('db_conn', None)
+    fuente = g.pop('db_fuente', None)
+    inicio = g.pop('inicio_peticion', None)
+    perfil = g.pop('perfil', None)
+    datos = (request.method, regla_actual(), request.full_path, response.status_code)
+
+    def cerrar():
+        if conn is not None:
+            fuente.pool.release(conn.conexion)
+        if inicio is not None:
+            finalizar_medicion(inicio, perfil, conn, *datos)
+
+    response.call_on_close(cerrar)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    pool = agenda_principal().pool.stats()
+    cache = cache_busquedas.stats()
+    reportes = cola_reportes.stats()
+    extras = (
+        ('contacts_db_pool_in_use', 'Conexiones del pool en uso.', pool['in_use']),
+        ('contacts_db_pool_idle', 'Conexiones del pool libres.', pool['idle']),
+        ('contacts_db_pool_waits', 'Veces que una petición esperó una conexión libre.', pool['waits']),
+        ('contacts_query_cache_entries', 'Entradas en la caché de búsquedas.', cache['entries']),
+        ('contacts_query_cache_hits', 'Aciertos de la caché de búsquedas.', cache['hits']),
+        ('contacts_query_cache_misses', 'Fallos de la caché de búsquedas.', cache['misses']),
+        ('contacts_books_open', 'Agendas con nombre abiertas.', agendas.stats()['open']),
+        ('contacts_reports_queued', 'Reportes en cola esperando ser guardados.', reportes['queued']),
+        ('contacts_reports_written', 'Reportes guardados.', reportes['written']),
+        ('contacts_reports_rejected', 'Reportes rechazados por cola llena.', reportes['rejected']),
+    )
+    return Response(metricas.render(extras), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Arma la expresión MATCH de FTS5 para un término de búsqueda. El término se pasa
+# como frase entre comillas para que los caracteres especiales no se interpreten.
+def expresion_fts(search_term):
+    frase = '"' + search_term.replace('"', '""') + '"'
+    expresion = f'{{nombre telefono direccion}} : {frase}'
+    digitos = ''.join(c for c in search_term if c.isdigit())
+    if len(digitos) >= MIN_LONGITUD_FTS:
+        expresion += f' OR telefono_digitos : "{digitos}"'
+    return expresion
+
+# Búsqueda con el índice FTS5. Devuelve el FROM, la condición WHERE, sus
+# parámetros y el orden por relevancia (bm25) para armar la consulta.
+def busqueda_fts(search_term):
+    return ('contactos AS c JOIN contactos_fts ON contactos_fts.rowid = c.rowid',
+            'contactos_fts MATCH ?', [expresion_fts(search_term)], 'bm25(contactos_fts)')
+
+# Búsqueda sin índice: se usa con términos cortos o si la base no tiene FTS5.
+def busqueda_like(search_term):
+    patron = f'%{search_term}%'
+    params = [patron, patron, patron]
+    condiciones = 'c.nombre LIKE ? OR c.telefono LIKE ? OR c.direccion LIKE ?'
+    digitos = ''.join(c for c in search_term if c.isdigit())
+    if digitos:
+        condiciones += " OR c.telefono_normalizado LIKE ?"
+        params.append(f'%{digitos}%')
+    return 'contactos AS c', f'({condiciones})', params, None
+
+# Búsqueda aproximada (mode=fuzzy): encuentra nombres aunque difieran en acentos,
+# mayúsculas, ortografía ("Gonzales" / "González") o por un error de tipeo. Los
+# candidatos salen del índice de claves fonéticas y se ordenan por distancia de
+# edición en Python; así nunca se recorre toda la tabla.
+
+# Candidatos que se traen del índice por búsqueda antes de ordenarlos
+FUZZY_CANDIDATES = int(os.environ.get('CONTACTS_FUZZY_CANDIDATES', 100))
+
+# Resultados de una búsqueda aproximada si no se indica limit
+FUZZY_MAX_RESULTS = 50
+
+MODOS_BUSQUEDA = ('contains', 'fuzzy')
+
+def marcadores(valores):
+    return ', '.join('?' * len(valores))
+
+# Distancia de edición (Levenshtein) entre dos palabras. Si pasa del tope deja de
+# calcular y devuelve tope + 1.
+def distancia_edicion(a, b, tope):
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > tope:
+        return tope + 1
+    if Levenshtein is not None:
+        return Levenshtein.distance(a, b, score_cutoff=tope)
+    anterior = list(range(len(b) + 1))
+    for i, letra_a in enumerate(a, 1):
+        actual = [i]
+        for j, letra_b in enumerate(b, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + (letra_a != letra_b)))
+        if min(actual) > tope:
+            return tope + 1
+        anterior = actual
+    return min(anterior[-1], tope + 1)
+
+# Errores tolerados en una palabra buscada: 1 hasta 4 letras, 2 hasta 9, luego 3
+def tolerancia(palabra):
+    return 1 + len(palabra) // 5
+
+# Suma, para cada palabra buscada, la distancia a la palabra más parecida del
+# nombre. Una palabra que suena igual (misma clave fonética) cuenta como la
+# tolerancia. Devuelve None si alguna palabra no tiene ninguna parecida.
+def puntaje_aproximado(busqueda, nombre):
+    palabras = plegar_texto(nombre).split()
+    total = 0
+    for palabra, clave in busqueda:
+        tope = tolerancia(palabra)
+        mejor = tope + 1
+        for candidata in palabras:
+            distancia = distancia_edicion(palabra, candidata, tope)
+            if distancia > tope and clave_fonetica(candidata) == clave:
+                distancia = tope
+            mejor = min(mejor, distancia)
+        if mejor > tope:
+            return None
+        total += mejor
+    return total
+
+# Ids de hasta `limite` contactos que comparten alguna clave con cada palabra
+# buscada. Los candidatos salen de la palabra con menos coincidencias en el índice
+# (primero por su clave exacta, después por las variantes); las demás solo filtran.
+def candidatos_aproximados(cursor, claves_por_palabra, limite):
+    if len(claves_por_palabra) > 1:
+        def coincidencias(claves):
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM (SELECT 1 FROM contactos_claves WHERE clave IN ({marcadores(claves)}) LIMIT ?)
+            ''', claves + [limite * 20])
+            return cursor.fetchone()[0]
+        claves_por_palabra = sorted(claves_por_palabra, key=coincidencias)
+
+    principal, otras = claves_por_palabra[0], claves_por_palabra[1:]
+    filtros = ''.join(f'''
+        AND EXISTS (SELECT 1 FROM contactos_claves AS o WHERE o.id = k.id AND o.clave IN ({marcadores(claves)}))
+    ''' for claves in otras)
+    params_filtros = [clave for claves in otras for clave in claves]
+
+    ids = OrderedDict()
+    for claves in (principal[:1], principal[1:]):
+        if not claves or len(ids) >= limite:
+            continue
+        cursor.execute(f'''
+            SELECT DISTINCT k.id FROM contactos_claves AS k
+            WHERE k.clave IN ({marcadores(claves)}) {filtros} LIMIT ?
+        ''', claves + params_filtros + [limite])
+        for fila in cursor.fetchall():
+            ids[fila[0]] = None
+    return list(ids)[:limite]
+
+# Resultado de GET /contacts con mode=fuzzy: los `limit` contactos (o
+# FUZZY_MAX_RESULTS) más parecidos, del más cercano al más lejano. No tiene
+# páginas siguientes. Antes indexa los contactos que hayan quedado pendientes
+# (escritos por fuera de la API).
+def resultado_aproximado(cursor, search_term, pagina, telefono):
+    cursor.execute('SELECT 1 FROM contactos_claves_pendientes LIMIT 1')
+    if cursor.fetchone():
+        cursor.execute('BEGIN IMMEDIATE')
+        indexar_claves_pendientes(cursor)
+        cursor.execute('COMMIT')
+
+    limite = pagina['limit'] if pagina else FUZZY_MAX_RESULTS
+    busqueda = [(palabra, clave_fonetica(palabra)) for palabra in plegar_texto(search_term).split()]
+    busqueda = [(palabra, clave) for palabra, clave in busqueda if clave]
+    contactos = []
+    ids = candidatos_aproximados(cursor, [claves_palabra(palabra) for palabra, _ in busqueda],
+                                 FUZZY_CANDIDATES) if busqueda else []
+    if ids:
+        condicion, params = f'c.rowid IN ({marcadores(ids)})', list(ids)
+        if telefono:
+            condicion += f' AND {telefono[0]}'
+            params += telefono[1]
+        cursor.execute(f'SELECT {columnas_contacto()} FROM contactos AS c WHERE {condicion}', params)
+        puntuados = []
+        for fila in cursor.fetchall():
+            puntaje = puntaje_aproximado(busqueda, fila['nombre'])
+            if puntaje is not None:
+                puntuados.append((puntaje, fila['nombre'], dict(fila)))
+        puntuados.sort(key=lambda puntuado: puntuado[:2])
+        contactos = [contacto for _, _, contacto in puntuados[:limite]]
+
+    if pagina is None:
+        return contactos
+    resultado = {'contacts': contactos, 'next_cursor': None}
+    if pagina['include_total']:
+        resultado['total'] = len(contactos)
+    return resultado
+
+# Filtro por teléfono de GET /contacts: ?phone= (igual) o ?phone_prefix= (empieza
+# con). Compara la clave normalizada, así que "555-1234" encuentra "5551234", y
+# usa el índice de telefono_normalizado. Devuelve (condición, parámetros) o None.
+def filtro_telefono(args):
+    for parametro, prefijo in (('phone', False), ('phone_prefix', True)):
+        valor = args.get(parametro)
+        if valor is None:
+            continue
+        clave = normalizar_telefono(valor)
+        if clave is None:
+            raise ValueError(f'El parámetro "{parametro}" debe contener al menos un dígito.')
+        if not prefijo:
+            return 'c.telefono_normalizado = ?', [clave]
+        # Las claves solo tienen dígitos y ':' es el carácter siguiente a '9', así
+        # que el rango [clave, clave + ':') son exactamente las claves con ese prefijo.
+        return 'c.telefono_normalizado >= ? AND c.telefono_normalizado < ?', [clave, clave + ':']
+    return None
+
+# Tamaño de página por defecto y máximo para GET /contacts paginado
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Columnas por las que se puede ordenar el listado paginado ("-" = descendente)
+COLUMNAS_ORDEN = ('nombre', 'telefono', 'direccion')
+
+# El cursor es opaco para el cliente: guarda el valor de la columna de orden y el
+# nombre (clave primaria, desempata) de la última fila devuelta.
+def codificar_cursor(valor, nombre):
+    datos = json.dumps([valor, nombre]).encode('utf-8')
+    return base64.urlsafe_b64encode(datos).decode('ascii')
+
+def decodificar_cursor(cursor_param):
+    try:
+        valor, nombre = json.loads(base64.urlsafe_b64decode(cursor_param.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('El cursor de paginación no es válido.')
+    return valor, nombre
+
+# Lee y valida los parámetros de paginación (limit, cursor, sort). Devuelve None
+# si la petición no pide paginación, para mantener la respuesta como lista.
+def parametros_paginacion(args):
+    if 'limit' not in args and 'cursor' not in args:
+        return None
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('El parámetro "limit" debe ser un número entero.')
+    if limit < 1:
+        raise ValueError('El parámetro "limit" debe ser mayor que cero.')
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    sort = args.get('sort', 'nombre')
+    descendente = sort.startswith('-')
+    columna = sort.lstrip('-')
+    if columna not in COLUMNAS_ORDEN:
+        raise ValueError(f'No se puede ordenar por "{columna}". Opciones: {", ".join(COLUMNAS_ORDEN)}')
+
+    cursor_param = args.get('cursor')
+    despues_de = decodificar_cursor(cursor_param) if cursor_param else None
+
+    return {
+        'limit': limit,
+        'columna': columna,
+        'descendente': descendente,
+        'despues_de': despues_de,
+        'include_total': args.get('include_total', '').lower() in ('1', 'true', 'yes'),
+    }
+
+# Devuelve una página usando paginación por clave (keyset) sobre (columna, nombre):
+# no usa OFFSET, así que el costo no crece con el número de página y las
+# inserciones concurrentes no desplazan las filas ya vistas.
+def pagina_contactos(cursor, tabla, condicion, params, pagina):
+    columna = pagina['columna']
+    direccion_orden = 'DESC' if pagina['descendente'] else 'ASC'
+    comparacion = '<' if pagina['descendente'] else '>'
+
+    condiciones = [condicion] if condicion else []
+    params_pagina = list(params)
+    if pagina['despues_de'] is not None:
+        if columna == 'nombre':
+            condiciones.append(f'c.nombre {comparacion} ?')
+            params_pagina.append(pagina['despues_de'][1])
+        else:
+            condiciones.append(f'(c.{columna}, c.nombre) {comparacion} (?, ?)')
+            params_pagina.extend(pagina['despues_de'])
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+
+    orden = f'c.nombre {direccion_orden}'
+    if columna != 'nombre':
+        orden = f'c.{columna} {direccion_orden}, {orden}'
+
+    # Se pide una fila de más para saber si hay una página siguiente
+    cursor.execute(f'''
+        SELECT {columnas_contacto()} FROM {tabla} {where}
+        ORDER BY {orden} LIMIT ?
+    ''', params_pagina + [pagina['limit'] + 1])
+    filas = cursor.fetchall()
+
+    contactos = [dict(row) for row in filas[:pagina['limit']]]
+    next_cursor = None
+    if len(filas) > pagina['limit']:
+        ultimo = contactos[-1]
+        next_cursor = codificar_cursor(ultimo[columna], ultimo['nombre'])
+
+    resultado = {'contacts': contactos, 'next_cursor': next_cursor}
+    if pagina['include_total']:
+        where_total = f'WHERE {condicion}' if condicion else ''
+        cursor.execute(f'SELECT COUNT(*) FROM {tabla} {where_total}', params)
+        resultado['total'] = cursor.fetchone()[0]
+    return resultado
+
+# Caché LRU con vencimiento para los resultados de búsqueda. Cada entrada guarda la
+# revisión de la agenda con la que se calculó: si la agenda cambió (incluso desde
+# otro proceso) la entrada ya no sirve. Las rutas que escriben además la vacían.
+class QueryCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, clave, revision):
+        with self._lock:
+            entrada = self._entries.get(clave)
+            if entrada is not None:
+                revision_entrada, creada, resultado = entrada
+                if revision_entrada == revision and time.monotonic() - creada < self.ttl:
+                    self._entries.move_to_end(clave)
+                    self.hits += 1
+                    return resultado
+                del self._entries[clave]
+            self.misses += 1
+            return None
+
+    def put(self, clave, revision, resultado):
+        with self._lock:
+            self._entries[clave] = (revision, time.monotonic(), resultado)
+            self._entries.move_to_end(clave)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+cache_busquedas = QueryCache(int(os.environ.get('CONTACTS_QUERY_CACHE_SIZE', 256)),
+                             float(os.environ.get('CONTACTS_QUERY_CACHE_TTL', 60)))
+
+@app.route('/stats/cache', methods=['GET'])
+def query_cache_stats():
+    return jsonify(cache_busquedas.stats())
+
+# --- Formatos de respuesta y compresión ---
+
+# Las respuestas (no streaming) de al menos esta cantidad de bytes se comprimen
+# si el cliente lo acepta; por debajo no vale la pena el costo de CPU.
+COMPRESS_MIN_BYTES = int(os.environ.get('CONTACTS_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Formatos de la lista de contactos. El columnar manda una lista por campo en vez
+# de repetir las claves en cada contacto: {"nombre": [...], "telefono": [...], ...}
+FORMATO_JSON = 'application/json'
+FORMATO_COLUMNAS = 'application/vnd.contactos.columnar+json'
+FORMATO_MSGPACK = 'application/msgpack'  # columnar, codificado con MessagePack
+FORMATOS_CONTACTOS = [FORMATO_JSON, FORMATO_COLUMNAS] + ([FORMATO_MSGPACK, 'application/x-msgpack'] if msgpack else [])
+
+# Cada formato tiene su propio ETag, para que un 304 no devuelva otro formato
+SUFIJOS_ETAG = {FORMATO_JSON: '', FORMATO_COLUMNAS: '-columnar', FORMATO_MSGPACK: '-msgpack'}
+
+CODIFICACIONES = ['br', 'gzip'] if brotli else ['gzip']
+
+# Devuelve la mejor compresión aceptada por el cliente ('br', 'gzip') o None
+def codificacion_preferida():
+    return request.accept_encodings.best_match(CODIFICACIONES)
+
+def formato_preferido():
+    formato = request.accept_mimetypes.best_match(FORMATOS_CONTACTOS, default=FORMATO_JSON)
+    return FORMATO_MSGPACK if formato == 'application/x-msgpack' else formato
+
+def a_columnas(contactos):
+    claves = list(contactos[0]) if contactos else ['nombre', 'telefono', 'direccion']
+    return {clave: [c[clave] for c in contactos] for clave in claves}
+
+# Arma la respuesta de /contacts en el formato pedido. El resultado es una lista de
+# contactos o una página {'contacts': [...], 'next_cursor': ..., 'total': ...}.
+def respuesta_contactos(resultado, formato):
+    if formato == FORMATO_JSON:
+        return jsonify(resultado)
+    if isinstance(resultado, dict):
+        datos = dict(resultado, contacts=a_columnas(resultado['contacts']))
+    else:
+        datos = a_columnas(resultado)
+    if formato == FORMATO_MSGPACK:
+        return Response(msgpack.packb(datos, use_bin_type=True), mimetype=FORMATO_MSGPACK)
+    return Response(json.dumps(datos, ensure_ascii=False, separators=(',', ':')), mimetype=FORMATO_COLUMNAS)
+
+# Comprime las respuestas grandes ya armadas en memoria. Las respuestas por streaming
+# (como /export) se comprimen por bloques en su propia ruta.
+@app.after_request
+def comprimir_respuesta(response):
+    if (response.direct_passthrough or response.is_streamed or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    datos = response.get_data()
+    if len(datos) < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    codificacion = codificacion_preferida()
+    if codificacion is None:
+        return response
+
+    if codificacion == 'br':
+        response.set_data(brotli.compress(datos, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(datos, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = codificacion
+    # Los bytes cambian con la compresión: el ETag pasa a ser débil, que sigue
+    # sirviendo para If-None-Match.
+    etag, debil = response.get_etag()
+    if etag and not debil:
+        response.set_etag(etag, weak=True)
+    return response
+
 @app.route('/contacts', methods=['GET'])
 def get_all_contacts():
-    conn = get_db_connection()
+    try:
+        pagina = parametros_paginacion(request.args)
+        telefono = filtro_telefono(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    modo = request.args.get('mode', 'contains')
+    if modo not in MODOS_BUSQUEDA:
+        return jsonify({'error': f'Modo de búsqueda no válido. Opciones: {", ".join(MODOS_BUSQUEDA)}'}), 400
+
+    fuente = fuente_lectura()
+    conn = get_db_connection(fuente)
     cursor = conn.cursor()
     
     search_term = request.args.get('query')
+    # Mientras se construye el índice aproximado, mode=fuzzy usa la búsqueda común
+    aproximada = bool(search_term) and modo == 'fuzzy' and fuente.busqueda_aproximada_disponible
     
     if search_term:
-        cursor.execute(
-            'SELECT * FROM contactos WHERE nombre LIKE ? OR telefono LIKE ? OR direccion LIKE ?',
-            (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%')
-        )
+        if fuente.fts_disponible and len(search_term) >= MIN_LONGITUD_FTS:
+            tabla, condicion, params, relevancia = busqueda_fts(search_term)
+        else:
+            tabla, condicion, params, relevancia = busqueda_like(search_term)
     else:
-        cursor.execute('SELECT * FROM contactos')
-        
-    contactos = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify(contactos)
+        tabla, condicion, params, relevancia = 'contactos AS c', None, [], None
+    if telefono:
+        condicion_telefono, params_telefono = telefono
+        condicion = f'{condicion} AND {condicion_telefono}' if condicion else condicion_telefono
+        params = params + params_telefono
 
-@app.route('/contacts', methods=['POST'])
-def add_contact():
-    data = request.get_json()
-    nombre = data.get('nombre')
-    telefono = data.get('telefono')
-    direccion = data.get('direccion')
+    # La revisión y la versión del esquema identifican lo que devuelve la agenda
+    # (una migración puede agregar campos, como version): si el cliente ya tiene la
+    # respuesta para ambas (If-None-Match) no se vuelve a consultar. Una
+    # instantánea no conserva la versión del esquema; se usa la de su agenda.
+    revision, esquema = version_datos(cursor)
+    if isinstance(fuente, Instantanea):
+        esquema = fuente.version[1]
+    formato = formato_preferido()
+    etag = f'rev-{revision}-{esquema}' + SUFIJOS_ETAG[formato]
+    if request.if_none_match.contains_weak(etag):
+        respuesta = Response(status=304)
+    else:
+        # Solo se guardan en caché las búsquedas y filtros: el listado completo puede ser enorme
+        clave = (agenda_actual().nombre,) + tuple(sorted(request.args.items())) if search_term or telefono else None
+        resultado = cache_busquedas.get(clave, (revision, esquema)) if clave else None
+        if resultado is None:
+            if aproximada:
+                resultado = resultado_aproximado(cursor, search_term, pagina, telefono)
+            elif pagina is not None:
+                resultado = pagina_contactos(cursor, tabla, condicion, params, pagina)
+            else:
+                where = f'WHERE {condicion}' if condicion else ''
+                orden = f'ORDER BY {relevancia}' if relevancia else ''
+                cursor.execute(f'SELECT {columnas_contacto()} FROM {tabla} {where} {orden}', params)
+                resultado = [dict(row) for row in cursor.fetchall()]
+            if clave:
+                cache_busquedas.put(clave, (revision, esquema), resultado)
+        respuesta = respuesta_contactos(resultado, formato)
 
-    if not all([nombre, telefono, direccion]):
-        return jsonify({'error': 'Faltan datos obligatorios'}), 400
+    respuesta.set_etag(etag)
+    respuesta.headers['X-Revision'] = str(revision)
+    respuesta.vary.add('Accept')
+    return respuesta
+
+@app.route('/contacts/changes', methods=['GET'])
+def get_contact_changes():
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'El parámetro "since" debe ser un número entero.'}), 400
 
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM contactos WHERE telefono = ?", (telefono,))
-    if cursor.fetchone()[0] > 0:
-        conn.close()
-        return jsonify({'error': f'Ya existe un contacto con el teléfono "{telefono}".'}), 409
+    revision = revision_actual(cursor)
 
-    try:
-        cursor.execute("INSERT INTO contactos (nombre, telefono, direccion) VALUES (?, ?, ?)",
-                       (nombre, telefono, direccion))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
-        return jsonify({'error': f'El contacto con nombre "{nombre}" ya existe.'}), 409
-    finally:
-        conn.close()
-    
-    return jsonify({'message': f'Contacto "{nombre}" agregado exitosamente.'}), 201
+    # Si las revisiones pedidas ya se descartaron, el cliente debe recargar todo
+    cursor.execute('SELECT MIN(rev) FROM contactos_cambios')
+    primera = cursor.fetchone()[0]
+    if since > revision or (since < revision and (primera is None or since < primera - 1)):
+        return jsonify({'reset': True, 'revision': revision, 'changes': [], 'has_more': False})
 
-@app.route('/contacts/<nombre>', methods=['PUT'])
-def update_contact(nombre):
-    data = request.get_json()
-    telefono = data.get('telefono')
-    direccion = data.get('direccion')
+    # Un contacto modificado varias veces aparece una sola vez, con su estado actual
+    con_version = g.db_fuente.versiones_disponibles
+    cursor.execute(f'''
+        SELECT cambios.rev, cambios.nombre, c.telefono, c.direccion{', c.version' if con_version else ''}
+        FROM (
+            SELECT nombre, MAX(rev) AS rev FROM contactos_cambios
+            WHERE rev > ? GROUP BY nombre
+        ) AS cambios
+        LEFT JOIN contactos AS c ON c.nombre = cambios.nombre
+        ORDER BY cambios.rev
+        LIMIT ?
+    ''', (since, CHANGES_PAGE_SIZE + 1))
+    filas = cursor.fetchall()
+    has_more = len(filas) > CHANGES_PAGE_SIZE
+    filas = filas[:CHANGES_PAGE_SIZE]
+
+    changes = []
+    for fila in filas:
+        if fila['telefono'] is None:
+            changes.append({'op': 'delete', 'nombre': fila['nombre']})
+        else:
+            cambio = {'op': 'upsert', 'nombre': fila['nombre'],
+                      'telefono': fila['telefono'], 'direccion': fila['direccion']}
+            if con_version:
+                cambio['version'] = fila['version']
+            changes.append(cambio)
+
+    return jsonify({
+        'reset': False,
+        'revision': filas[-1]['rev'] if has_more else revision,
+        'changes': changes,
+        'has_more': has_more,
+    })
+
+INSERT_CONTACTO_SQL = '''
+    INSERT INTO contactos (nombre, telefono, direccion, telefono_normalizado) VALUES (?, ?, ?, ?)
+'''
+
+MENSAJE_TELEFONO_INVALIDO = 'El teléfono debe contener al menos un dígito.'
+
+MENSAJE_TELEFONO_TIPO = 'El teléfono debe ser un texto o un número entero.'
+
+# Revisa los tipos de los campos que llegan en el JSON (POST, PUT y
+# /contacts/batch): nombre y dirección deben ser texto y el teléfono texto o un
+# número entero. Devuelve la respuesta 400 del primero que no lo es, o None.
+def error_tipo_campos(nombre=None, telefono=None, direccion=None):
+    for campo, valor in (('nombre', nombre), ('direccion', direccion)):
+        if valor is not None and not isinstance(valor, str):
+            return 400, {'error': f'"{campo}" debe ser un texto.'}
+    if telefono is not None and telefono_como_texto(telefono) is None:
+        return 400, {'error': MENSAJE_TELEFONO_TIPO}
+    return None
+
+MENSAJE_SIN_VERSIONES = 'La agenda todavía no tiene versiones de contactos; reintente en unos segundos.'
+
+# Versiones aceptadas según la cabecera If-Match ("3" o "3", "4"), o None si el
+# pedido no pone condición (sin cabecera o con *). Las etiquetas que no son un
+# número no coinciden con ninguna versión.
+def versiones_if_match():
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    return [int(etiqueta) for etiqueta in if_match.as_set() if etiqueta.isdigit()]
+
+# Estado actual de un contacto (con su versión si la agenda ya la tiene), o None
+# si no existe
+def contacto_actual(cursor, nombre):
+    columnas = ['nombre', 'telefono', 'direccion']
+    if agenda_actual().versiones_disponibles:
+        columnas.append('version')
+    cursor.execute(f'SELECT {", ".join(columnas)} FROM contactos WHERE nombre = ?', (nombre,))
+    fila = cursor.fetchone()
+    return dict(zip(columnas, fila)) if fila is not None else None
+
+# Respuesta de una escritura condicional que no se aplicó: 404 si el contacto no
+# existe, o 412 con su estado actual para que el cliente lo actualice sin recargar todo.
+def conflicto_version(cursor, nombre):
+    contacto = contacto_actual(cursor, nombre)
+    if contacto is None:
+        return 404, {'error': f'Contacto "{nombre}" no encontrado.'}
+    return 412, {'error': f'El contacto "{nombre}" fue modificado por otro usuario '
+                          f'(versión actual: {contacto["version"]}).',
+                 'contact': contacto}
+
+# Condición SQL para una escritura condicional: (texto a agregar al WHERE, parámetros)
+def condicion_version(versiones):
+    if versiones is None:
+        return '', []
+    if not versiones:
+        return ' AND 0', []
+    return f' AND version IN ({marcadores(versiones)})', list(versiones)
+
+# Operaciones sobre un contacto compartidas por las rutas individuales y por
+# /contacts/batch. No consultan antes si el contacto o el teléfono existen: se
+# apoyan en las restricciones de la tabla (clave primaria y teléfono normalizado
+# único) y, con versiones (If-Match), en la condición del mismo UPDATE o DELETE;
+# solo si la escritura no se aplicó se consulta por qué. Devuelven (código HTTP,
+# cuerpo) y no hacen commit.
+def crear_contacto(cursor, nombre, telefono, direccion):
+    error = error_tipo_campos(nombre, telefono, direccion)
+    if error:
+        return error
+    if not all([nombre, telefono, direccion]):
+        return 400, {'error': 'Faltan datos obligatorios'}
+    telefono = telefono_como_texto(telefono)
+    telefono_normalizado = normalizar_telefono(telefono)
+    if telefono_normalizado is None:
+        return 400, {'error': MENSAJE_TELEFONO_INVALIDO}
+    try:
+        cursor.execute(INSERT_CONTACTO_SQL, (nombre, telefono, direccion, telefono_normalizado))
+    except sqlite3.IntegrityError as e:
+        if codigo_conflicto(e) == 'duplicate_phone':
+            return 409, {'error': f'Ya existe un contacto con el teléfono "{telefono}".'}
+        return 409, {'error': f'El contacto con nombre "{nombre}" ya existe.'}
+    cuerpo = {'message': f'Contacto "{nombre}" agregado exitosamente.'}
+    if agenda_actual().versiones_disponibles:
+        cuerpo['version'] = 1
+    return 201, cuerpo
 
+def actualizar_contacto(cursor, nombre, telefono, direccion, versiones=None):
+    error = error_tipo_campos(nombre, telefono, direccion)
+    if error:
+        return error
     if not telefono and not direccion:
-        return jsonify({'error': 'Se requiere al menos el teléfono o la dirección para actualizar'}), 400
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if telefono:
-        cursor.execute("SELECT COUNT(*) FROM contactos WHERE telefono = ? AND nombre != ?", (telefono, nombre))
-        if cursor.fetchone()[0] > 0:
-            conn.close()
-            return jsonify({'error': f'Ya existe otro contacto con el teléfono "{telefono}".'}), 409
-            
+        return 400, {'error': 'Se requiere al menos el teléfono o la dirección para actualizar'}
+
     query_parts = []
     params = []
     if telefono:
-        query_parts.append("telefono = ?")
-        params.append(telefono)
+        telefono = telefono_como_texto(telefono)
+        telefono_normalizado = normalizar_telefono(telefono)
+        if telefono_normalizado is None:
+            return 400, {'error': MENSAJE_TELEFONO_INVALIDO}
+        query_parts.append("telefono = ?, telefono_normalizado = ?")
+        params.extend([telefono, telefono_normalizado])
     if direccion:
         query_parts.append("direccion = ?")
         params.append(direccion)
         
+    con_versiones = agenda_actual().versiones_disponibles
+    if con_versiones:
+        # La versión se incrementa en el mismo UPDATE y RETURNING la devuelve,
+        # sin otra consulta (el trigger contactos_version no vuelve a sumarla)
+        query_parts.append("version = version + 1")
     set_clause = ", ".join(query_parts)
+    condicion, params_version = condicion_version(versiones)
     params.append(nombre)
-    
-    cursor.execute(f"UPDATE contactos SET {set_clause} WHERE nombre = ?", tuple(params))
-    conn.commit()
-    
+    returning = " RETURNING version" if con_versiones else ""
+
+    try:
+        cursor.execute(f"UPDATE contactos SET {set_clause} WHERE nombre = ?{condicion}{returning}",
+                       tuple(params + params_version))
+        filas = cursor.fetchall()
+    except sqlite3.IntegrityError:
+        return 409, {'error': f'Ya existe otro contacto con el teléfono "{telefono}".'}
+
+    aplicado = bool(filas) if con_versiones else cursor.rowcount > 0
+    if not aplicado:
+        if versiones is not None:
+            return conflicto_version(cursor, nombre)
+        return 404, {'error': f'Contacto "{nombre}" no encontrado.'}
+    cuerpo = {'message': f'Contacto "{nombre}" actualizado exitosamente.'}
+    if con_versiones:
+        cuerpo['version'] = filas[0][0]
+    return 200, cuerpo
+
+def eliminar_contacto(cursor, nombre, versiones=None):
+    error = error_tipo_campos(nombre)
+    if error:
+        return error
+    condicion, params_version = condicion_version(versiones)
+    cursor.execute(f"DELETE FROM contactos WHERE nombre = ?{condicion}", [nombre] + params_version)
     if cursor.rowcount == 0:
-        conn.close()
-        return jsonify({'error': f'Contacto "{nombre}" no encontrado.'}), 404
-        
-    conn.close()
-    return jsonify({'message': f'Contacto "{nombre}" actualizado exitosamente.'}), 200
+        if versiones is not None:
+            return conflicto_version(cursor, nombre)
+        return 404, {'error': f'Contacto "{nombre}" no encontrado.'}
+    return 200, {'message': f'Contacto "{nombre}" eliminado exitosamente.'}
+
+@app.route('/contacts', methods=['POST'])
+def add_contact():
+    data = request.get_json()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    status, cuerpo = crear_contacto(cursor, data.get('nombre'), data.get('telefono'), data.get('direccion'))
+    if status == 201:
+        actualizar_indice_aproximado(cursor)
+        conn.commit()
+        cache_busquedas.invalidate()
+    return jsonify(cuerpo), status
+
+# Con If-Match: "<versión>" la actualización solo se aplica si el contacto sigue
+# en esa versión; si no, 412 con el contacto actual. La respuesta trae la nueva
+# versión en el cuerpo y en ETag.
+@app.route('/contacts/<nombre>', methods=['PUT'])
+def update_contact(nombre):
+    data = request.get_json()
+    versiones = versiones_if_match()
+    conn = get_db_connection()  # antes de mirar versiones_disponibles (ver Agenda.revisar_esquema)
+    if versiones is not None and not agenda_actual().versiones_disponibles:
+        return jsonify({'error': MENSAJE_SIN_VERSIONES}), 503, {'Retry-After': '5'}
+
+    status, cuerpo = actualizar_contacto(conn.cursor(), nombre, data.get('telefono'), data.get('direccion'),
+                                         versiones)
+    if status == 200:
+        conn.commit()
+        cache_busquedas.invalidate()
+    respuesta = jsonify(cuerpo)
+    if 'version' in cuerpo:
+        respuesta.set_etag(str(cuerpo['version']))
+    elif status == 412:
+        respuesta.set_etag(str(cuerpo['contact']['version']))
+    return respuesta, status
 
 @app.route('/contacts/<nombre>', methods=['DELETE'])
 def delete_contact(nombre):
+    versiones = versiones_if_match()
+    conn = get_db_connection()
+    if versiones is not None and not agenda_actual().versiones_disponibles:
+        return jsonify({'error': MENSAJE_SIN_VERSIONES}), 503, {'Retry-After': '5'}
+
+    cursor = conn.cursor()
+    status, cuerpo = eliminar_contacto(cursor, nombre, versiones)
+    if status == 200:
+        actualizar_indice_aproximado(cursor)
+        conn.commit()
+        cache_busquedas.invalidate()
+    return jsonify(cuerpo), status
+
+# Máximo de operaciones aceptadas en un solo pedido a /contacts/batch
+MAX_BATCH_OPERATIONS = 10000
+
+# Aplica una lista de operaciones (create, update, delete) en una sola transacción
+# con un único commit. Cada operación recibe su propio resultado; con
+# "atomic": true, si alguna falla no se aplica ninguna. Un update o delete con
+# "version" solo se aplica si el contacto sigue en esa versión (como If-Match).
+# Sin "atomic", las operaciones rechazadas por conflicto (404, 409, 412) traen en
+# "contact" el estado del contacto en la agenda (null si no existe), para que un
+# cliente con escrituras encoladas corrija su copia sin recargarla entera.
+@app.route('/contacts/batch', methods=['POST'])
+def batch_contacts():
+    data = request.get_json(silent=True)
+    operaciones = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operaciones, list):
+        return jsonify({'error': 'Se espera un objeto JSON con una lista "operations".'}), 400
+    if len(operaciones) > MAX_BATCH_OPERATIONS:
+        return jsonify({'error': f'Se aceptan como máximo {MAX_BATCH_OPERATIONS} operaciones por pedido.'}), 413
+    atomic = bool(data.get('atomic', False))
+
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM contactos WHERE nombre = ?", (nombre,))
+    # IMMEDIATE toma el bloqueo de escritura al empezar: con BEGIN a secas, una
+    # lectura previa a la primera escritura puede fallar con "database is locked"
+    # si otra transacción escribió entretanto, sin esperar el busy_timeout.
+    cursor.execute('BEGIN IMMEDIATE')
+
+    results = []
+    applied = 0
+    for index, operacion in enumerate(operaciones):
+        if not isinstance(operacion, dict):
+            operacion = {}
+        op = operacion.get('op')
+        nombre = operacion.get('nombre')
+        version = operacion.get('version')
+        versiones = None if version is None else [version]
+        if not nombre:
+            status, cuerpo = 400, {'error': 'Falta el nombre del contacto.'}
+        elif version is not None and (type(version) is not int or op not in ('update', 'delete')):
+            status, cuerpo = 400, {'error': '"version" debe ser un número entero y solo se acepta en update y delete.'}
+        elif version is not None and not agenda_actual().versiones_disponibles:
+            status, cuerpo = 503, {'error': MENSAJE_SIN_VERSIONES}
+        elif op == 'create':
+            status, cuerpo = crear_contacto(cursor, nombre, operacion.get('telefono'), operacion.get('direccion'))
+        elif op == 'update':
+            status, cuerpo = actualizar_contacto(cursor, nombre, operacion.get('telefono'), operacion.get('direccion'),
+                                                 versiones)
+        elif op == 'delete':
+            status, cuerpo = eliminar_contacto(cursor, nombre, versiones)
+        else:
+            status, cuerpo = 400, {'error': f'Operación desconocida: "{op}". Opciones: create, update, delete'}
+
+        if status < 300:
+            applied += 1
+        elif not atomic and status in (404, 409) and nombre:
+            cuerpo['contact'] = contacto_actual(cursor, nombre)
+        results.append({'index': index, 'op': op, 'nombre': nombre, 'status': status, **cuerpo})
+
+    failed = len(results) - applied
+    if atomic and failed:
+        conn.rollback()
+        return jsonify({'error': f'Fallaron {failed} operaciones; no se aplicó ningún cambio.',
+                        'applied': 0, 'failed': failed, 'results': results}), 409
+
+    actualizar_indice_aproximado(cursor)
     conn.commit()
-    
-    if cursor.rowcount == 0:
-        conn.close()
-        return jsonify({'error': f'Contacto "{nombre}" no encontrado.'}), 404
-        
-    conn.close()
-    return jsonify({'message': f'Contacto "{nombre}" eliminado exitosamente.'}), 200
+    if applied:
+        cache_busquedas.invalidate()
+    return jsonify({'applied': applied, 'failed': failed, 'results': results}), 200
+
+# --- Reportes de problemas (/enviar_mensaje) ---
+#
+# Los reportes se guardan en su propia base (así una ráfaga de reportes no compite
+# por el bloqueo de escritura con las rutas de contactos). La petición solo los
+# encola; un hilo escritor los inserta por lotes. Si la cola está llena se rechaza
+# el reporte con 503 y Retry-After en vez de hacer esperar a la petición.
+
+REPORTS_DATABASE_PATH = os.environ.get('CONTACTS_REPORTS_DB', 'reports.db')
+
+# Reportes que pueden esperar en memoria a ser escritos
+REPORTS_QUEUE_SIZE = int(os.environ.get('CONTACTS_REPORTS_QUEUE_SIZE', 10000))
+
+# Máximo de reportes por transacción del escritor
+REPORTS_BATCH_SIZE = 500
+
+# Tamaño de página por defecto y máximo de GET /reports
+REPORTS_PAGE_SIZE = 100
+MAX_REPORTS_PAGE_SIZE = 1000
+
+MAX_REPORT_LENGTH = 10000
+
+def conectar_reportes():
+    conn = sqlite3.connect(REPORTS_DATABASE_PATH, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f"PRAGMA synchronous = {DB_PRAGMAS['synchronous']}")
+    conn.execute(f"PRAGMA busy_timeout = {DB_PRAGMAS['busy_timeout']}")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reportes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mensaje TEXT NOT NULL,
+            recibido TEXT NOT NULL,
+            confirmado TEXT
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS reportes_pendientes ON reportes (id) WHERE confirmado IS NULL')
+    return conn
+
+# Cola acotada con un hilo que escribe los reportes por lotes. El hilo arranca con
+# el primer reporte (así cada proceso de gunicorn tiene el suyo) y al terminar el
+# proceso escribe lo que quedó en la cola.
+class ColaReportes:
+    def __init__(self, max_size, batch_size):
+        self.batch_size = batch_size
+        self._cola = queue.Queue(max_size)
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.encolados = 0
+        self.rechazados = 0
+        self.escritos = 0
+        self.lotes = 0
+        self.errores = 0
+        self.max_pendientes = 0
+
+    def encolar(self, mensaje):
+        """Agrega un reporte a la cola. Devuelve False si está llena."""
+        self._iniciar()
+        recibido = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        try:
+            self._cola.put_nowait((mensaje, recibido))
+        except queue.Full:
+            with self._lock:
+                self.rechazados += 1
+            return False
+        with self._lock:
+            self.encolados += 1
+            self.max_pendientes = max(self.max_pendientes, self._cola.qsize())
+        return True
+
+    def _iniciar(self):
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._escribir, name='reportes', daemon=True)
+                self._hilo.start()
+                atexit.register(self.detener)
+
+    # Espera el primer reporte, junta los que ya estén en la cola (hasta batch_size)
+    # y los inserta en una sola transacción
+    def _escribir(self):
+        conn = conectar_reportes()
+        try:
+            while not (self._detener.is_set() and self._cola.empty()):
+                try:
+                    lote = [self._cola.get(timeout=0.5)]
+                except queue.Empty:
+                    continue
+                while len(lote) < self.batch_size:
+                    try:
+                        lote.append(self._cola.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.executemany('INSERT INTO reportes (mensaje, recibido) VALUES (?, ?)', lote)
+                    conn.execute('COMMIT')
+                except sqlite3.Error as e:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    app.logger.error(f'No se pudieron guardar {len(lote)} reportes: {e}')
+                    with self._lock:
+                        self.errores += len(lote)
+                    continue
+                with self._lock:
+                    self.escritos += len(lote)
+                    self.lotes += 1
+        finally:
+            conn.close()
+
+    def detener(self, timeout=10):
+        """Escribe los reportes que quedan en la cola y termina el hilo."""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._cola.qsize(),
+                'max_queue_size': self._cola.maxsize,
+                'max_queued': self.max_pendientes,
+                'accepted': self.encolados,
+                'rejected': self.rechazados,
+                'written': self.escritos,
+                'batches': self.lotes,
+                'failed': self.errores,
+            }
+
+cola_reportes = ColaReportes(REPORTS_QUEUE_SIZE, REPORTS_BATCH_SIZE)
+
+_pool_reportes = None
+_pool_reportes_lock = threading.Lock()
+
+def get_pool_reportes():
+    global _pool_reportes
+    with _pool_reportes_lock:
+        if _pool_reportes is None or _pool_reportes.database_path != REPORTS_DATABASE_PATH:
+            if _pool_reportes is not None:
+                _pool_reportes.close_all()
+            _pool_reportes = ConnectionPool(REPORTS_DATABASE_PATH, 2, DB_POOL_TIMEOUT, conectar_reportes)
+        return _pool_reportes
 
 @app.route('/enviar_mensaje', methods=['POST'])
 def recibir_mensaje():
-    data = request.json
-    mensaje = data.get('mensaje')
-    if not mensaje:
+    data = request.get_json(silent=True)
+    mensaje = data.get('mensaje') if isinstance(data, dict) else None
+    if not mensaje or not isinstance(mensaje, str):
         return jsonify({'status': 'error', 'message': 'Mensaje no proporcionado'}), 400
+    if len(mensaje) > MAX_REPORT_LENGTH:
+        return jsonify({'status': 'error',
+                        'message': f'El mensaje no puede superar los {MAX_REPORT_LENGTH} caracteres.'}), 413
+
+    if not cola_reportes.encolar(mensaje):
+        respuesta = jsonify({'status': 'error',
+                             'message': 'Hay demasiados reportes pendientes; intentá de nuevo en unos segundos.'})
+        respuesta.headers['Retry-After'] = '1'
+        return respuesta, 503
+    return jsonify({'status': 'success', 'message': 'Mensaje recibido, gracias por el reporte.'}), 202
 
-    print(f"Mensaje recibido: {mensaje}")
-    return jsonify({'status': 'success', 'message': 'Mensaje recibido, gracias por el reporte.'})
+# Lista los reportes guardados, del más viejo al más nuevo, con paginación por id:
+# ?status=pending|acked|all (por defecto pending), ?limit= y ?cursor= (el
+# next_cursor de la página anterior). Los reportes que siguen en la cola todavía
+# no aparecen.
+@app.route('/reports', methods=['GET'])
+def listar_reportes():
+    estado = request.args.get('status', 'pending')
+    condiciones = {'pending': 'confirmado IS NULL', 'acked': 'confirmado IS NOT NULL', 'all': '1'}
+    if estado not in condiciones:
+        return jsonify({'error': f'Estado no válido. Opciones: {", ".join(condiciones)}'}), 400
+    try:
+        limit = min(int(request.args.get('limit', REPORTS_PAGE_SIZE)), MAX_REPORTS_PAGE_SIZE)
+        despues_de = int(request.args.get('cursor', 0))
+    except ValueError:
+        return jsonify({'error': 'Los parámetros "limit" y "cursor" deben ser números enteros.'}), 400
+    if limit < 1:
+        return jsonify({'error': 'El parámetro "limit" debe ser mayor que cero.'}), 400
+
+    pool = get_pool_reportes()
+    conn = pool.acquire()
+    try:
+        filas = conn.execute(f'''
+            SELECT id, mensaje, recibido, confirmado FROM reportes
+            WHERE {condiciones[estado]} AND id > ? ORDER BY id LIMIT ?
+        ''', (despues_de, limit + 1)).fetchall()
+    finally:
+        pool.release(conn)
+
+    reportes = [{'id': fila['id'], 'mensaje': fila['mensaje'], 'received_at': fila['recibido'],
+                 'acked_at': fila['confirmado']} for fila in filas[:limit]]
+    next_cursor = str(reportes[-1]['id']) if len(filas) > limit else None
+    return jsonify({'reports': reportes, 'next_cursor': next_cursor})
+
+# Marca reportes como atendidos: {"ids": [1, 2, 3]}. Los ya confirmados no cambian.
+@app.route('/reports/ack', methods=['POST'])
+def confirmar_reportes():
+    data = request.get_json(silent=True)
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({'error': 'Se espera un objeto JSON con una lista de ids enteros "ids".'}), 400
+    if len(ids) > MAX_REPORTS_PAGE_SIZE:
+        return jsonify({'error': f'Se aceptan como máximo {MAX_REPORTS_PAGE_SIZE} ids por pedido.'}), 413
+
+    confirmado = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    pool = get_pool_reportes()
+    conn = pool.acquire()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.executemany('UPDATE reportes SET confirmado = ? WHERE id = ? AND confirmado IS NULL',
+                                  [(confirmado, i) for i in ids])
+        confirmados = cursor.rowcount
+        conn.execute('COMMIT')
+    finally:
+        pool.release(conn)
+    return jsonify({'acked': confirmados})
+
+@app.route('/stats/reports', methods=['GET'])
+def report_stats():
+    return jsonify(cola_reportes.stats())
+
+# Función que detiene el servidor en curso de forma ordenada. La define el modo de
+# ejecución elegido en run_server (waitress, gunicorn o el servidor de desarrollo).
+_detener_servidor = None
 
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     print("Apagando el servidor...")
-    os.kill(os.getpid(), signal.SIGINT)
-    return jsonify({'response': 'Servidor apagado'}), 200
+    respuesta = jsonify({'response': 'Servidor apagado'})
+    if _detener_servidor is not None:
+        # Se detiene después de enviar la respuesta, dejando terminar los pedidos en curso
+        respuesta.call_on_close(_detener_servidor)
+    else:
+        os.kill(os.getpid(), signal.SIGINT)
+    return respuesta, 200
+
+# Indica si el servidor está listo para atender pedidos (la base responde).
+# main.py lo consulta al arrancar en lugar de esperar un tiempo fijo.
+@app.route('/ready', methods=['GET'])
+def ready():
+    try:
+        get_db_connection().execute('SELECT 1 FROM contactos LIMIT 1')
+    except (sqlite3.Error, RuntimeError) as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ready'}), 200
+
+# Cantidad de filas que se leen de la base y se envían por cada bloque del CSV
+EXPORT_CHUNK_ROWS = 1000
+
+# Genera el CSV por bloques a medida que se leen las filas del cursor, sin
+# armar el archivo completo en memoria.
+def generar_csv(cursor):
+    si = io.StringIO(newline='')
+    cw = csv.writer(si)
+    cw.writerow(['nombre', 'telefono', 'direccion'])
+    while True:
+        filas = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+        if not filas:
+            break
+        cw.writerows(filas)
+        yield si.getvalue().encode('utf-8')
+        si.seek(0)
+        si.truncate(0)
+    if si.tell():
+        yield si.getvalue().encode('utf-8')
+
+# Comprime con gzip un flujo de bloques de bytes sin esperar a tenerlo completo.
+def comprimir_gzip(bloques):
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> formato gzip
+    for bloque in bloques:
+        comprimido = compresor.compress(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+def comprimir_brotli(bloques):
+    compresor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for bloque in bloques:
+        comprimido = compresor.process(bloque)
+        if comprimido:
+            yield comprimido
+    yield compresor.finish()
 
 @app.route('/export', methods=['GET'])
 def export_contacts():
-    conn = get_db_connection()
+    conn = get_db_connection(fuente_lectura())
     cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM contactos')
+    total = cursor.fetchone()[0]
     cursor.execute('SELECT nombre, telefono, direccion FROM contactos')
-    contacts = cursor.fetchall()
-    conn.close()
 
-    si = io.StringIO(newline='')
-    cw = csv.writer(si)
-    
-    cw.writerow(['nombre', 'telefono', 'direccion'])
-    
-    cw.writerows(contacts)
-    
-    output = make_response(si.getvalue())
+    contenido = generar_csv(cursor)
+    codificacion = codificacion_preferida()
+    if codificacion == 'br':
+        contenido = comprimir_brotli(contenido)
+    elif codificacion == 'gzip':
+        contenido = comprimir_gzip(contenido)
+
+    output = Response(contenido, mimetype='text/csv')
     output.headers['Content-Disposition'] = 'attachment; filename=contacts.csv'
     output.headers['Content-type'] = 'text/csv; charset=utf-8' 
+    output.headers['X-Contact-Count'] = str(total)
+    output.headers['Vary'] = 'Accept-Encoding'
+    if codificacion:
+        output.headers['Content-Encoding'] = codificacion
     
-    return output
+    return cerrar_al_terminar(output)
+
+# Filas que se insertan por cada executemany durante la importación
+IMPORT_BATCH_SIZE = 5000
+
+# Bytes que se leen del cuerpo de /import por vez
+IMPORT_READ_SIZE = 64 * 1024
+
+# Máximo de errores detallados que se devuelven en el reporte de importación. El
+# resto solo se cuenta, para que el reporte de un archivo enorme no ocupe memoria.
+MAX_IMPORT_ERRORS = 1000
+
+# Políticas ante un contacto que ya existe: saltear la fila, actualizar el
+# contacto existente o cancelar toda la importación.
+IMPORT_CONFLICT_POLICIES = ('skip', 'upsert', 'fail')
+
+# Días que se recuerda una clave de idempotencia de /import
+IMPORT_KEYS_RETENTION_DAYS = int(os.environ.get('CONTACTS_IMPORT_KEYS_RETENTION_DAYS', 7))
+
+MAX_IDEMPOTENCY_KEY_LENGTH = 200
+
+UPSERT_CONTACTO_SQL = INSERT_CONTACTO_SQL + '''
+    ON CONFLICT(nombre) DO UPDATE SET telefono = excluded.telefono, direccion = excluded.direccion,
+                                      telefono_normalizado = excluded.telefono_normalizado
+'''
+
+# Clasifica un IntegrityError por su código extendido de SQLite. Desde la migración
+# 8 el nombre ya no es la clave primaria sino una columna UNIQUE, así que para
+# distinguirlo de los teléfonos se mira la columna que informa SQLite
+# ("UNIQUE constraint failed: contactos.nombre").
+def codigo_conflicto(error):
+    nombre_error = getattr(error, 'sqlite_errorname', '')
+    if nombre_error == 'SQLITE_CONSTRAINT_PRIMARYKEY':
+        return 'duplicate_name'
+    if nombre_error == 'SQLITE_CONSTRAINT_UNIQUE':
+        if str(error).endswith('contactos.nombre'):
+            return 'duplicate_name'
+        return 'duplicate_phone'
+    return 'constraint_error'
+
+# Acumula el resultado de una importación fila por fila
+class ImportReport:
+    def __init__(self, policy):
+        self.policy = policy
+        self.imported = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self.errors_truncated = False
+        self.aborted = False
+
+    def _report(self, line, code, message, nombre):
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'line': line, 'nombre': nombre, 'code': code, 'message': message})
+        else:
+            self.errors_truncated = True
+
+    def add_error(self, line, code, message, nombre=None):
+        self.failed += 1
+        self._report(line, code, message, nombre)
+
+    def add_conflict(self, line, nombre, telefono, error):
+        code = codigo_conflicto(error)
+        if code == 'duplicate_name':
+            message = f"El contacto '{nombre}' ya existe."
+        elif code == 'duplicate_phone':
+            message = f"El teléfono '{telefono}' ya existe para otro contacto."
+        else:
+            message = f"Error al importar el contacto '{nombre}': {error}"
+        # Con la política 'skip' un nombre repetido no es un error: la fila se
+        # saltea y solo queda registrada en el reporte.
+        if self.policy == 'skip' and code == 'duplicate_name':
+            self.skipped += 1
+            self._report(line, code, message, nombre)
+        else:
+            self.add_error(line, code, message, nombre)
+
+    def to_dict(self):
+        return {
+            'policy': self.policy,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'aborted': self.aborted,
+            'errors': self.errors,
+            'errors_truncated': self.errors_truncated,
+        }
+
+    def summary(self):
+        if self.aborted:
+            return f"La importación se canceló por errores; no se importó ningún contacto ({self.failed} errores)."
+        if self.failed:
+            return f"Se importaron {self.imported} contactos. Ocurrieron {self.failed} errores en la importación."
+        if self.skipped:
+            return f'Se importaron {self.imported} contactos. Se omitieron {self.skipped} contactos que ya existían.'
+        return f'Se importaron {self.imported} contactos exitosamente.'
+
+# Decodifica el cuerpo de /import por bloques de líneas completas (un carácter
+# UTF-8 de varios bytes nunca incluye los bytes de fin de línea) y entrega las
+# líneas para csv.reader. Si un bloque no es UTF-8 válido, entrega antes las líneas
+# completas anteriores al byte inválido: así reader.line_num + 1 es su línea.
+def lineas_utf8(stream):
+    resto = b''
+    primero = True
+    while True:
+        bloque = stream.read(IMPORT_READ_SIZE)
+        datos = resto + bloque
+        resto = b''
+        if bloque:
+            # Un \r al final puede ser la mitad de un \r\n: queda para el próximo bloque
+            corte = max(datos.rfind(b'\n'), datos.rfind(b'\r', 0, len(datos) - 1)) + 1
+            datos, resto = datos[:corte], datos[corte:]
+        if primero and datos:
+            datos = datos.removeprefix(codecs.BOM_UTF8)
+            primero = False
+        try:
+            texto = datos.decode('utf-8')
+        except UnicodeDecodeError as e:
+            inicio = max(datos.rfind(b'\n', 0, e.start), datos.rfind(b'\r', 0, e.start)) + 1
+            yield from io.StringIO(datos[:inicio].decode('utf-8'), newline='')
+            raise
+        yield from io.StringIO(texto, newline='')
+        if not bloque:
+            return
+
+# Inserta un lote con executemany dentro de un savepoint. Si alguna fila viola una
+# restricción se deshace solo el lote y se reintenta fila por fila para saber cuáles
+# fallaron. Devuelve False si la política es 'fail' y hubo un conflicto.
+def insertar_lote(cursor, sql, lote, report):
+    cursor.execute('SAVEPOINT lote_importacion')
+    try:
+        cursor.executemany(sql, [fila for _, fila in lote])
+        cursor.execute('RELEASE lote_importacion')
+        report.imported += len(lote)
+        return True
+    except sqlite3.IntegrityError:
+        cursor.execute('ROLLBACK TO lote_importacion')
+        cursor.execute('RELEASE lote_importacion')
+
+    for line, fila in lote:
+        try:
+            cursor.execute(sql, fila)
+            report.imported += 1
+        except sqlite3.IntegrityError as e:
+            report.add_conflict(line, fila[0], fila[1], e)
+            if report.policy == 'fail':
+                return False
+    return True
 
 @app.route('/import', methods=['POST'])
 def import_contacts():
-    if 'text/csv' not in request.headers['Content-Type']:
+    if 'text/csv' not in request.headers.get('Content-Type', ''):
         return jsonify({'error': 'Tipo de contenido no soportado. Se espera text/csv'}), 415
 
-    csv_data = request.data.decode('utf-8')
-    si = io.StringIO(csv_data)
-    reader = csv.reader(si)
+    policy = request.args.get('on_conflict', 'skip')
+    if policy not in IMPORT_CONFLICT_POLICIES:
+        return jsonify({'error': f'Política de conflicto no válida. Opciones: {", ".join(IMPORT_CONFLICT_POLICIES)}'}), 400
+    clave = request.headers.get('Idempotency-Key')
+    if clave is not None and not 0 < len(clave) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({'error': f'La cabecera Idempotency-Key debe tener entre 1 y {MAX_IDEMPOTENCY_KEY_LENGTH} caracteres.'}), 400
+
+    # El cuerpo se lee y se decodifica a medida que avanza el csv.reader, sin
+    # cargar el archivo completo en memoria.
+    reader = csv.reader(lineas_utf8(request.stream))
     
     try:
         header = next(reader)
@@ -190,38 +2696,186 @@ def import_contacts():
             return jsonify({'error': 'La cabecera del archivo CSV no es válida. Se esperaba: nombre,telefono,direccion'}), 400
     except StopIteration:
         return jsonify({'error': 'El archivo CSV está vacío.'}), 400
-        
-    imported_count = 0
-    errors = []
+    except UnicodeDecodeError:
+        return jsonify({'error': 'El archivo CSV no está codificado en UTF-8.'}), 400
 
+    report = ImportReport(policy)
+    sql = UPSERT_CONTACTO_SQL if policy == 'upsert' else INSERT_CONTACTO_SQL
+
+    agenda = agenda_actual()
     conn = get_db_connection()
     cursor = conn.cursor()
-    
-    for row in reader:
-        try:
-            nombre, telefono, direccion = row
-            cursor.execute("INSERT INTO contactos (nombre, telefono, direccion) VALUES (?, ?, ?)",
-                           (nombre.strip(), telefono.strip(), direccion.strip()))
-            imported_count += 1
-        except sqlite3.IntegrityError as e:
-            if "UNIQUE constraint failed: contactos.nombre" in str(e):
-                errors.append(f"Error: El contacto '{nombre}' ya existe.")
-            elif "UNIQUE constraint failed: contactos.telefono" in str(e):
-                errors.append(f"Error: El teléfono '{telefono}' ya existe para otro contacto.")
+    cursor.execute('BEGIN IMMEDIATE')  # ver batch_contacts
+    # Una parte ya importada con la misma clave no se vuelve a aplicar: se devuelve
+    # el reporte guardado. El bloqueo de escritura evita que dos reenvíos se crucen.
+    if clave is not None and agenda.importaciones_idempotentes:
+        cursor.execute('SELECT estado, resultado FROM importaciones WHERE clave = ?', (clave,))
+        fila = cursor.fetchone()
+        if fila is not None:
+            conn.rollback()
+            respuesta = Response(fila[1], status=fila[0], mimetype='application/json')
+            respuesta.headers['Idempotent-Replayed'] = 'true'
+            return respuesta
+    if agenda.fts_disponible:
+        cursor.execute('SELECT COALESCE(MAX(rowid), 0) FROM contactos')
+        ultimo_rowid = cursor.fetchone()[0]
+        cursor.execute('INSERT INTO contactos_fts_pausa (activa) VALUES (1)')
+
+    lote = []
+    error_lectura = None
+    try:
+        for row in reader:
+            line = reader.line_num
+            if len(row) != 3:
+                report.add_error(line, 'invalid_format',
+                                 f"La fila '{row}' no tiene el formato correcto (debe tener 3 columnas).")
             else:
-                errors.append(f"Error desconocido al importar el contacto '{nombre}': {e}")
-        except ValueError:
-            errors.append(f"Error: La fila '{row}' no tiene el formato correcto (debe tener 3 columnas).")
+                fila = tuple(campo.strip() for campo in row)
+                if not all(fila):
+                    report.add_error(line, 'missing_fields', 'Todos los campos son obligatorios.', fila[0] or None)
+                else:
+                    telefono_normalizado = normalizar_telefono(fila[1])
+                    if telefono_normalizado is None:
+                        report.add_error(line, 'invalid_phone', MENSAJE_TELEFONO_INVALIDO, fila[0])
+                    else:
+                        lote.append((line, fila + (telefono_normalizado,)))
+            if policy == 'fail' and report.failed:
+                break
+            if len(lote) >= IMPORT_BATCH_SIZE:
+                if not insertar_lote(cursor, sql, lote, report):
+                    break
+                lote = []
+    except UnicodeDecodeError:
+        error_lectura = (reader.line_num + 1, 'invalid_encoding', 'El archivo CSV no está codificado en UTF-8.')
+    except csv.Error as e:
+        error_lectura = (reader.line_num, 'invalid_format', f'El archivo CSV no es válido: {e}')
 
-    conn.commit()
-    conn.close()
-    
-    if errors:
-        error_message = f"Se importaron {imported_count} contactos. Ocurrieron errores en la importación:\n" + "\n".join(errors)
-        return jsonify({'error': error_message}), 400
+    # Las filas válidas anteriores a un error de lectura también se insertan
+    # (salvo que la importación ya se vaya a cancelar)
+    if lote and not (policy == 'fail' and report.failed):
+        insertar_lote(cursor, sql, lote, report)
+    if error_lectura is not None:
+        report.add_error(*error_lectura)
+
+    if policy == 'fail' and report.failed:
+        conn.rollback()
+        report.aborted = True
+        report.imported = 0
+
+    resultado = report.to_dict()
+    resultado['error' if report.failed else 'message'] = report.summary()
+    estado = 400 if report.failed else 200
+
+    if not report.aborted:
+        if agenda.fts_disponible:
+            indexar_contactos_desde(cursor, ultimo_rowid)
+            cursor.execute('DELETE FROM contactos_fts_pausa')
+        actualizar_indice_aproximado(cursor)
+        if clave is not None and agenda.importaciones_idempotentes:
+            cursor.execute("DELETE FROM importaciones WHERE creada < datetime('now', ?)",
+                           (f'-{IMPORT_KEYS_RETENTION_DAYS} days',))
+            cursor.execute("INSERT INTO importaciones (clave, estado, resultado, creada) VALUES (?, ?, ?, datetime('now'))",
+                           (clave, estado, json.dumps(resultado, ensure_ascii=False)))
+        conn.commit()
+        cache_busquedas.invalidate()
+
+    return jsonify(resultado), estado
+
+# Rutas que trabajan sobre una agenda: además de la ruta original (agenda
+# principal) se atienden bajo /books/<book>/ con la misma vista (ver abrir_agenda).
+RUTAS_POR_AGENDA = ('/contacts', '/contacts/changes', '/contacts/<nombre>', '/contacts/batch',
+                    '/export', '/import', '/stats/migrations', '/stats/pool', '/stats/snapshot')
+
+for regla in list(app.url_map.iter_rules()):
+    if regla.rule in RUTAS_POR_AGENDA:
+        app.add_url_rule(f'/books/<book>{regla.rule}', endpoint=f'book_{regla.endpoint}',
+                         view_func=app.view_functions[regla.endpoint], methods=regla.methods)
+
+# Modo multi-hilo con waitress: funciona en cualquier sistema operativo
+def run_waitress(host, port, threads):
+    global _detener_servidor
+    from waitress import create_server, wasyncore
+
+    server = create_server(app, host=host, port=port, threads=threads)
+
+    # El cierre se ejecuta dentro del bucle principal de waitress (pull_trigger):
+    # espera a que terminen los pedidos en curso y después cierra todos los
+    # sockets, con lo que server.run() termina.
+    def cerrar():
+        server.task_dispatcher.shutdown()
+        wasyncore.close_all(server._map)
+
+    _detener_servidor = lambda: server.trigger.pull_trigger(cerrar)
+    print(f"Servidor escuchando en http://{host}:{port} (waitress, {threads} hilos)")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.close()
+
+# Modo multi-proceso con gunicorn (solo Linux/macOS): varios procesos, cada uno con
+# sus hilos, para aprovechar todos los núcleos.
+def run_gunicorn(host, port, workers, threads):
+    global _detener_servidor
+    from gunicorn.app.base import BaseApplication
+
+    class GunicornApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('graceful_timeout', 30)
+
+        def load(self):
+            return app
+
+    # Cada proceso worker pide al proceso principal un apagado ordenado (SIGTERM)
+    _detener_servidor = lambda: os.kill(os.getppid(), signal.SIGTERM)
+    GunicornApplication().run()
+
+# Servidor de desarrollo de Werkzeug, solo para depurar
+def run_dev(host, port, debug):
+    global _detener_servidor
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, app, threaded=True)
+    _detener_servidor = lambda: threading.Thread(target=server.shutdown).start()
+    print(f"Servidor de desarrollo escuchando en http://{host}:{port}")
+    app.debug = debug
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# Punto de entrada del servidor. Con server='auto' se usa gunicorn si se piden
+# varios procesos y está disponible, y waitress en cualquier otro caso.
+def run_server(host='127.0.0.1', port=5000, workers=1, threads=8, server='auto', debug=False):
+    if server == 'auto':
+        server = 'waitress'
+        if workers > 1:
+            if importlib.util.find_spec('gunicorn') is not None:
+                server = 'gunicorn'
+            else:
+                print("gunicorn no está disponible en este sistema; se usará waitress con un solo proceso.")
+
+    init_db(en_otro_proceso=server == 'gunicorn')
+    if server == 'gunicorn':
+        run_gunicorn(host, port, workers, threads)
+    elif server == 'dev':
+        run_dev(host, port, debug)
     else:
-        return jsonify({'message': f'Se importaron {imported_count} contactos exitosamente.'})
+        run_waitress(host, port, threads)
 
 if __name__ == '__main__':
-    init_db()
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Servidor de la agenda de contactos')
+    parser.add_argument('--host', default=os.environ.get('CONTACTS_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CONTACTS_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CONTACTS_WORKERS', 1)),
+                        help='cantidad de procesos (más de uno requiere gunicorn)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('CONTACTS_THREADS', 8)),
+                        help='hilos por proceso')
+    parser.add_argument('--server', choices=('auto', 'waitress', 'gunicorn', 'dev'),
+                        default=os.environ.get('CONTACTS_SERVER', 'auto'))
+    parser.add_argument('--debug', action='store_true', help='activa el depurador (solo con --server dev)')
+    args = parser.parse_args()
+    run_server(args.host, args.port, args.workers, args.threads, args.server, args.debug)
\ No newline at end of file
@@ -0,0 +1,306 @@
+# test_servidor.py
+
+import sqlite3
+import time
+
+import pytest
+
+import servidor
+
+
+# Cliente de prueba de Flask sobre una agenda nueva en un directorio temporal
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    monkeypatch.setattr(servidor, 'DATABASE_PATH', str(tmp_path / 'contacts.db'))
+    monkeypatch.setattr(servidor, 'REPORTS_DATABASE_PATH', str(tmp_path / 'reports.db'))
+    monkeypatch.setattr(servidor, 'BOOKS_DIR', str(tmp_path / 'books'))
+    monkeypatch.setattr(servidor, 'agendas', servidor.RegistroAgendas(servidor.MAX_OPEN_BOOKS))
+    servidor.init_db(en_segundo_plano=False)
+    servidor.cache_busquedas.invalidate()
+    yield servidor.app.test_client()
+    servidor.agenda_principal().cerrar()
+    for libro in servidor.agendas.listar():
+        agenda = servidor.agendas.obtener(libro['name'])
+        if agenda.hilo_migraciones is not None:
+            agenda.hilo_migraciones.join()
+        agenda.cerrar()
+
+
+# Un teléfono numérico en el JSON se guarda como texto, como antes de normalizarlos
+def test_telefono_numerico(cliente):
+    respuesta = cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': 1155551234, 'direccion': 'Calle 1'})
+    assert respuesta.status_code == 201
+
+    respuesta = cliente.put('/contacts/Ana', json={'telefono': 1155559999})
+    assert respuesta.status_code == 200
+
+    respuesta = cliente.post('/contacts/batch', json={'operations': [
+        {'op': 'create', 'nombre': 'Beto', 'telefono': 1144440000, 'direccion': 'Calle 2'},
+        {'op': 'update', 'nombre': 'Beto', 'telefono': 1144441111},
+    ]})
+    assert [r['status'] for r in respuesta.get_json()['results']] == [201, 200]
+
+    contactos = {c['nombre']: c['telefono'] for c in cliente.get('/contacts').get_json()}
+    assert contactos == {'Ana': '1155559999', 'Beto': '1144441111'}
+
+
+# Cualquier otro tipo que no sea texto se rechaza con 400 en lugar de un error 500
+def test_telefono_de_tipo_invalido(cliente):
+    for telefono in ([1, 2], {'numero': 1}, 12.5, True):
+        respuesta = cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': telefono, 'direccion': 'Calle 1'})
+        assert respuesta.status_code == 400, telefono
+        assert respuesta.get_json()['error'] == servidor.MENSAJE_TELEFONO_TIPO
+
+
+# En /contacts/batch un campo de tipo inválido falla solo en su operación
+def test_batch_campos_de_tipo_invalido(cliente):
+    respuesta = cliente.post('/contacts/batch', json={'operations': [
+        {'op': 'create', 'nombre': ['Ana'], 'telefono': '111', 'direccion': 'Calle 1'},
+        {'op': 'create', 'nombre': 'Beto', 'telefono': '222', 'direccion': {'calle': 'Mitre'}},
+        {'op': 'create', 'nombre': 'Caro', 'telefono': ['333'], 'direccion': 'Calle 3'},
+        {'op': 'delete', 'nombre': 7},
+        {'op': 'create', 'nombre': 'Dani', 'telefono': '444', 'direccion': 'Calle 4'},
+    ]})
+    assert respuesta.status_code == 200
+    assert [r['status'] for r in respuesta.get_json()['results']] == [400, 400, 400, 400, 201]
+    assert [c['nombre'] for c in cliente.get('/contacts').get_json()] == ['Dani']
+
+
+# POST y PUT validan los tipos igual que /contacts/batch: 400 en lugar de un error 500
+def test_campos_de_tipo_invalido(cliente):
+    for cuerpo in ({'nombre': ['Ana'], 'telefono': '111', 'direccion': 'Calle 1'},
+                   {'nombre': 'Ana', 'telefono': '111', 'direccion': {'calle': 'Mitre'}},
+                   {'nombre': 'Ana', 'telefono': '111', 'direccion': []}):
+        respuesta = cliente.post('/contacts', json=cuerpo)
+        assert respuesta.status_code == 400, cuerpo
+    assert cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': '111', 'direccion': 'Calle 1'}).status_code == 201
+
+    for cuerpo in ({'direccion': ['Calle 2']}, {'telefono': '222', 'direccion': 5}, {'telefono': {'n': 1}}):
+        respuesta = cliente.put('/contacts/Ana', json=cuerpo)
+        assert respuesta.status_code == 400, cuerpo
+    assert cliente.get('/contacts').get_json()[0]['direccion'] == 'Calle 1'
+
+
+# La cabecera del formato de exposición de Prometheus se envía tal cual
+def test_metrics_content_type(cliente):
+    respuesta = cliente.get('/metrics')
+    assert respuesta.status_code == 200
+    assert respuesta.headers['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Una migración que cambia las respuestas (la 11 agrega version) invalida los
+# ETag de antes aunque la revisión de los contactos no cambie
+def test_etag_cambia_con_el_esquema(cliente, monkeypatch, tmp_path):
+    migraciones = servidor.MIGRACIONES
+    monkeypatch.setattr(servidor, 'DATABASE_PATH', str(tmp_path / 'vieja.db'))
+    monkeypatch.setattr(servidor, 'MIGRACIONES', migraciones[:10])
+    servidor.init_db(en_segundo_plano=False)
+    cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': '111', 'direccion': 'Calle 1'})
+    antes = cliente.get('/contacts')
+    assert 'version' not in antes.get_json()[0]
+
+    monkeypatch.setattr(servidor, 'MIGRACIONES', migraciones)
+    servidor.init_db(en_segundo_plano=False)
+    despues = cliente.get('/contacts', headers={'If-None-Match': antes.headers['ETag']})
+    assert despues.status_code == 200
+    assert despues.get_json()[0]['version'] == 1
+    assert despues.headers['X-Revision'] == antes.headers['X-Revision']
+
+
+# PUT incrementa la versión una sola vez (en el UPDATE, no también en el trigger)
+# y devuelve la misma que queda guardada, con If-Match o sin él
+def test_put_devuelve_la_version_guardada(cliente):
+    cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': '111', 'direccion': 'Calle 1'})
+
+    respuesta = cliente.put('/contacts/Ana', json={'direccion': 'Calle 2'})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['version'] == 2
+
+    respuesta = cliente.put('/contacts/Ana', json={'direccion': 'Calle 3'}, headers={'If-Match': '"2"'})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['version'] == 3
+
+    respuesta = cliente.put('/contacts/Ana', json={'direccion': 'Calle 4'}, headers={'If-Match': '"2"'})
+    assert respuesta.status_code == 412
+
+    respuesta = cliente.post('/contacts/batch', json={'operations': [
+        {'op': 'update', 'nombre': 'Ana', 'telefono': '222'},
+    ]})
+    assert respuesta.get_json()['results'][0]['status'] == 200
+    assert cliente.get('/contacts').get_json()[0]['version'] == 4
+
+
+# Base anterior al registro de migraciones, solo con la tabla original
+def crear_base_anterior(ruta, cantidad):
+    conn = sqlite3.connect(ruta)
+    conn.execute('CREATE TABLE contactos (nombre TEXT PRIMARY KEY, telefono TEXT NOT NULL UNIQUE, direccion TEXT NOT NULL)')
+    conn.executemany('INSERT INTO contactos VALUES (?, ?, ?)',
+                     [(f'Persona {i}', f'11{i:08d}', f'Calle {i}') for i in range(cantidad)])
+    conn.commit()
+    conn.close()
+
+
+# En una base con contactos el índice de búsqueda se llena en la migración 13 (por
+# lotes); hasta entonces se busca con LIKE y las escrituras se indexan igual
+def test_indice_busqueda_por_lotes(cliente, monkeypatch, tmp_path):
+    ruta = str(tmp_path / 'anterior.db')
+    crear_base_anterior(ruta, 120)
+    migraciones = servidor.MIGRACIONES
+    monkeypatch.setattr(servidor, 'DATABASE_PATH', ruta)
+    monkeypatch.setattr(servidor, 'MIGRATION_BATCH_SIZE', 50)
+    monkeypatch.setattr(servidor, 'MIGRACIONES', migraciones[:12])
+    servidor.init_db(en_segundo_plano=False)
+    assert not servidor.agenda_principal().fts_disponible
+    assert [c['nombre'] for c in cliente.get('/contacts', query_string={'query': 'Persona 117'}).get_json()] == ['Persona 117']
+    cliente.post('/contacts', json={'nombre': 'Zulema', 'telefono': '999', 'direccion': 'Calle Nueva'})
+    cliente.put('/contacts/Persona 3', json={'direccion': 'Calle Cambiada'})
+
+    monkeypatch.setattr(servidor, 'MIGRACIONES', migraciones)
+    servidor.init_db(en_segundo_plano=False)
+    assert servidor.agenda_principal().fts_disponible
+    for termino, nombres in (('Zulema', ['Zulema']), ('Cambiada', ['Persona 3']), ('Persona 117', ['Persona 117'])):
+        assert [c['nombre'] for c in cliente.get('/contacts', query_string={'query': termino}).get_json()] == nombres
+    conn = sqlite3.connect(ruta)
+    assert conn.execute('SELECT COUNT(*) FROM contactos_fts').fetchone()[0] == 121
+    conn.close()
+
+
+# Un byte que no es UTF-8 corta la importación en su línea: las filas válidas
+# anteriores (aunque no llenen un lote) se importan y el error dice la línea real
+def test_importacion_con_byte_invalido(cliente):
+    filas = ''.join(f'Persona {i},11{i:08d},Calle {i}\r\n' for i in range(1000))
+    cuerpo = ('nombre,telefono,direccion\r\n' + filas).encode('utf-8') + b'Mal\xff,999,Calle\r\nOtra,888,Calle\r\n'
+    respuesta = cliente.post('/import', data=cuerpo, content_type='text/csv')
+    reporte = respuesta.get_json()
+    assert (reporte['imported'], reporte['failed']) == (1000, 1)
+    assert reporte['errors'][0]['line'] == 1002
+    assert reporte['errors'][0]['code'] == 'invalid_encoding'
+    assert len(cliente.get('/contacts', query_string={'limit': 2000}).get_json()['contacts']) == 1000
+
+
+# Espera hasta unos segundos a que se cumpla una condición (hilos en segundo plano)
+def esperar(condicion, segundos=5):
+    limite = time.monotonic() + segundos
+    while not condicion():
+        assert time.monotonic() < limite, 'la condición no se cumplió a tiempo'
+        time.sleep(0.02)
+
+
+def nombres(respuesta):
+    return [c['nombre'] for c in respuesta.get_json()]
+
+
+# Migración 8 (reconstrucción de contactos con id entero) sobre una base anterior,
+# con escrituras entre sus lotes: las copian los triggers, los lotes no las pisan y
+# cada contacto conserva como id su rowid anterior
+def test_migracion_identificador_con_escrituras(cliente, monkeypatch, tmp_path):
+    ruta = str(tmp_path / 'anterior.db')
+    crear_base_anterior(ruta, 50)
+    migraciones = servidor.MIGRACIONES
+    monkeypatch.setattr(servidor, 'DATABASE_PATH', ruta)
+    monkeypatch.setattr(servidor, 'MIGRATION_BATCH_SIZE', 10)
+    monkeypatch.setattr(servidor, 'MIGRACIONES', migraciones[:7])
+    servidor.init_db(en_segundo_plano=False)
+
+    escrituras = [
+        lambda: cliente.put('/contacts/Persona 45', json={'direccion': 'Sin copiar'}),
+        lambda: cliente.delete('/contacts/Persona 40'),
+        lambda: cliente.put('/contacts/Persona 2', json={'telefono': '123'}),  # ya copiado
+        lambda: cliente.delete('/contacts/Persona 5'),
+        lambda: cliente.post('/contacts', json={'nombre': 'Nuevo', 'telefono': '999', 'direccion': 'Calle Nueva'}),
+    ]
+    conn = servidor.conectar_para_migrar(ruta)
+    progreso = None
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        progreso = servidor.migracion_identificador_entero(conn.cursor(), progreso)
+        conn.execute('COMMIT')
+        if progreso is None:
+            break
+        if escrituras:
+            assert escrituras.pop(0)().status_code < 300
+    assert not escrituras
+
+    esperado = {f'Persona {i}': (i + 1, f'11{i:08d}', f'Calle {i}') for i in range(50)}
+    esperado['Persona 45'] = (46, '1100000045', 'Sin copiar')
+    esperado['Persona 2'] = (3, '123', 'Calle 2')
+    del esperado['Persona 40'], esperado['Persona 5']
+    esperado['Nuevo'] = (51, '999', 'Calle Nueva')
+    filas = conn.execute('SELECT nombre, id, telefono, direccion FROM contactos').fetchall()
+    assert {nombre: tuple(resto) for nombre, *resto in filas} == esperado
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'contactos_copia%' "
+                        "OR name = 'contactos_nueva'").fetchall() == []
+    conn.close()
+
+    # El resto de las migraciones (y los triggers recreados) funcionan sobre la tabla nueva
+    monkeypatch.setattr(servidor, 'MIGRACIONES', migraciones)
+    servidor.init_db(en_segundo_plano=False)
+    assert nombres(cliente.get('/contacts', query_string={'query': 'Calle Nueva'})) == ['Nuevo']
+    assert cliente.put('/contacts/Nuevo', json={'direccion': 'Otra'}).get_json()['version'] == 2
+
+
+# Políticas de /import ante contactos que ya existen, y reenvío con la misma clave
+def test_importacion_politicas_de_conflicto(cliente):
+    def importar(politica, filas, **cabeceras):
+        return cliente.post('/import', query_string={'on_conflict': politica}, headers=cabeceras,
+                            data=('nombre,telefono,direccion\n' + filas).encode(), content_type='text/csv')
+
+    def contactos():
+        return {c['nombre']: c['telefono'] for c in cliente.get('/contacts').get_json()}
+
+    cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': '111', 'direccion': 'Calle 1'})
+
+    reporte = importar('skip', 'Ana,222,Calle Nueva\nBeto,333,Calle 3\n').get_json()
+    assert (reporte['imported'], reporte['skipped'], reporte['failed']) == (1, 1, 0)
+    assert contactos() == {'Ana': '111', 'Beto': '333'}
+
+    reporte = importar('upsert', 'Ana,222,Calle Nueva\nCaro,444,Calle 4\n').get_json()
+    assert (reporte['imported'], reporte['failed']) == (2, 0)
+    assert contactos() == {'Ana': '222', 'Beto': '333', 'Caro': '444'}
+
+    respuesta = importar('fail', 'Dani,555,Calle 5\nAna,666,Calle 6\n')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['aborted'] and respuesta.get_json()['imported'] == 0
+    assert contactos() == {'Ana': '222', 'Beto': '333', 'Caro': '444'}
+
+    assert importar('skip', 'Eva,777,Calle 7\n', **{'Idempotency-Key': 'parte-1'}).get_json()['imported'] == 1
+    cliente.delete('/contacts/Eva')
+    respuesta = importar('skip', 'Eva,777,Calle 7\n', **{'Idempotency-Key': 'parte-1'})
+    assert respuesta.headers['Idempotent-Replayed'] == 'true'
+    assert respuesta.get_json()['imported'] == 1
+    assert 'Eva' not in contactos()
+
+
+# Cada agenda con nombre es un archivo aparte bajo BOOKS_DIR, que se crea con la
+# primera escritura; sus contactos no se mezclan con los de la principal
+def test_agendas_con_nombre(cliente, tmp_path):
+    assert cliente.get('/books/trabajo/contacts').status_code == 404
+    assert cliente.post('/books/Trabajo/contacts', json={'nombre': 'Ana', 'telefono': '1', 'direccion': 'X'}).status_code == 400
+
+    assert cliente.post('/books/trabajo/contacts', json={'nombre': 'Ana', 'telefono': '111', 'direccion': 'Calle 1'}).status_code == 201
+    assert cliente.post('/contacts', json={'nombre': 'Beto', 'telefono': '111', 'direccion': 'Calle 2'}).status_code == 201
+    assert cliente.put('/books/trabajo/contacts/Ana', json={'direccion': 'Calle 3'}).status_code == 200
+
+    assert nombres(cliente.get('/books/trabajo/contacts')) == ['Ana']
+    assert nombres(cliente.get('/contacts')) == ['Beto']
+    assert cliente.get('/books/trabajo/contacts').get_json()[0]['direccion'] == 'Calle 3'
+    assert [b['name'] for b in cliente.get('/books').get_json()['books']] == ['trabajo']
+    assert (tmp_path / 'books' / 'trabajo.db').exists()
+
+
+# Con CONTACTS_SNAPSHOT_MAX_AGE los GET se leen de una copia de la agenda, que se
+# renueva cuando cambian los contactos
+def test_instantaneas(cliente, monkeypatch):
+    monkeypatch.setattr(servidor, 'SNAPSHOT_MAX_AGE', 0.4)
+    agenda = servidor.agenda_principal()
+    cliente.post('/contacts', json={'nombre': 'Ana', 'telefono': '111', 'direccion': 'Calle 1'})
+    cliente.get('/contacts')
+    esperar(lambda: agenda.instantanea is not None)
+
+    respuesta = cliente.get('/contacts')
+    assert 'X-Snapshot-Age' in respuesta.headers
+    assert nombres(respuesta) == ['Ana']
+
+    cliente.post('/contacts', json={'nombre': 'Beto', 'telefono': '222', 'direccion': 'Calle 2'})
+    esperar(lambda: nombres(cliente.get('/contacts')) == ['Ana', 'Beto'])
+    assert cliente.get('/stats/snapshot').get_json()['snapshots_created'] >= 2